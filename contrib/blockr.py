@@ -2,33 +2,29 @@
 # -*- coding: utf-8 -*-
 
 
+import asyncio
 import json
+
 import boto3
 
 import click
 
 import requests
+
+from dpds.http_client import AsyncDPayAPIClient
+from dpds.storages.db.scripts.account_names import collect_account_names
+
 Session = requests.Session()
 
 
+async def _get_account_names(url):
+    async with AsyncDPayAPIClient(url) as client:
+        return await collect_account_names(client)
+
+
 def get_account_names(url):
-    lower_bound_name  = 'a'
-    limit = 1000
-    accts = list()
-    try:
-        while True:
-            resp = Session.post(url,json={'id':1,'jsonrpc':'2.0','method':'lookup_accounts','params':[lower_bound_name, limit]})
-            accounts_in_resp = resp.json()['result']
-            accts.extend(accounts_in_resp)
-            if lower_bound_name == accounts_in_resp[-1]:
-                break
-            lower_bound_name = accounts_in_resp[-1]
-    except Exception as e:
-            print(e)
-    valid_accounts = (a for a in accts if a not in ('',None))
-    uniq_accounts = set(valid_accounts)
-    sorted_accounts = sorted(list(uniq_accounts))
-    return sorted_accounts
+    loop = asyncio.get_event_loop()
+    return loop.run_until_complete(_get_account_names(url))
 
 
 def put_json(s3_resource, bucket, key, data):
@@ -1,15 +1,34 @@
 # -*- coding: utf-8 -*-
-import concurrent.futures
+import asyncio
+import itertools as it
 import json
+import random
 
 import click
+from aiohttp import web
 
 import structlog
+from dpds.chain.fixtures import CORPUS_FORMATS
+from dpds.chain.fixtures import DEFAULT_RECORD_BATCH_SIZE
+from dpds.chain.fixtures import DEFAULT_RECORD_REQUESTS
+from dpds.chain.fixtures import FixtureServer
+from dpds.chain.fixtures import open_corpus
+from dpds.chain.fixtures import record_blocks
+from dpds.http_client import AsyncDPayAPIClient
+from dpds.http_client import RPCConnectionError
+from dpds.http_client import RPCError
 from dpds.http_client import SimpleDPayAPIClient
+from dpds.response_cache import DEFAULT_MAX_BYTES as DEFAULT_RPC_CACHE_MAX_BYTES
+from dpds.response_cache import ResponseCache
+from dpds.storages.db.scripts.fetch_control import DEFAULT_RPC_RETRIES
+from dpds.utils import backoff_delay
 from dpds.utils import chunkify
 
 logger = structlog.get_logger(__name__)
 
+# get-blocks batches in flight when --max_workers is omitted
+DEFAULT_GET_BLOCKS_REQUESTS = 4
+
 
 @click.group()
 def chain():
@@ -59,28 +78,64 @@ def stream_blocks(url, block_nums, start, end):
     2. ENV var "BLOCKS_OUT" if provided
     3. Default: STDOUT
     """
-    # Setup dpayd source
-    rpc = SimpleDPayAPIClient(url)
-    with click.open_file('-', 'w', encoding='utf8') as f:
-        if block_nums:
-            block_nums = json.load(block_nums)
-            blocks = _stream_blocks(rpc, block_nums)
-        elif start and end:
-            blocks = _stream_blocks(rpc, range(start, end))
-        else:
-            blocks = rpc.stream(start)
+    if block_nums:
+        block_nums = json.load(block_nums)
 
-        json_blocks = map(json.dumps, blocks)
+    async def _stream():
+        # Setup dpayd source
+        async with AsyncDPayAPIClient(url) as rpc:
+            with click.open_file('-', 'w', encoding='utf8') as f:
+                if block_nums:
+                    blocks = _stream_blocks(rpc, block_nums)
+                elif start and end:
+                    blocks = _stream_blocks(rpc, range(start, end))
+                else:
+                    blocks = rpc.stream(start)
 
-        for block in json_blocks:
-            click.echo(block, file=f)
+                async for block in blocks:
+                    click.echo(json.dumps(block), file=f)
 
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(_stream())
 
-def _stream_blocks(rpc, block_nums):
-    for block in map(rpc.get_block, block_nums):
+
+async def _stream_blocks(rpc, block_nums, retries=DEFAULT_RPC_RETRIES):
+    for block_num in block_nums:
+        block, = await _batch_with_retries(
+            rpc, [('get_block', block_num)], retries=retries)
+        if isinstance(block, Exception):
+            raise block
         yield block
 
 
+async def _batch_with_retries(rpc, calls, retries=DEFAULT_RPC_RETRIES):
+    """Results of a JSON-RPC batch of calls in call order
+
+    Failed calls back off with jitter and are retried at most retries
+    times, after which their error takes their place in the results.
+    """
+    calls = list(calls)
+    results = [None] * len(calls)
+    pending = list(range(len(calls)))
+    for attempt in range(retries + 1):
+        if attempt:
+            await asyncio.sleep(backoff_delay(attempt))
+        try:
+            batch = await rpc.batch([calls[i] for i in pending],
+                                    return_exceptions=True)
+        except (RPCError, RPCConnectionError) as e:
+            batch = [e] * len(pending)
+        for i, result in zip(pending, batch):
+            results[i] = result
+        failed = [i for i in pending if isinstance(results[i], Exception)]
+        if not failed:
+            break
+        logger.warning('error getting blocks', attempt=attempt + 1,
+                       failed=len(failed), err=results[failed[0]])
+        pending = failed
+    return results
+
+
 @chain.command()
 @click.option(
     '--url',
@@ -102,49 +157,154 @@ def block_height(url):
     metavar='DPAYD_HTTP_URL',
     envvar='DPAYD_HTTP_URL',
     help='dpayd HTTP server URL')
-def get_blocks_fast(start, end, chunksize, max_workers, url):
+@click.option('--rpc_cache', type=click.Path(dir_okay=False), default=None,
+              envvar='DPDS_RPC_CACHE',
+              help='Cache irreversible blocks in this file, so later runs skip '
+                   'requesting them')
+@click.option('--rpc_cache_max_bytes', type=click.IntRange(min=1),
+              default=DEFAULT_RPC_CACHE_MAX_BYTES,
+              help='Evict the oldest cached blocks once the cache takes more '
+                   'than this many bytes')
+def get_blocks_fast(start, end, chunksize, max_workers, url, rpc_cache,
+                    rpc_cache_max_bytes):
     """Request blocks from dpayd in JSON format"""
+    cache = (ResponseCache(rpc_cache, max_bytes=rpc_cache_max_bytes)
+             if rpc_cache else None)
 
-    rpc = SimpleDPayAPIClient(url)
-    if end == 0:
-        end = rpc.last_irreversible_block_num()
-
-    with click.open_file('-', 'w', encoding='utf8') as f:
-        blocks = _get_blocks_fast(
-            start=start,
-            end=end,
-            chunksize=chunksize,
-            max_workers=max_workers,
-            rpc=rpc,
-            url=url)
-        json_blocks = map(json.dumps, blocks)
-        for block in json_blocks:
-            click.echo(block.encode('utf8'), file=f)
+    async def _get_blocks():
+        async with AsyncDPayAPIClient(url, cache=cache) as rpc:
+            _end = end or await rpc.last_irreversible_block_num()
+            with click.open_file('-', 'w', encoding='utf8') as f:
+                blocks = _get_blocks_fast(
+                    start=start,
+                    end=_end,
+                    chunksize=chunksize,
+                    max_workers=max_workers,
+                    rpc=rpc)
+                async for block in blocks:
+                    click.echo(json.dumps(block).encode('utf8'), file=f)
+
+    loop = asyncio.get_event_loop()
+    try:
+        loop.run_until_complete(_get_blocks())
+    finally:
+        if cache is not None:
+            cache.close()
 
 
 # pylint: disable=too-many-arguments
-def _get_blocks_fast(start=None,
-                     end=None,
-                     chunksize=None,
-                     max_workers=None,
-                     rpc=None,
-                     url=None):
+async def _get_blocks_fast(start=None,
+                           end=None,
+                           chunksize=None,
+                           max_workers=None,
+                           rpc=None):
+    """Yield blocks start through end - 1 in order
+
+    Blocks are requested chunksize to a JSON-RPC batch, with max_workers
+    batches in flight.
+    """
     extra = dict(
         start=start,
         end=end,
         chunksize=chunksize,
         max_workers=max_workers,
-        rpc=rpc,
-        url=url)
+        url=rpc.url)
     logger.debug('get_blocks_fast', extra=extra)
-    rpc = rpc or SimpleDPayAPIClient(url)
-    with concurrent.futures.ThreadPoolExecutor(
-            max_workers=max_workers) as executor:
-        for i, chunk in enumerate(
-                chunkify(range(start, end), chunksize=chunksize), 1):
-            logger.debug('get_block_fast loop', extra=dict(chunk_count=i))
-            for b in executor.map(rpc.get_block, chunk):
-                # dont yield anything when we encounter a null output
-                # from an HTTP 503 error
-                if b:
-                    yield b
+    chunks = chunkify(range(start, end), chunksize=chunksize)
+    for i, window in enumerate(
+            chunkify(chunks,
+                     chunksize=max_workers or DEFAULT_GET_BLOCKS_REQUESTS), 1):
+        logger.debug('get_block_fast loop', extra=dict(window_count=i))
+        batches = await asyncio.gather(*(
+            _batch_with_retries(
+                rpc, [('get_block', block_num) for block_num in chunk])
+            for chunk in window))
+        for b in it.chain.from_iterable(batches):
+            # dont yield anything when we encounter a null output
+            # or an error response left after retries
+            if b and not isinstance(b, Exception):
+                yield b
+
+
+@chain.command(name='record')
+@click.option(
+    '--url',
+    metavar='DPAYD_HTTP_URL',
+    envvar='DPAYD_HTTP_URL',
+    default='https://greatchain.dpays.io',
+    help='DPayd HTTP server URL')
+@click.option('--path', type=click.Path(file_okay=False), default='blocks_data',
+              help='Corpus to record into')
+@click.option('--format', 'corpus_format', type=click.Choice(CORPUS_FORMATS),
+              default='fs',
+              help='"fs" for a dpds fs store, "dir" for '
+                   '<path>/<method>/<block_num>.json files')
+@click.option('--start', type=click.IntRange(min=1), default=1)
+@click.option(
+    '--end', type=click.IntRange(min=0), default=0,
+    help='Last block_num to record, default is the last irreversible block')
+@click.option('--batch_size', type=click.IntRange(min=1),
+              default=DEFAULT_RECORD_BATCH_SIZE,
+              help='Blocks per JSON-RPC batch')
+@click.option('--max_requests', type=click.IntRange(min=1),
+              default=DEFAULT_RECORD_REQUESTS,
+              help='JSON-RPC batches in flight')
+@click.option('--skip_existing', type=click.BOOL, default=True)
+def record(url, path, corpus_format, start, end, batch_size, max_requests,
+           skip_existing):
+    """Record blocks and their ops into a corpus for serve-fixtures"""
+    corpus = open_corpus(path, corpus_format)
+
+    async def _record():
+        async with AsyncDPayAPIClient(url) as rpc:
+            _end = end or await rpc.last_irreversible_block_num()
+            recorded = await record_blocks(rpc, corpus, range(start, _end + 1),
+                                           batch_size=batch_size,
+                                           requests=max_requests,
+                                           skip_existing=skip_existing)
+            return _end, recorded
+
+    loop = asyncio.get_event_loop()
+    _end, recorded = loop.run_until_complete(_record())
+    logger.info(
+        'recorded blocks', start=start, end=_end, recorded=recorded, path=path)
+
+
+@chain.command(name='serve-fixtures')
+@click.option('--path', type=click.Path(exists=True, file_okay=False),
+              default='blocks_data', help='Corpus to serve')
+@click.option('--format', 'corpus_format', type=click.Choice(CORPUS_FORMATS),
+              default='fs',
+              help='"fs" for a dpds fs store, "dir" for '
+                   '<path>/<method>/<block_num>.json files')
+@click.option('--host', type=click.STRING, default='127.0.0.1')
+@click.option('--port', type=click.INT, default=8090)
+@click.option('--latency', type=click.FloatRange(min=0), default=0,
+              help='Seconds added to every HTTP request')
+@click.option('--jitter', type=click.FloatRange(min=0), default=0,
+              help='Up to this many more seconds added at random')
+@click.option('--error_rate', type=click.FloatRange(min=0, max=1), default=0,
+              help='Fraction of HTTP requests answered with a 503')
+@click.option(
+    '--rpc_error_rate', type=click.FloatRange(min=0, max=1), default=0,
+    help='Fraction of calls answered with a JSON-RPC error')
+@click.option('--seed', type=click.INT, default=None,
+              help='Seed for latency jitter and error injection')
+def serve_fixtures(path, corpus_format, host, port, latency, jitter, error_rate,
+                   rpc_error_rate, seed):
+    """Serve a recorded corpus as a stand-in dpayd JSON-RPC endpoint
+
+    \b
+    Answers get_block, get_ops_in_block and get_dynamic_global_properties,
+    singly or in batches. The last irreversible block is the highest
+    block in the corpus.
+    """
+    server = FixtureServer(open_corpus(path, corpus_format),
+                           latency=latency,
+                           jitter=jitter,
+                           error_rate=error_rate,
+                           rpc_error_rate=rpc_error_rate,
+                           rng=random.Random(seed))
+    logger.info('serving fixtures', path=path, url=f'http://{host}:{port}/',
+                last_irreversible_block_num=server.last_irreversible_block_num)
+    web.run_app(server.app(), host=host, port=port)
@@ -0,0 +1,280 @@
+# -*- coding: utf-8 -*-
+"""Record blocks into a corpus and replay them from a stand-in dpayd
+
+A corpus is either a ``dir`` corpus, with one JSON result per file in a
+directory named after the method, or a ``dpds fs`` store. ``dpds chain
+record`` writes ``<path>/get_block/<block_num>.json`` and
+``<path>/get_ops_in_block/<block_num>.json``. ``get_block`` results under
+other names, like those in ``tests/data/get_block``, are served as the
+block they hold.
+
+The server answers ``get_block``, ``get_ops_in_block`` and
+``get_dynamic_global_properties``, singly or in batches, splicing the
+recorded bytes into responses without decoding them, so it can outrun the
+ingest path it is used to benchmark. Only ``get_ops_in_block`` calls
+asking for virtual ops alone are decoded, to filter them.
+"""
+import asyncio
+import pathlib
+import random
+
+import rapidjson as json
+import structlog
+from aiohttp import web
+
+from dpds.dpds_json import dumps
+from dpds.storages.db.scripts.fetch_control import DEFAULT_RPC_RETRIES
+from dpds.storages.fs.cli import key
+from dpds.storages.fs.local import BLOCK_FILENAME
+from dpds.storages.fs.local import OPS_FILENAMES
+from dpds.storages.fs.local import FsBlockStore
+from dpds.utils import backoff_delay
+from dpds.utils import block_num_from_previous
+from dpds.utils import chunkify
+
+logger = structlog.get_logger(__name__)
+
+BLOCK_METHODS = ('get_block', 'get_ops_in_block')
+CORPUS_FORMATS = ('fs', 'dir')
+DEFAULT_RECORD_BATCH_SIZE = 50
+DEFAULT_RECORD_REQUESTS = 4
+
+# JSON-RPC error codes
+METHOD_NOT_FOUND = -32601
+INVALID_REQUEST = -32600
+SERVER_ERROR = -32000
+
+
+class DirCorpus(object):
+    """Corpus of ``<path>/<method>/<block_num>.json`` result files
+
+    Other ``get_block`` files are indexed by the block_num they hold or
+    follow from their ``previous``, and files which aren't blocks are
+    skipped. Blocks without a ``get_ops_in_block`` file have no operations.
+    """
+
+    def __init__(self, path):
+        self.path = pathlib.PosixPath(path)
+        self._named_blocks = None
+
+    def key(self, method, block_num):
+        return self.path / method / f'{block_num}.json'
+
+    def named_blocks(self):
+        """block_num to path of the get_block files not named by block_num"""
+        if self._named_blocks is None:
+            self._named_blocks = {}
+            for path in (self.path / 'get_block').glob('*.json'):
+                if path.stem.isdigit():
+                    continue
+                try:
+                    block = json.loads(path.read_bytes())
+                    block_num = (block.get('block_num')
+                                 or block_num_from_previous(block['previous']))
+                except (AttributeError, KeyError, TypeError, ValueError):
+                    continue
+                self._named_blocks[block_num] = path
+        return self._named_blocks
+
+    def has_block(self, block_num):
+        return (self.key('get_block', block_num).exists()
+                or block_num in self.named_blocks())
+
+    async def read(self, method, block_num):
+        try:
+            return self.key(method, block_num).read_bytes()
+        except OSError:
+            pass
+        if method == 'get_block' and block_num in self.named_blocks():
+            return self.named_blocks()[block_num].read_bytes()
+        if method == 'get_ops_in_block' and self.has_block(block_num):
+            return b'[]'
+        return None
+
+    def highest_block_num(self):
+        block_nums = [
+            int(p.stem) for p in (self.path / 'get_block').glob('*.json')
+            if p.stem.isdigit()]
+        return max(block_nums + list(self.named_blocks()), default=0)
+
+
+class FsCorpus(object):
+    """Corpus backed by a ``dpds fs`` block store"""
+
+    def __init__(self, path):
+        self.path = path
+        self.store = FsBlockStore(path)
+
+    def key(self, method, block_num):
+        filename = BLOCK_FILENAME if method == 'get_block' else OPS_FILENAMES[0]
+        return key(block_num, filename, self.path)
+
+    async def read(self, method, block_num):
+        path = self.store.block_dir(block_num)
+        try:
+            if method == 'get_block':
+                return await self.store.read(path / BLOCK_FILENAME)
+            return await self.store.read_ops(path)
+        except OSError:
+            return None
+
+    def highest_block_num(self):
+        return self.store.highest_block_num()
+
+
+def open_corpus(path, corpus_format='fs'):
+    if corpus_format == 'dir':
+        return DirCorpus(path)
+    if corpus_format == 'fs':
+        return FsCorpus(path)
+    raise ValueError(f'unknown corpus format {corpus_format}')
+
+
+def write_result(corpus, method, block_num, result):
+    path = corpus.key(method, block_num)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(dumps(result).encode())
+
+
+def jsonrpc_result(request_id, raw_result):
+    return b''.join((b'{"id":', json.dumps(request_id).encode(),
+                     b',"jsonrpc":"2.0","result":', raw_result, b'}'))
+
+
+def jsonrpc_error(request_id, code, message):
+    return json.dumps({'id': request_id,
+                       'jsonrpc': '2.0',
+                       'error': {'code': code, 'message': message}}).encode()
+
+
+class FixtureServer(object):
+    """JSON-RPC stand-in for dpayd answering from a corpus
+
+    Args:
+      corpus: `DirCorpus` or `FsCorpus`
+      latency: seconds added to every HTTP request
+      jitter: up to this many more seconds added at random
+      error_rate: fraction of HTTP requests answered with a 503
+      rpc_error_rate: fraction of calls answered with a JSON-RPC error
+    """
+
+    def __init__(self, corpus, latency=0, jitter=0, error_rate=0,
+                 rpc_error_rate=0, rng=None):
+        self.corpus = corpus
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rpc_error_rate = rpc_error_rate
+        self.rng = rng or random.Random()
+        self.last_irreversible_block_num = corpus.highest_block_num()
+
+    async def call(self, request):
+        request_id = request.get('id') if isinstance(request, dict) else None
+        if not isinstance(request, dict) or 'method' not in request:
+            return jsonrpc_error(request_id, INVALID_REQUEST, 'Invalid Request')
+        method = request['method']
+        params = request.get('params') or []
+        if self.rpc_error_rate and self.rng.random() < self.rpc_error_rate:
+            return jsonrpc_error(request_id, SERVER_ERROR, 'injected error')
+        if method == 'get_dynamic_global_properties':
+            block_num = self.last_irreversible_block_num
+            return jsonrpc_result(request_id, json.dumps({
+                'head_block_number': block_num,
+                'last_irreversible_block_num': block_num}).encode())
+        if method not in BLOCK_METHODS:
+            return jsonrpc_error(request_id, METHOD_NOT_FOUND,
+                                 f'unknown method {method}')
+        try:
+            block_num = int(params[0])
+        except (IndexError, TypeError, ValueError):
+            return jsonrpc_error(request_id, INVALID_REQUEST,
+                                 'missing block_num')
+        raw_result = await self.corpus.read(method, block_num)
+        if raw_result is None:
+            return jsonrpc_error(request_id, SERVER_ERROR,
+                                 f'block {block_num} not in corpus')
+        if method == 'get_ops_in_block' and len(params) > 1 and params[1]:
+            # only_virtual
+            raw_result = json.dumps([op for op in json.loads(raw_result)
+                                     if op.get('virtual_op')]).encode()
+        return jsonrpc_result(request_id, raw_result)
+
+    async def handle(self, aiohttp_request):
+        delay = self.latency + self.rng.uniform(0, self.jitter)
+        if delay:
+            await asyncio.sleep(delay)
+        if self.error_rate and self.rng.random() < self.error_rate:
+            raise web.HTTPServiceUnavailable()
+        try:
+            request = json.loads(await aiohttp_request.read())
+        except ValueError:
+            return self.response(jsonrpc_error(None, -32700, 'Parse error'))
+        if isinstance(request, list):
+            responses = await asyncio.gather(*(self.call(r) for r in request))
+            return self.response(b'[' + b','.join(responses) + b']')
+        return self.response(await self.call(request))
+
+    @staticmethod
+    def response(body):
+        return web.Response(body=body, content_type='application/json')
+
+    def app(self):
+        app = web.Application(client_max_size=1024 ** 3)
+        app.router.add_post('/', self.handle)
+        return app
+
+
+async def fetch_results(client, block_nums, retries=DEFAULT_RPC_RETRIES):
+    """(block_num, block, ops) for block_nums from one JSON-RPC batch
+
+    client is a `dpds.http_client.AsyncDPayAPIClient`.
+    """
+    calls = []
+    for block_num in block_nums:
+        calls.extend(
+            [('get_block', block_num), ('get_ops_in_block', block_num, False)])
+    for attempt in range(retries + 1):
+        if attempt:
+            await asyncio.sleep(backoff_delay(attempt))
+        try:
+            results = await client.batch(calls)
+            blocks_and_ops = list(zip(block_nums, results[::2], results[1::2]))
+            assert all(block is not None for _, block, _ in blocks_and_ops)
+            return blocks_and_ops
+        except Exception as e:
+            logger.warning('error fetching blocks to record',
+                           e=e, first=block_nums[0], last=block_nums[-1],
+                           attempt=attempt + 1)
+            if attempt == retries:
+                raise
+
+
+async def record_blocks(
+        client, corpus, block_nums, batch_size=DEFAULT_RECORD_BATCH_SIZE,
+        requests=DEFAULT_RECORD_REQUESTS, retries=DEFAULT_RPC_RETRIES,
+        skip_existing=True, pbar=None):
+    """Fetch blocks and their ops into corpus, returns how many were recorded"""
+    if skip_existing:
+        block_nums = [block_num for block_num in block_nums
+                      if not (corpus.key('get_block', block_num).exists()
+                              and corpus.key('get_ops_in_block',
+                                             block_num).exists())]
+    semaphore = asyncio.Semaphore(requests)
+    recorded = 0
+
+    async def record_batch(batch):
+        nonlocal recorded
+        async with semaphore:
+            blocks_and_ops = await fetch_results(client, batch, retries=retries)
+        for block_num, block, ops in blocks_and_ops:
+            # the block is written last so a partly recorded block counts as
+            # missing
+            write_result(corpus, 'get_ops_in_block', block_num, ops)
+            write_result(corpus, 'get_block', block_num, block)
+        recorded += len(blocks_and_ops)
+        if pbar:
+            pbar.update(len(blocks_and_ops))
+
+    await asyncio.gather(*(record_batch(batch)
+                           for batch in chunkify(block_nums, batch_size)))
+    return recorded
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+"""Routing between several dpayd endpoints
+
+Each endpoint keeps an EWMA of its request latency and error rate, and
+requests go to the endpoint with the lowest expected cost, its latency
+scaled by the requests it already has in flight and by its error rate.
+An endpoint failing failure_threshold requests in a row is ejected by
+opening its circuit breaker. Once open_seconds pass, the next request
+routed to it is a probe, which closes the breaker if it succeeds and
+reopens it if it fails.
+"""
+import os
+import threading
+import time
+
+import structlog
+
+logger = structlog.get_logger(__name__)
+
+DEFAULT_URL = 'https://api.dpays.io'
+# weight of the newest sample in the latency and error rate EWMAs
+DEFAULT_ALPHA = 0.2
+# latency assumed for an endpoint before its first response
+INITIAL_LATENCY = 0.1
+DEFAULT_FAILURE_THRESHOLD = 5
+DEFAULT_OPEN_SECONDS = 30.0
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+def parse_urls(urls=None):
+    """A list of endpoint urls from a list or a comma separated string
+
+    Falls back to the comma separated DPAYD_HTTP_URL environment variable.
+    """
+    urls = urls or os.environ.get('DPAYD_HTTP_URL', DEFAULT_URL)
+    if isinstance(urls, str):
+        urls = urls.split(',')
+    urls = [url.strip() for url in urls if url.strip()]
+    if not urls:
+        raise ValueError('no dpayd urls given')
+    return urls
+
+
+class Endpoint(object):
+    """A dpayd url with its latency and error rate EWMAs and breaker state"""
+
+    def __init__(self, url):
+        self.url = url
+        self.latency = INITIAL_LATENCY
+        self.error_rate = 0.0
+        self.in_flight = 0
+        self.consecutive_failures = 0
+        self.state = CLOSED
+        self.opened_at = None
+
+    @property
+    def cost(self):
+        return self.latency * (self.in_flight + 1) / max(
+            1.0 - self.error_rate, 0.01)
+
+    def __repr__(self):
+        return (
+            f'Endpoint({self.url!r}, state={self.state}, '
+            f'latency={self.latency:.3f}, '
+            f'error_rate={self.error_rate:.3f}, in_flight={self.in_flight})')
+
+
+class EndpointPool(object):
+    """Latency weighted routing with circuit breakers between dpayd endpoints
+
+    Safe to share between threads. Every `choose` must be followed by one
+    `record_success`, `record_failure` or `release` of the endpoint it
+    returned.
+
+    Args:
+      urls: endpoint urls, a list or a comma separated string
+      alpha: weight of the newest sample in the EWMAs
+      failure_threshold: failures in a row that open an endpoint's breaker
+      open_seconds: seconds an open breaker waits before a probe
+      clock: monotonic clock, for testing
+    """
+
+    def __init__(self, urls=None, alpha=DEFAULT_ALPHA,
+                 failure_threshold=DEFAULT_FAILURE_THRESHOLD,
+                 open_seconds=DEFAULT_OPEN_SECONDS, clock=time.monotonic):
+        self.endpoints = [Endpoint(url) for url in parse_urls(urls)]
+        self.alpha = alpha
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self.clock = clock
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.endpoints)
+
+    @property
+    def urls(self):
+        return [endpoint.url for endpoint in self.endpoints]
+
+    def _available(self, endpoint, now):
+        if endpoint.state == CLOSED:
+            return True
+        # one probe at a time once the breaker has been open long enough
+        return (endpoint.state == OPEN
+                and now - endpoint.opened_at >= self.open_seconds)
+
+    def choose(self, exclude=()):
+        """The endpoint to send the next request to
+
+        Endpoints in exclude, such as those already tried for a request, are
+        only chosen if every endpoint is. If every breaker is open, the one
+        open longest is chosen rather than failing the request outright.
+        """
+        with self._lock:
+            now = self.clock()
+            candidates = [e for e in self.endpoints
+                          if e.url not in exclude] or self.endpoints
+            available = [e for e in candidates if self._available(e, now)]
+            if available:
+                endpoint = min(available, key=lambda e: e.cost)
+            else:
+                endpoint = min(candidates, key=lambda e: e.opened_at or now)
+            if endpoint.state == OPEN:
+                endpoint.state = HALF_OPEN
+                logger.info('probing endpoint', url=endpoint.url)
+            endpoint.in_flight += 1
+            return endpoint
+
+    def release(self, endpoint):
+        """Return an endpoint whose request was abandoned, recording nothing"""
+        with self._lock:
+            endpoint.in_flight -= 1
+            if endpoint.state == HALF_OPEN:
+                # an abandoned probe leaves the endpoint to be probed again
+                endpoint.state = OPEN
+
+    def record_success(self, endpoint, latency):
+        with self._lock:
+            endpoint.in_flight -= 1
+            endpoint.latency += self.alpha * (latency - endpoint.latency)
+            endpoint.error_rate -= self.alpha * endpoint.error_rate
+            endpoint.consecutive_failures = 0
+            if endpoint.state != CLOSED:
+                logger.info('readmitting endpoint', url=endpoint.url,
+                            latency=latency)
+                endpoint.state = CLOSED
+                endpoint.opened_at = None
+
+    def record_failure(self, endpoint):
+        with self._lock:
+            endpoint.in_flight -= 1
+            endpoint.error_rate += self.alpha * (1.0 - endpoint.error_rate)
+            endpoint.consecutive_failures += 1
+            if endpoint.state == HALF_OPEN or (
+                    endpoint.state == CLOSED
+                    and (endpoint.consecutive_failures
+                         >= self.failure_threshold)):
+                if endpoint.state == CLOSED:
+                    logger.warning('ejecting endpoint', url=endpoint.url,
+                                   failures=endpoint.consecutive_failures)
+                endpoint.state = OPEN
+                endpoint.opened_at = self.clock()
@@ -1,22 +1,37 @@
 # -*- coding: utf-8 -*-
+import asyncio
 import concurrent.futures
 import json
 import logging
-import os
 import socket
 import time
-from functools import partial
+from collections import deque
+from collections import namedtuple
 from functools import partialmethod
 from urllib.parse import urlparse
 
+import aiohttp
 import certifi
 import urllib3
 from urllib3.connection import HTTPConnection
 
 import structlog
 
+from dpds.endpoints import EndpointPool
+from dpds.utils import backoff_delay
+from dpds.utils import chunkify
+
 logger = structlog.get_logger(__name__)
 
+DEFAULT_BATCH_SIZE = 50
+# times the failed calls of a batch are sent again
+DEFAULT_BATCH_RETRIES = 3
+# calls in flight per worker thread of exec_multi_with_futures
+DEFAULT_WINDOW_PER_WORKER = 2
+DEFAULT_MAX_WORKERS = 8
+# urllib3 retries per request with several endpoints to fail over between
+DEFAULT_FAILOVER_RETRIES = 2
+
 
 class RPCError(Exception):
     pass
@@ -26,6 +41,31 @@ class RPCConnectionError(Exception):
     pass
 
 
+def rpc_result(response_json):
+    """The result of a JSON-RPC response, raising `RPCError` for an error
+    response"""
+    if 'error' in response_json:
+        error = response_json['error']
+        raise RPCError(error.get('detail', error['message']))
+    return response_json.get('result', None)
+
+
+class CachedResponse(namedtuple('CachedResponse', 'status data')):
+    """Stands in for the urllib3 response to a request answered from a
+    `ResponseCache`"""
+    REDIRECT_STATUSES = ()
+
+
+def json_rpc_batch_body(calls, ids=None):
+    """JSON-RPC batch request body for (name, *args) calls, with ids in call
+    order if omitted"""
+    ids = range(len(calls)) if ids is None else ids
+    return json.dumps([{"method": name, "params": args, "jsonrpc": "2.0",
+                        "id": request_id}
+                       for request_id, (name, *args) in zip(ids, calls)],
+                      ensure_ascii=False).encode('utf8')
+
+
 class SimpleDPayAPIClient(object):
     """Simple dPay JSON-HTTP-RPC API
 
@@ -33,8 +73,11 @@ class SimpleDPayAPIClient(object):
         dPay API.
 
     Args:
-      str: url: url of the API server
+      str: url: url of the API server, or a list or comma separated string
+        of several, see `dpds.endpoints.EndpointPool`
       urllib3: HTTPConnectionPool url: instance of urllib3.HTTPConnectionPool
+      ResponseCache: cache: cache of irreversible block responses, see
+        `dpds.response_cache.ResponseCache`
 
     .. code-block:: python
 
@@ -53,17 +96,22 @@ class SimpleDPayAPIClient(object):
     """
 
     def __init__(self, url=None, log_level=logging.INFO, **kwargs):
-        url = url or os.environ.get('DPAYD_HTTP_URL', 'https://api.dpays.io')
-        self.url = url
-        self.hostname = urlparse(url).hostname
+        self.endpoints = EndpointPool(url)
+        self.url = self.endpoints.urls[0]
+        self.hostname = urlparse(self.url).hostname
         self.return_with_args = kwargs.get('return_with_args', False)
         self.re_raise = kwargs.get('re_raise', False)
         self.max_workers = kwargs.get('max_workers', None)
+        self.batch_size = kwargs.get('batch_size', DEFAULT_BATCH_SIZE)
+        self.batch_retries = kwargs.get('batch_retries', DEFAULT_BATCH_RETRIES)
+        self.cache = kwargs.get('cache', None)
 
         num_pools = kwargs.get('num_pools', 10)
         maxsize = kwargs.get('maxsize', 10)
         timeout = kwargs.get('timeout', 60)
-        retries = kwargs.get('retries', 30)
+        # with several endpoints a failing request fails over instead
+        retries = kwargs.get('retries', 30 if len(self.endpoints) == 1
+                             else DEFAULT_FAILOVER_RETRIES)
         pool_block = kwargs.get('pool_block', False)
         tcp_keepalive = kwargs.get('tcp_keepalive', True)
 
@@ -89,7 +137,91 @@ class SimpleDPayAPIClient(object):
             pool_timeout=None, release_conn=None, chunked=False, body_pos=None,
             **response_kw)
         '''
-        self.request = partial(self.http.urlopen, 'POST', url)
+
+    def request(self, body):
+        """POST body, answering the calls it can from the response cache
+
+        Returns the response and its decoded body, which is None for a non
+        200 or undecodable response, so the body is decoded only once.
+        """
+        if self.cache is None:
+            response = self._request(body)
+            return response, self._decode(response)
+        cached = self.cache.lookup(body)
+        if cached.body is None:
+            response = CachedResponse(200, self.cache.merge(cached))
+            return response, self._decode(response)
+        if self.cache.needs_irreversible_block_num(cached):
+            cached = cached._replace(
+                irreversible_block_num=self._refresh_irreversible_block_num())
+        response = self._request(cached.body)
+        if response.status != 200:
+            return response, None
+        if cached.hits:
+            response = CachedResponse(200,
+                                      self.cache.merge(cached, response.data))
+        responses = self._decode(response)
+        if responses is not None:
+            self.cache.store(cached, responses)
+        return response, responses
+
+    @staticmethod
+    def _decode(response):
+        if response.status != 200:
+            return None
+        try:
+            return json.loads(response.data.decode('utf-8'))
+        except ValueError as e:
+            logger.info('failed to load response', err=e)
+            return None
+
+    def _refresh_irreversible_block_num(self):
+        try:
+            response = self._request(
+                self.json_rpc_body('get_dynamic_global_properties'))
+            result = rpc_result(json.loads(response.data.decode('utf-8')))
+            self.cache.set_irreversible_block_num(
+                result['last_irreversible_block_num'])
+        except Exception as e:
+            logger.info(
+                'error getting last irreversible block to cache responses',
+                err=e)
+            # retried once the cache's refresh interval passes
+            self.cache.set_irreversible_block_num(0)
+        return self.cache.irreversible_block_num
+
+    def _request(self, body):
+        """POST body to the healthiest endpoint, failing over to the others
+
+        Returns the last endpoint's response, or raises its error, if every
+        endpoint fails.
+        """
+        tried = []
+        while True:
+            endpoint = self.endpoints.choose(exclude=tried)
+            tried.append(endpoint.url)
+            last = len(tried) >= len(self.endpoints)
+            start = time.perf_counter()
+            try:
+                response = self.http.urlopen('POST', endpoint.url, body=body)
+            except Exception as e:
+                self.endpoints.record_failure(endpoint)
+                if last:
+                    raise
+                logger.info('endpoint request error', url=endpoint.url, err=e)
+                continue
+            except BaseException:
+                self.endpoints.release(endpoint)
+                raise
+            if response.status == 200:
+                self.endpoints.record_success(endpoint,
+                                              time.perf_counter() - start)
+                return response
+            self.endpoints.record_failure(endpoint)
+            if last:
+                return response
+            logger.info('endpoint non 200 response', url=endpoint.url,
+                        status=response.status)
 
     @staticmethod
     def json_rpc_body(name, *args, as_json=True):
@@ -102,7 +234,7 @@ class SimpleDPayAPIClient(object):
     def exec(self, name, *args, re_raise=None, return_with_args=None):
         body = SimpleDPayAPIClient.json_rpc_body(name, *args)
         try:
-            response = self.request(body=body)
+            response, responses = self.request(body=body)
         except Exception as e:
             if re_raise:
                 raise e
@@ -120,62 +252,127 @@ class SimpleDPayAPIClient(object):
 
             return self._return(
                 response=response,
+                responses=responses,
                 args=args,
                 return_with_args=return_with_args)
 
-    def _return(self, response=None, args=None, return_with_args=None):
+    def _return(self, response=None, responses=None, args=None,
+                return_with_args=None):
         return_with_args = return_with_args or self.return_with_args
 
         if not response:
             result = None
         elif response.status != 200:
             result = None
+        elif responses is None:
+            result = None
         else:
-            try:
-                response_json = json.loads(response.data.decode('utf-8'))
-            except Exception as e:
-                extra = dict(response=response, request_args=args, err=e)
-                logger.info('failed to load response', extra=extra)
-                result = None
-            else:
-                if 'error' in response_json:
-                    error = response_json['error']
-                    error_message = error.get(
-                        'detail', response_json['error']['message'])
-                    raise RPCError(error_message)
-
-                result = response_json.get('result', None)
+            result = rpc_result(responses)
         if return_with_args:
             return result, args
         return result
 
-    def exec_multi(self, name, params):
-        body_gen = ({
-            "method": name,
-            "params": [i],
-            "jsonrpc": "2.0",
-            "id": 0
-        } for i in params)
-        for body in body_gen:
-            json_body = json.dumps(body, ensure_ascii=False).encode('utf8')
-            yield self._return(
-                response=self.request(body=json_body),
-                args=body['params'],
-                return_with_args=True)
-
-    def exec_multi_with_futures(self, name, params, max_workers=None):
+    def exec_multi(self, name, params, *args, batch_size=None, retries=None):
+        """Call name with each of params, yielding (result, call params) in
+        params order
+
+        Calls are sent batch_size to a JSON-RPC batch request, each with its
+        param followed by args. The calls of a batch that fail are sent
+        again, up to retries times, after which their result is None.
+        """
+        batch_size = batch_size or self.batch_size
+        for chunk in chunkify(params, chunksize=batch_size):
+            calls = [(name, param, *args) for param in chunk]
+            results = self._exec_batch(calls, retries=retries)
+            yield from ((result, list(call[1:]))
+                        for result, call in zip(results, calls))
+
+    def _exec_batch(self, calls, retries=None):
+        """Results of (name, *args) calls sent as JSON-RPC batches, retrying
+        failed calls"""
+        retries = self.batch_retries if retries is None else retries
+        results = [None] * len(calls)
+        pending = list(range(len(calls)))
+        for attempt in range(retries + 1):
+            if attempt:
+                time.sleep(backoff_delay(attempt))
+            body = json_rpc_batch_body([calls[i] for i in pending], ids=pending)
+            try:
+                response, responses = self.request(body=body)
+                assert response.status == 200, f'status {response.status}'
+                assert responses is not None, 'undecodable response'
+                # a batch rejected as a whole is answered with a single error
+                assert isinstance(responses, list), responses
+            except Exception as e:
+                logger.info('batch request error', err=e, calls=len(pending),
+                            attempt=attempt + 1)
+                continue
+            responses_by_id = {response.get('id'): response
+                               for response in responses}
+            failed = []
+            for i in pending:
+                try:
+                    results[i] = rpc_result(responses_by_id[i])
+                except (KeyError, RPCError) as e:
+                    logger.debug('batch call error', err=e, call=calls[i],
+                                 attempt=attempt + 1)
+                    failed.append(i)
+            pending = failed
+            if not pending:
+                break
+        if pending:
+            logger.info('giving up on batch calls',
+                        calls=[calls[i] for i in pending])
+        return results
+
+    def exec_multi_with_futures(self, name, params, max_workers=None,
+                                window=None, retries=None):
+        """Call name with each of params from a thread pool, yielding results in
+        params order
+
+        At most window calls are in flight, so params are consumed lazily
+        and memory stays flat however many there are. Results finished
+        ahead of an earlier call wait in the window until it is yielded.
+        Failed calls are retried with backoff, up to retries times, after
+        which their result is None.
+        """
+        max_workers = max_workers or self.max_workers or DEFAULT_MAX_WORKERS
+        window = window or max_workers * DEFAULT_WINDOW_PER_WORKER
+        params = iter(params)
         with concurrent.futures.ThreadPoolExecutor(
                 max_workers=max_workers) as executor:
-            futures = (executor.submit(
-                self.exec, name, param, return_with_args=True)
-                for param in params)
-            for future in concurrent.futures.as_completed(futures):
-                result, args = future.result()
-                if result:
-                    yield result
-                else:
-                    executor.submit(
-                        self.exec, name, args, return_with_args=True)
+            in_flight = deque()
+            try:
+                while True:
+                    for param in params:
+                        in_flight.append(executor.submit(
+                            self._exec_with_retries, name, param,
+                            retries=retries))
+                        if len(in_flight) >= window:
+                            break
+                    if not in_flight:
+                        return
+                    yield in_flight.popleft().result()
+            finally:
+                # a caller that stops early should not wait on the window
+                for future in in_flight:
+                    future.cancel()
+
+    def _exec_with_retries(self, name, *args, retries=None):
+        retries = self.batch_retries if retries is None else retries
+        for attempt in range(retries + 1):
+            if attempt:
+                time.sleep(backoff_delay(attempt))
+            try:
+                result = self.exec(name, *args, re_raise=True)
+            except Exception as e:
+                logger.debug('call error', err=e, name=name, args=args,
+                             attempt=attempt + 1)
+                continue
+            if result is not None:
+                return result
+        logger.info('giving up on call', name=name, args=args, retries=retries)
+        return None
 
     get_dynamic_global_properties = partialmethod(
         exec, 'get_dynamic_global_properties')
@@ -219,3 +416,220 @@ class SimpleDPayAPIClient(object):
                     if block_num > stop:
                         break
             time.sleep(interval / 2)
+
+
+class AsyncDPayAPIClient(object):
+    """Asyncio dPay JSON-HTTP-RPC API
+
+        The asyncio counterpart of `SimpleDPayAPIClient`. Calls share one
+        pooled aiohttp connector, and `batch` sends many calls as a single
+        JSON-RPC batch request.
+
+    Args:
+      str: url: url of the API server, or a list or comma separated string
+        of several, see `dpds.endpoints.EndpointPool`
+      aiohttp.TCPConnector: connector: connector of the session, created if
+        omitted
+      int: limit: connections a created connector may open
+      int: timeout: seconds before a request times out
+      json_loads: function decoding response bodies
+      ResponseCache: cache: cache of irreversible block responses, see
+        `dpds.response_cache.ResponseCache`
+
+    .. code-block:: python
+
+    from dpds.http_client import AsyncDPayAPIClient
+
+    async with AsyncDPayAPIClient("http://domain.com:port") as rpc:
+        block = await rpc.get_block(1)
+        block, ops = await rpc.batch([('get_block', 2),
+                                      ('get_ops_in_block', 2, False)])
+    """
+
+    def __init__(self, url=None, connector=None, limit=100, timeout=60,
+                 json_loads=json.loads, cache=None):
+        self.endpoints = EndpointPool(url)
+        self.url = self.endpoints.urls[0]
+        self.hostname = urlparse(self.url).hostname
+        self.limit = limit
+        self.timeout = timeout
+        self.json_loads = json_loads
+        self.cache = cache
+        self._connector = connector
+        self._session = None
+
+    @property
+    def session(self):
+        # created on first use, inside the event loop it is used from
+        if self._session is None:
+            connector = self._connector or aiohttp.TCPConnector(
+                limit=self.limit)
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+                headers={'Content-Type': 'application/json'})
+        return self._session
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def post(self, body):
+        """POST a JSON-RPC request body, returns the response body and its
+        decoding
+
+        Calls cached in the response cache are answered from it, and only
+        the rest are sent. The response body is decoded once, and the
+        cache stores results from the decoded responses.
+        """
+        if self.cache is None:
+            data = await self._post(body)
+            return data, self.json_loads(data)
+        loop = asyncio.get_event_loop()
+        cached = await loop.run_in_executor(None, self.cache.lookup, body)
+        if cached.body is None:
+            data = self.cache.merge(cached)
+            return data, self.json_loads(data)
+        if self.cache.needs_irreversible_block_num(cached):
+            cached = cached._replace(irreversible_block_num=(
+                await self._refresh_irreversible_block_num()))
+        data = self.cache.merge(cached, await self._post(cached.body))
+        responses = self.json_loads(data)
+        await loop.run_in_executor(None, self.cache.store, cached, responses)
+        return data, responses
+
+    async def _refresh_irreversible_block_num(self):
+        body = SimpleDPayAPIClient.json_rpc_body(
+            'get_dynamic_global_properties')
+        try:
+            result = rpc_result(self.json_loads(await self._post(body)))
+            self.cache.set_irreversible_block_num(
+                result['last_irreversible_block_num'])
+        except (RPCError, RPCConnectionError, KeyError, ValueError) as e:
+            logger.info(
+                'error getting last irreversible block to cache responses',
+                err=e)
+            # retried once the cache's refresh interval passes
+            self.cache.set_irreversible_block_num(0)
+        return self.cache.irreversible_block_num
+
+    async def _post(self, body):
+        """POST a JSON-RPC request body to the healthiest endpoint, returns the
+        response body
+
+        A failed request fails over to the other endpoints. Raises
+        `RPCConnectionError` if the request fails or the response status
+        is an error at every endpoint.
+        """
+        tried = []
+        while True:
+            endpoint = self.endpoints.choose(exclude=tried)
+            tried.append(endpoint.url)
+            start = time.perf_counter()
+            try:
+                async with self.session.post(endpoint.url,
+                                             data=body) as response:
+                    response.raise_for_status()
+                    data = await response.read()
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                self.endpoints.record_failure(endpoint)
+                if len(tried) >= len(self.endpoints):
+                    raise RPCConnectionError(
+                        f'{urlparse(endpoint.url).hostname}: {e}') from e
+                logger.info('endpoint request error', url=endpoint.url, err=e)
+                continue
+            except BaseException:
+                self.endpoints.release(endpoint)
+                raise
+            self.endpoints.record_success(endpoint, time.perf_counter() - start)
+            return data
+
+    async def exec(self, name, *args):
+        body = SimpleDPayAPIClient.json_rpc_body(name, *args)
+        _, response = await self.post(body)
+        return rpc_result(response)
+
+    batch_body = staticmethod(json_rpc_batch_body)
+
+    @staticmethod
+    def batch_results(responses, call_count, return_exceptions=False):
+        """Results of a `batch_body` request's decoded responses in call order
+
+        Responses are matched to calls by id, as a server may answer a batch
+        in any order. A call without a response raises `RPCError`, as does
+        a call answered with an error, unless return_exceptions is set, in
+        which case its `RPCError` takes its place in the results.
+        """
+        if not isinstance(responses, list):
+            # a batch rejected as a whole is answered with a single error
+            rpc_result(responses)
+            raise RPCError('batch answered with a single response')
+        responses_by_id = {response.get('id'): response
+                           for response in responses}
+        results = []
+        for request_id in range(call_count):
+            try:
+                if request_id not in responses_by_id:
+                    raise RPCError(f'no response to batch call {request_id}')
+                results.append(rpc_result(responses_by_id[request_id]))
+            except RPCError as e:
+                if not return_exceptions:
+                    raise
+                results.append(e)
+        return results
+
+    async def batch(self, calls, return_exceptions=False):
+        """Send (name, *args) calls as one JSON-RPC batch, returns their results
+        in call order"""
+        calls = list(calls)
+        if not calls:
+            return []
+        _, responses = await self.post(self.batch_body(calls))
+        return self.batch_results(responses, len(calls),
+                                  return_exceptions=return_exceptions)
+
+    get_dynamic_global_properties = partialmethod(
+        exec, 'get_dynamic_global_properties')
+
+    get_config = partialmethod(exec, 'get_config')
+
+    get_block = partialmethod(exec, 'get_block')
+
+    get_ops_in_block = partialmethod(exec, 'get_ops_in_block')
+
+    async def last_irreversible_block_num(self):
+        return (await self.get_dynamic_global_properties())[
+            'last_irreversible_block_num']
+
+    async def block_height(self):
+        return await self.last_irreversible_block_num()
+
+    async def block_interval(self):
+        return (await self.get_config())['DPAY_BLOCK_INTERVAL']
+
+    async def stream(self, start=None, stop=None, interval=None):
+        """Yield blocks from start, waiting for each to become irreversible"""
+        start = start or await self.block_height()
+        interval = interval or await self.block_interval()
+        block_num = start
+        height = await self.block_height()
+        while stop is None or block_num <= stop:
+            try:
+                if block_num > height:
+                    await asyncio.sleep(interval / 2)
+                    height = await self.block_height()
+                    continue
+                block = await self.get_block(block_num)
+            except (RPCError, RPCConnectionError) as e:
+                logger.info('error streaming block', block_num=block_num, err=e)
+                await asyncio.sleep(interval / 2)
+                continue
+            yield block
+            block_num += 1
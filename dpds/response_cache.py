@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+"""On-disk cache of irreversible get_block and get_ops_in_block responses
+
+Blocks at or below the last irreversible block never change, so their
+results are cached by method, block_num and any further params, zlib
+compressed in an sqlite database. A result is only cached if its block
+was irreversible before its request was sent, so a block fetched from a
+fork is never cached.
+
+Caching works on JSON-RPC request and response bodies. Cached calls are
+taken out of a request before it is sent, and their cached result bytes
+are spliced into the response body as they are, without being decoded
+and encoded again. Results are cached from the responses the client has
+already decoded, so caching adds no decode of its own. Once the cache
+holds more than max_bytes, the oldest results are evicted first.
+"""
+import json
+import sqlite3
+import threading
+import time
+import zlib
+from collections import namedtuple
+
+import rapidjson
+import structlog
+
+logger = structlog.get_logger(__name__)
+
+CACHED_METHODS = frozenset(['get_block', 'get_ops_in_block'])
+DEFAULT_MAX_BYTES = 4 * 1024 ** 3
+# eviction frees space down to this fraction of max_bytes
+EVICT_TO = 0.9
+COMPRESSION_LEVEL = 6
+# seconds between last irreversible block requests made to decide what to cache
+LIB_REFRESH_SECONDS = 3.0
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS responses (
+    method TEXT NOT NULL,
+    block_num INTEGER NOT NULL,
+    params TEXT NOT NULL,
+    data BLOB NOT NULL,
+    PRIMARY KEY (method, block_num, params)
+)'''
+
+
+def cache_key(name, args):
+    """The (method, block_num, params) key of a cacheable call, None for any
+    other call"""
+    if name not in CACHED_METHODS or not args:
+        return None
+    block_num = args[0]
+    if not isinstance(block_num, int) or isinstance(block_num, bool):
+        return None
+    return name, block_num, json.dumps(list(args[1:]))
+
+
+def response_fragment(request_id, raw_result):
+    """A JSON-RPC response body for request_id around an encoded result"""
+    return b'{"id":%s,"jsonrpc":"2.0","result":%s}' % (
+        json.dumps(request_id).encode(), raw_result)
+
+
+# hits: response fragments of cached calls
+# body: request body of the calls left to send, None if every call was cached
+# misses: {request id: key} of the cacheable calls left to send
+# lib_ids: ids of get_dynamic_global_properties calls
+# is_batch: whether the request was a batch
+# irreversible_block_num: last irreversible block known before the request
+CachedRequest = namedtuple(
+    'CachedRequest', 'hits body misses lib_ids is_batch irreversible_block_num')
+
+
+class ResponseCache(object):
+    """Compressed, size bounded cache of irreversible block responses
+
+    Safe to share between threads, and between processes through the same
+    path.
+
+    Args:
+      path: sqlite database file, created if missing
+      max_bytes: compressed bytes kept before the oldest results are evicted
+      clock: monotonic clock, for testing
+    """
+
+    def __init__(self, path, max_bytes=DEFAULT_MAX_BYTES, clock=time.monotonic):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=60, isolation_level=None,
+                                   check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute(SCHEMA)
+        self.size = self._db.execute(
+            'SELECT COALESCE(SUM(LENGTH(data)), 0) '
+            'FROM responses').fetchone()[0]
+        self.irreversible_block_num = 0
+        self._lib_checked_at = None
+        self.hits = 0
+        self.misses = 0
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    # --- results ---
+
+    def get(self, key):
+        """The encoded result cached for key, None if there is none"""
+        with self._lock:
+            row = self._db.execute(
+                'SELECT data FROM responses WHERE method = ? AND block_num = ? '
+                'AND params = ?', key).fetchone()
+        if row is None:
+            return None
+        return zlib.decompress(row[0])
+
+    def put_many(self, results):
+        """Cache (key, encoded result) pairs, evicting the oldest results once
+        over max_bytes"""
+        rows = [(*key, zlib.compress(raw_result, COMPRESSION_LEVEL))
+                for key, raw_result in results]
+        if not rows:
+            return
+        with self._lock:
+            with self._db:
+                self._db.executemany(
+                    'INSERT OR REPLACE INTO responses (method, block_num, '
+                    'params, data) VALUES (?, ?, ?, ?)', rows)
+            self.size += sum(len(row[-1]) for row in rows)
+            if self.size > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        # the size is recounted, other processes may have added or evicted
+        # results
+        self.size = self._db.execute(
+            'SELECT COALESCE(SUM(LENGTH(data)), 0) '
+            'FROM responses').fetchone()[0]
+        target = self.max_bytes * EVICT_TO
+        evicted = 0
+        with self._db:
+            for rowid, length in self._db.execute(
+                    'SELECT rowid, LENGTH(data) FROM responses '
+                    'ORDER BY rowid').fetchall():
+                if self.size <= target:
+                    break
+                self._db.execute(
+                    'DELETE FROM responses WHERE rowid = ?', (rowid,))
+                self.size -= length
+                evicted += 1
+        logger.info('evicted cached responses', evicted=evicted, size=self.size,
+                    path=self.path)
+
+    # --- last irreversible block ---
+
+    def set_irreversible_block_num(self, block_num):
+        self.irreversible_block_num = max(
+            self.irreversible_block_num, block_num)
+        self._lib_checked_at = self.clock()
+
+    def needs_irreversible_block_num(self, cached_request):
+        """Whether the last irreversible block should be requested before
+        sending cached_request
+
+        It is if a cacheable call is for a block above the last irreversible
+        block known, at most every LIB_REFRESH_SECONDS.
+        """
+        if not any(block_num > self.irreversible_block_num
+                   for _, block_num, _ in cached_request.misses.values()):
+            return False
+        return (self._lib_checked_at is None
+                or self.clock() - self._lib_checked_at >= LIB_REFRESH_SECONDS)
+
+    # --- request and response bodies ---
+
+    def lookup(self, body):
+        """Split a JSON-RPC request body into cached responses and the calls
+        left to send"""
+        request = json.loads(body)
+        is_batch = isinstance(request, list)
+        calls = request if is_batch else [request]
+        hits = []
+        misses = {}
+        lib_ids = []
+        unsent = []
+        for call in calls:
+            name = call.get('method')
+            if name == 'get_dynamic_global_properties':
+                lib_ids.append(call.get('id'))
+            key = cache_key(name, call.get('params') or [])
+            raw_result = self.get(key) if key is not None else None
+            if raw_result is not None:
+                hits.append(response_fragment(call.get('id'), raw_result))
+                continue
+            if key is not None:
+                misses[call.get('id')] = key
+            unsent.append(call)
+        self.hits += len(hits)
+        self.misses += len(misses)
+        if not hits:
+            unsent_body = body
+        elif not unsent:
+            unsent_body = None
+        else:
+            unsent_body = json.dumps(unsent if is_batch else unsent[0],
+                                     ensure_ascii=False).encode('utf8')
+        return CachedRequest(hits, unsent_body, misses, lib_ids, is_batch,
+                             self.irreversible_block_num)
+
+    def store(self, cached_request, responses):
+        """Cache the irreversible results among the decoded responses to
+        cached_request's body
+
+        responses may be decoded from the merged response body, the
+        responses answered from the cache are skipped. Also takes the last
+        irreversible block from any get_dynamic_global_properties response.
+        """
+        cacheable = {request_id: key
+                     for request_id, key in cached_request.misses.items()
+                     if key[1] <= cached_request.irreversible_block_num}
+        if not cacheable and not cached_request.lib_ids:
+            return
+        if not isinstance(responses, list):
+            responses = [responses]
+        results = []
+        for response in responses:
+            if not isinstance(response, dict) or response.get('result') is None:
+                continue
+            request_id = response.get('id')
+            if request_id in cached_request.lib_ids:
+                self.set_irreversible_block_num(
+                    response['result']['last_irreversible_block_num'])
+            elif request_id in cacheable:
+                results.append((cacheable[request_id],
+                                rapidjson.dumps(
+                                    response['result'],
+                                    ensure_ascii=False).encode('utf8')))
+        self.put_many(results)
+
+    @staticmethod
+    def merge(cached_request, response_body=None):
+        """The response body to cached_request's original request
+
+        response_body is the response to the calls left to send, None if
+        there were none. A response that is not a batch, such as an error
+        rejecting the whole batch, is returned as it is.
+        """
+        if response_body is None:
+            if cached_request.is_batch:
+                return b'[' + b','.join(cached_request.hits) + b']'
+            return cached_request.hits[0]
+        if not cached_request.hits:
+            return response_body
+        stripped = response_body.strip()
+        if not stripped.startswith(b'['):
+            return response_body
+        fragments = list(cached_request.hits)
+        inner = stripped[1:-1].strip()
+        if inner:
+            fragments.append(inner)
+        return b'[' + b','.join(fragments) + b']'
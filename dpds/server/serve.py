@@ -15,6 +15,8 @@ from jsonrpcserver import config
 from jsonrpcserver.async_methods import AsyncMethods
 from sqlalchemy.engine.url import make_url
 
+from dpds.storages.db.tables.meta.populate_watermark import PopulateWatermark
+
 from .methods.account_history_api.methods import get_ops_in_block
 from .methods.account_history_api.methods import get_account_history
 
@@ -74,7 +76,11 @@ async def api_healthcheck(request):
     block_cls = request.config.Block
     rpc = request.config.rpc
     app = request.app
-    last_db_block = block_cls.highest_block(db)
+    # every block up to the watermark is stored, MAX(block_num) makes no such
+    # claim
+    last_db_block = PopulateWatermark.highest_block(db)
+    if last_db_block is None:
+        last_db_block = block_cls.highest_block(db)
     last_irreversible_block = rpc.last_irreversible_block_num()
     diff = last_irreversible_block - last_db_block
     if diff > app.config['dpds.MAX_BLOCK_NUM_DIFF']:
@@ -119,24 +119,30 @@ def bulk_add_blocks(ctx, blocks, chunksize):
 
 
 @db.command(name='init')
+@click.option('--partition_width', type=click.IntRange(min=1), default=None,
+              help='Range partition the largest operation tables by block_num, '
+                   'this many blocks per partition')
 @click.pass_context
-def init_db_tables(ctx):
+def init_db_tables(ctx, partition_width):
     """Create any missing tables on the database"""
     database_url = ctx.obj['database_url']
     metadata = ctx.obj['metadata']
 
-    init_tables(database_url, metadata)
+    init_tables(database_url, metadata, partition_width=partition_width)
 
 
 @db.command(name='reset')
+@click.option('--partition_width', type=click.IntRange(min=1), default=None,
+              help='Range partition the largest operation tables by block_num, '
+                   'this many blocks per partition')
 @click.confirmation_option(
     prompt='Are you sure you want to drop and then create all db tables?')
 @click.pass_context
-def reset_db_tables(ctx):
+def reset_db_tables(ctx, partition_width):
     """Drop and then create tables on the database"""
     database_url = ctx.obj['database_url']
     metadata = ctx.obj['metadata']
-    reset_tables(database_url, metadata)
+    reset_tables(database_url, metadata, partition_width=partition_width)
 
 
 @db.command(name='last-block')
@@ -164,8 +170,11 @@ def last_block(ctx):
     envvar='DPAYD_HTTP_URL',
     required=True,
     help='DPayd HTTP server URL')
+@click.option('--start', type=click.IntRange(min=1), default=1)
+@click.option('--ranges', is_flag=True,
+              help='Output [start, end] ranges instead of block_nums')
 @click.pass_context
-def find_missing_blocks(ctx, url):
+def find_missing_blocks(ctx, url, start, ranges):
     """Return JSON array of block_nums from missing blocks"""
 
     engine = ctx.obj['engine']
@@ -182,9 +191,13 @@ def find_missing_blocks(ctx, url):
 
     last_chain_block = rpc.last_irreversible_block_num()
 
-    click.echo(
-        json.dumps(
-            Block.find_missing(session, last_chain_block=last_chain_block)))
+    if ranges:
+        missing = list(Block.find_missing_ranges(
+            session, last_chain_block=last_chain_block, start_block=start))
+    else:
+        missing = Block.find_missing(
+            session, last_chain_block=last_chain_block, start_block=start)
+    click.echo(json.dumps(missing))
 
 
 @db.command(name='raw-sql')
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""Page every account name out of dpayd's ``lookup_accounts`` concurrently
+
+``lookup_accounts`` only pages forwards from a lower bound, so the name
+space is split at name prefixes and each partition is paged on its own.
+"""
+import asyncio
+import string
+
+import structlog
+
+from dpds.storages.db.scripts.fetch_control import DEFAULT_RPC_RETRIES
+from dpds.utils import backoff_delay
+
+logger = structlog.get_logger(__name__)
+
+# characters allowed in account names, in dpayd's (byte) sort order
+ACCOUNT_NAME_CHARS = '-.' + string.digits + string.ascii_lowercase
+LOOKUP_ACCOUNTS_LIMIT = 1000
+DEFAULT_LOOKUP_REQUESTS = 16
+
+
+def name_space_partitions(prefix_length=1):
+    """[lower, upper) name bounds covering every name, upper None for the last
+
+    Names start with a letter, so the space is split before each possible
+    prefix of up to prefix_length characters starting with a letter.
+    """
+    prefixes = list(string.ascii_lowercase)
+    splits = list(prefixes)
+    for _ in range(prefix_length - 1):
+        prefixes = [p + c for p in prefixes for c in ACCOUNT_NAME_CHARS]
+        splits.extend(prefixes)
+    splits.sort()
+    return list(zip([''] + splits, splits + [None]))
+
+
+async def lookup_accounts(client, lower_bound, limit=LOOKUP_ACCOUNTS_LIMIT,
+                          retries=DEFAULT_RPC_RETRIES, semaphore=None):
+    """Return up to limit names from lower_bound on, retrying with backoff
+
+    client is a `dpds.http_client.AsyncDPayAPIClient`. Raises the last
+    error once retries run out.
+    """
+    semaphore = semaphore or asyncio.Semaphore(1)
+    for attempt in range(retries + 1):
+        if attempt:
+            await asyncio.sleep(backoff_delay(attempt))
+        try:
+            async with semaphore:
+                return await client.exec('lookup_accounts', lower_bound, limit)
+        except Exception as e:
+            logger.warning('error looking up accounts',
+                           e=e, lower_bound=lower_bound, attempt=attempt + 1)
+            if attempt == retries:
+                raise
+
+
+async def page_account_names(client, lower, upper, on_names,
+                             limit=LOOKUP_ACCOUNTS_LIMIT,
+                             retries=DEFAULT_RPC_RETRIES, semaphore=None):
+    """Page names in [lower, upper), awaiting on_names with each page"""
+    lower_bound = lower
+    last_name = None
+    while True:
+        names = await lookup_accounts(client, lower_bound, limit=limit,
+                                      retries=retries, semaphore=semaphore)
+        # each page repeats the name it was requested from
+        page = [name for name in names
+                if name != last_name and (upper is None or name < upper)]
+        if page:
+            await on_names(page)
+        if (len(names) < limit
+                or names[-1] == last_name
+                or (upper is not None and names[-1] >= upper)):
+            return
+        lower_bound = last_name = names[-1]
+
+
+async def lookup_account_names(client, on_names, prefix_length=1,
+                               requests=DEFAULT_LOOKUP_REQUESTS,
+                               limit=LOOKUP_ACCOUNTS_LIMIT,
+                               retries=DEFAULT_RPC_RETRIES):
+    """Page every account name with up to requests lookups in flight
+
+    on_names is awaited with each page of names as it arrives, in no
+    particular order across partitions.
+    """
+    semaphore = asyncio.Semaphore(requests)
+    await asyncio.gather(*(
+        page_account_names(client, lower, upper, on_names, limit=limit,
+                           retries=retries, semaphore=semaphore)
+        for lower, upper in name_space_partitions(prefix_length)))
+
+
+async def collect_account_names(client, **kwargs):
+    """Return every account name, sorted"""
+    account_names = set()
+
+    async def add_names(names):
+        account_names.update(names)
+
+    await lookup_account_names(client, add_names, **kwargs)
+    return sorted(account_names)
@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+"""Deferred secondary indexes and foreign keys for bulk loads
+
+A bulk load drops the secondary indexes and foreign keys of the block and
+operation tables, keeping only their primary keys, and rebuilds them once
+the data is in. Definitions always come from the ORM tables, so an
+interrupted bulk load can be finished by any later run.
+"""
+import asyncio
+
+import structlog
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.schema import CreateIndex
+
+from dpds.storages.db.tables.block import Block
+# registers dpds_meta_accounts, the table the foreign keys refer to
+from dpds.storages.db.tables.meta.accounts import Account  # noqa
+from dpds.storages.db.tables.operations import combined_ops_class_map
+from dpds.storages.db.tables.partitions import PARTITIONED_TABLE_NAMES_SQL
+
+logger = structlog.get_logger(__name__)
+
+DIALECT = postgresql.dialect()
+PREPARER = DIALECT.identifier_preparer
+
+BULK_LOAD_TABLES = tuple(sorted(
+    {Block.__table__} | {cls.__table__
+                         for cls in combined_ops_class_map.values()},
+    key=lambda table: table.name))
+
+FOREIGN_KEY_NAMES_SQL = """
+SELECT c.conname
+FROM pg_constraint c
+WHERE c.contype = 'f' AND c.conrelid = $1::regclass
+"""
+
+# foreign keys on a table over exactly these columns, in order
+FOREIGN_KEY_EXISTS_SQL = """
+SELECT EXISTS (
+    SELECT 1 FROM pg_constraint c
+    WHERE c.contype = 'f' AND c.conrelid = $1::regclass
+    AND ARRAY(
+        SELECT a.attname::text
+        FROM unnest(c.conkey) WITH ORDINALITY AS k(attnum, ord)
+        JOIN pg_attribute a ON a.attrelid = c.conrelid AND a.attnum = k.attnum
+        ORDER BY k.ord
+    ) = $2::text[]
+)
+"""
+
+NOT_VALIDATED_FOREIGN_KEYS_SQL = """
+SELECT c.conrelid::regclass::text AS table_name, c.conname
+FROM pg_constraint c
+WHERE c.contype = 'f' AND NOT c.convalidated
+AND c.conrelid::regclass::text = ANY($1::text[])
+ORDER BY 1, 2
+"""
+
+# whether any deferred index is missing or any foreign key is missing or
+# not yet validated, i.e. a bulk load hasn't been finished
+BULK_LOAD_PENDING_SQL = """
+SELECT (
+    SELECT count(*) FROM pg_class
+    WHERE relkind IN ('i', 'I') AND relname = ANY($1::text[])
+) < $2 OR (
+    SELECT count(*) FROM pg_constraint c
+    WHERE c.contype = 'f' AND c.convalidated
+    AND c.conrelid::regclass::text = ANY($3::text[])
+) < $4
+"""
+
+
+def index_sql(index):
+    sql = str(CreateIndex(index).compile(dialect=DIALECT))
+    return sql.replace('CREATE INDEX ', 'CREATE INDEX IF NOT EXISTS ', 1)
+
+
+def foreign_key_name(table, foreign_key):
+    # postgres' own default name, truncated to its identifier limit
+    return f'{table.name}_{"_".join(foreign_key.column_keys)}_fkey'[:63]
+
+
+def foreign_key_sql(table, foreign_key, not_valid=True):
+    columns = ', '.join(PREPARER.quote(c) for c in foreign_key.column_keys)
+    referred_columns = ', '.join(PREPARER.quote(element.column.name)
+                                 for element in foreign_key.elements)
+    sql = (f'ALTER TABLE {PREPARER.format_table(table)} '
+           'ADD CONSTRAINT '
+           f'{PREPARER.quote(foreign_key_name(table, foreign_key))} '
+           f'FOREIGN KEY ({columns}) '
+           f'REFERENCES {PREPARER.format_table(foreign_key.referred_table)} '
+           f'({referred_columns})')
+    if foreign_key.deferrable:
+        sql += ' DEFERRABLE'
+    if foreign_key.initially:
+        sql += f' INITIALLY {foreign_key.initially}'
+    if not_valid:
+        # validated separately so adding the key doesn't scan the table
+        sql += ' NOT VALID'
+    return sql
+
+
+def deferred_indexes(tables=BULK_LOAD_TABLES):
+    return [(table.name, index.name, index_sql(index))
+            for table in tables
+            for index in sorted(table.indexes, key=lambda index: index.name)]
+
+
+def deferred_foreign_keys(tables=BULK_LOAD_TABLES):
+    return [(table, foreign_key)
+            for table in tables
+            for foreign_key in sorted(table.foreign_key_constraints,
+                                      key=lambda fk: fk.column_keys)]
+
+
+async def run_statements(pool, statements, workers=4, pbar=None):
+    """Execute independent DDL statements on up to workers connections
+
+    Failed statements are logged and returned, the rest still run.
+    """
+    queue = asyncio.Queue()
+    for statement in statements:
+        queue.put_nowait(statement)
+    failed = []
+
+    async def worker():
+        while not queue.empty():
+            statement = queue.get_nowait()
+            async with pool.acquire() as conn:
+                try:
+                    await conn.execute(statement, timeout=None)
+                except Exception as e:
+                    logger.error('error running bulk load statement', e=e,
+                                 statement=statement)
+                    failed.append(statement)
+            if pbar:
+                pbar.update(1)
+
+    await asyncio.gather(*(
+        worker() for _ in range(min(workers, len(statements)) or 1)))
+    return failed
+
+
+async def drop_deferred_indexes_and_foreign_keys(pool, tables=BULK_LOAD_TABLES):
+    """Drop secondary indexes and foreign keys, returns how many were dropped"""
+    dropped = 0
+    async with pool.acquire() as conn:
+        for _, index_name, _ in deferred_indexes(tables):
+            if await conn.fetchval('SELECT to_regclass($1)', index_name):
+                await conn.execute(
+                    f'DROP INDEX IF EXISTS {PREPARER.quote(index_name)}')
+                dropped += 1
+        for table in tables:
+            for conname in await conn.fetch(FOREIGN_KEY_NAMES_SQL, table.name):
+                await conn.execute(
+                    f'ALTER TABLE {PREPARER.format_table(table)} '
+                    f'DROP CONSTRAINT {PREPARER.quote(conname["conname"])}')
+                dropped += 1
+    return dropped
+
+
+async def bulk_load_pending(pool, tables=BULK_LOAD_TABLES):
+    """Whether a bulk load left indexes or foreign keys to rebuild
+
+    Counts what exists in one catalog query, so runs which aren't finishing
+    a bulk load skip looking up each index and key.
+    """
+    index_names = [index_name for _, index_name, _ in deferred_indexes(tables)]
+    async with pool.acquire() as conn:
+        return await conn.fetchval(BULK_LOAD_PENDING_SQL,
+                                   index_names,
+                                   len(index_names),
+                                   [table.name for table in tables],
+                                   len(deferred_foreign_keys(tables)))
+
+
+async def missing_deferred_indexes(pool, tables=BULK_LOAD_TABLES):
+    async with pool.acquire() as conn:
+        return [sql for _, index_name, sql in deferred_indexes(tables)
+                if not await conn.fetchval('SELECT to_regclass($1)',
+                                           index_name)]
+
+
+async def missing_deferred_foreign_keys(pool, tables=BULK_LOAD_TABLES):
+    async with pool.acquire() as conn:
+        # postgres can't add NOT VALID foreign keys to partitioned tables
+        partitioned = {row['relname']
+                       for row in await conn.fetch(PARTITIONED_TABLE_NAMES_SQL)}
+        return [foreign_key_sql(table, foreign_key,
+                                not_valid=table.name not in partitioned)
+                for table, foreign_key in deferred_foreign_keys(tables)
+                if not await conn.fetchval(FOREIGN_KEY_EXISTS_SQL,
+                                           table.name,
+                                           list(foreign_key.column_keys))]
+
+
+async def not_validated_foreign_keys(pool, tables=BULK_LOAD_TABLES):
+    async with pool.acquire() as conn:
+        rows = await conn.fetch(NOT_VALIDATED_FOREIGN_KEYS_SQL,
+                                [t.name for t in tables])
+    return [f'ALTER TABLE {PREPARER.quote(row["table_name"])} '
+            f'VALIDATE CONSTRAINT {PREPARER.quote(row["conname"])}'
+            for row in rows]
+
+
+def analyze_statements(tables=BULK_LOAD_TABLES):
+    return [f'ANALYZE {PREPARER.format_table(table)}' for table in tables]
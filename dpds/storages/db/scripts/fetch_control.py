@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+import asyncio
+
+import structlog
+
+logger = structlog.get_logger(__name__)
+
+# seconds a batch may take before it counts as a congestion signal
+DEFAULT_TARGET_LATENCY = 2.0
+# decoded response bytes a batch may return before it counts as oversized
+DEFAULT_MAX_PAYLOAD_BYTES = 16 * 1024 * 1024
+DEFAULT_RPC_RETRIES = 4
+# weight of the newest sample in the error rate EWMA
+ERROR_RATE_ALPHA = 0.1
+# error rate above which successes stop growing batch size and concurrency
+DEFAULT_MAX_ERROR_RATE = 0.05
+
+
+class FetchController(object):
+    """AIMD controller for RPC batch size and in-flight requests.
+
+    Fast, error free batches grow the batch size additively and allow one
+    more request in flight per round of successes. Errors halve both, slow
+    batches halve the batch size and oversized payloads shrink it to fit.
+    Growth waits while the EWMA of the error rate is above max_error_rate,
+    so a flaky node isn't probed back into failing as soon as one batch
+    gets through.
+    """
+
+    def __init__(self,
+                 batch_size=100,
+                 concurrency=5,
+                 min_batch_size=1,
+                 max_batch_size=500,
+                 min_concurrency=1,
+                 max_concurrency=20,
+                 target_latency=DEFAULT_TARGET_LATENCY,
+                 max_payload_bytes=DEFAULT_MAX_PAYLOAD_BYTES,
+                 batch_increase=10,
+                 decrease_factor=0.5,
+                 max_error_rate=DEFAULT_MAX_ERROR_RATE):
+        self.min_batch_size = min_batch_size
+        self.max_batch_size = max(max_batch_size, min_batch_size)
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max(max_concurrency, min_concurrency)
+        self.batch_size = self._clamp(batch_size, min_batch_size,
+                                      self.max_batch_size)
+        self.concurrency = self._clamp(concurrency, min_concurrency,
+                                       self.max_concurrency)
+        self.target_latency = target_latency
+        self.max_payload_bytes = max_payload_bytes
+        self.batch_increase = batch_increase
+        self.decrease_factor = decrease_factor
+        self.max_error_rate = max_error_rate
+        self.error_rate = 0.0
+        self.in_flight = 0
+        self._successes = 0
+        self._condition = None
+
+    @staticmethod
+    def _clamp(value, low, high):
+        return max(low, min(high, int(value)))
+
+    @property
+    def condition(self):
+        # created lazily so the controller can be built outside the loop
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        return self._condition
+
+    async def acquire(self):
+        async with self.condition:
+            await self.condition.wait_for(
+                lambda: self.in_flight < self.concurrency)
+            self.in_flight += 1
+
+    async def release(self):
+        async with self.condition:
+            self.in_flight -= 1
+            self.condition.notify_all()
+
+    def _update_error_rate(self, failed):
+        self.error_rate += ERROR_RATE_ALPHA * (float(failed) - self.error_rate)
+
+    def _decrease_batch_size(self, limit=None):
+        batch_size = self.batch_size * self.decrease_factor
+        if limit is not None:
+            batch_size = min(batch_size, limit)
+        self.batch_size = self._clamp(batch_size, self.min_batch_size,
+                                      self.max_batch_size)
+
+    def record_success(self, latency, payload_bytes, block_count):
+        self._update_error_rate(False)
+        if payload_bytes > self.max_payload_bytes:
+            bytes_per_block = payload_bytes / max(block_count, 1)
+            self._decrease_batch_size(
+                limit=self.max_payload_bytes / bytes_per_block)
+            self._successes = 0
+            logger.info('rpc payload too large, shrinking batch size',
+                        payload_bytes=payload_bytes, **self.state())
+        elif latency > self.target_latency:
+            self._decrease_batch_size()
+            self._successes = 0
+            logger.info('rpc batch too slow, shrinking batch size',
+                        latency=latency, **self.state())
+        elif self.error_rate > self.max_error_rate:
+            # holding steady until the errors subside
+            self._successes = 0
+        else:
+            self.batch_size = self._clamp(self.batch_size + self.batch_increase,
+                                          self.min_batch_size,
+                                          self.max_batch_size)
+            self._successes += 1
+            if self._successes >= self.concurrency:
+                self._successes = 0
+                self.concurrency = self._clamp(self.concurrency + 1,
+                                               self.min_concurrency,
+                                               self.max_concurrency)
+
+    def record_failure(self):
+        self._update_error_rate(True)
+        self._successes = 0
+        self._decrease_batch_size()
+        self.concurrency = self._clamp(self.concurrency * self.decrease_factor,
+                                       self.min_concurrency,
+                                       self.max_concurrency)
+        logger.info('rpc batch failed, backing off', **self.state())
+
+    def state(self):
+        return dict(batch_size=self.batch_size,
+                    concurrency=self.concurrency,
+                    in_flight=self.in_flight,
+                    error_rate=round(self.error_rate, 3))
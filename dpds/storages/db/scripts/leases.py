@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+"""Block range leases shared by populate workers through the database
+
+The block space is split into leases of a fixed number of blocks, aligned
+to multiples of the lease size so every populate process seeds the same
+rows however its view of the missing blocks differs. Workers on any host
+claim an unheld lease with ``FOR UPDATE SKIP LOCKED``, renew it with
+heartbeats while loading its missing blocks, and mark it completed. A
+lease whose holder stops heartbeating expires and can be claimed again.
+"""
+import asyncio
+import os
+import socket
+
+import structlog
+
+logger = structlog.get_logger(__name__)
+
+DEFAULT_LEASE_SIZE = 100_000
+DEFAULT_LEASE_TTL = 60.0
+# claims of a lease still left with missing blocks before it is skipped
+DEFAULT_MAX_LEASE_ATTEMPTS = 5
+# seconds before a lease left with missing blocks may be claimed again
+LEASE_RETRY_DELAY = 30.0
+# seconds between claim attempts while other workers hold the rest
+LEASE_POLL_INTERVAL = 5.0
+
+SEED_LEASES_SQL = """
+INSERT INTO dpds_populate_leases (start_block, end_block, completed, attempts)
+VALUES ($1, $2, false, 0)
+ON CONFLICT (start_block) DO UPDATE SET
+    end_block = GREATEST(dpds_populate_leases.end_block, EXCLUDED.end_block),
+    completed = false,
+    attempts = 0
+"""
+
+CLAIM_LEASE_SQL = """
+UPDATE dpds_populate_leases
+SET owner = $1, expires_at = now() + make_interval(secs => $2),
+    attempts = attempts + 1
+WHERE start_block = (
+    SELECT start_block FROM dpds_populate_leases
+    WHERE NOT completed AND attempts < $3
+        AND (expires_at IS NULL OR expires_at < now())
+    ORDER BY start_block
+    LIMIT 1
+    FOR UPDATE SKIP LOCKED
+)
+RETURNING start_block, end_block
+"""
+
+RENEW_LEASE_SQL = """
+UPDATE dpds_populate_leases
+SET expires_at = now() + make_interval(secs => $3)
+WHERE start_block = $1 AND owner = $2 AND NOT completed
+RETURNING start_block
+"""
+
+COMPLETE_LEASE_SQL = """
+UPDATE dpds_populate_leases
+SET completed = true, owner = NULL, expires_at = NULL
+WHERE start_block = $1 AND owner = $2
+"""
+
+RELEASE_LEASE_SQL = """
+UPDATE dpds_populate_leases
+SET owner = NULL, expires_at = now() + make_interval(secs => $3)
+WHERE start_block = $1 AND owner = $2
+"""
+
+REMAINING_LEASES_SQL = """
+SELECT EXISTS (
+    SELECT 1 FROM dpds_populate_leases WHERE NOT completed AND attempts < $1
+)
+"""
+
+
+class LeaseLost(Exception):
+    """A lease expired and may have been claimed by another worker"""
+
+
+def lease_owner(worker_num=0):
+    return f'{socket.gethostname()}:{os.getpid()}:{worker_num}'
+
+
+def lease_ranges(ranges, lease_size=DEFAULT_LEASE_SIZE):
+    """Aligned (start, end) leases covering inclusive block ranges
+
+    Leases start at multiples of lease_size, so the first may start before
+    the ranges do, and end at the last block of the ranges they cover.
+    """
+    leases = {}
+    for start, end in ranges:
+        for lease_start in range(start - start % lease_size, end + 1,
+                                 lease_size):
+            lease_end = min(lease_start + lease_size - 1, end)
+            leases[lease_start] = max(
+                leases.get(lease_start, lease_end), lease_end)
+    return sorted(leases.items())
+
+
+async def seed_leases(pool, ranges, lease_size=DEFAULT_LEASE_SIZE):
+    """Create or reopen the leases covering ranges, returns how many"""
+    leases = lease_ranges(ranges, lease_size)
+    async with pool.acquire() as conn:
+        await conn.executemany(SEED_LEASES_SQL, leases)
+    return len(leases)
+
+
+async def claim_lease(pool, owner, ttl=DEFAULT_LEASE_TTL,
+                      max_attempts=DEFAULT_MAX_LEASE_ATTEMPTS):
+    """Claim the lowest unheld lease, returns its (start, end) or None"""
+    async with pool.acquire() as conn:
+        row = await conn.fetchrow(CLAIM_LEASE_SQL, owner, float(ttl),
+                                  max_attempts)
+    if row is None:
+        return None
+    return row['start_block'], row['end_block']
+
+
+async def renew_lease(pool, start_block, owner, ttl=DEFAULT_LEASE_TTL):
+    """Extend a held lease, returns False if it is no longer held by owner"""
+    async with pool.acquire() as conn:
+        return await conn.fetchval(RENEW_LEASE_SQL, start_block, owner,
+                                   float(ttl)) is not None
+
+
+async def complete_lease(pool, start_block, owner):
+    async with pool.acquire() as conn:
+        await conn.execute(COMPLETE_LEASE_SQL, start_block, owner)
+
+
+async def release_lease(pool, start_block, owner,
+                        retry_delay=LEASE_RETRY_DELAY):
+    """Give a lease up, claimable again after retry_delay seconds"""
+    async with pool.acquire() as conn:
+        await conn.execute(RELEASE_LEASE_SQL, start_block, owner,
+                           float(retry_delay))
+
+
+async def has_remaining_leases(pool, max_attempts=DEFAULT_MAX_LEASE_ATTEMPTS):
+    async with pool.acquire() as conn:
+        return await conn.fetchval(REMAINING_LEASES_SQL, max_attempts)
+
+
+async def hold_lease(pool, start_block, owner, coro, ttl=DEFAULT_LEASE_TTL):
+    """Await coro while renewing the lease every third of its ttl
+
+    Raises `LeaseLost`, cancelling coro, if a renewal finds the lease gone.
+    """
+    task = asyncio.ensure_future(coro)
+    try:
+        while True:
+            done, _ = await asyncio.wait([task], timeout=ttl / 3)
+            if done:
+                return task.result()
+            if not await renew_lease(pool, start_block, owner, ttl):
+                raise LeaseLost(start_block)
+    finally:
+        task.cancel()
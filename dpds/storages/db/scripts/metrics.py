@@ -0,0 +1,265 @@
+# -*- coding: utf-8 -*-
+"""Minimal Prometheus text-format metrics for populate
+
+Counters, gauges and histograms are registered on `REGISTRY` when defined
+and served in the Prometheus text exposition format by
+`start_metrics_server`.
+"""
+import math
+
+import structlog
+from aiohttp import web
+
+logger = structlog.get_logger(__name__)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+DEFAULT_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60)
+
+
+def format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if value == -math.inf:
+        return '-Inf'
+    if value != value:
+        return 'NaN'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (
+        str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+        for value in labels.values())
+    return '{' + ','.join(f'{name}="{value}"'
+                          for name, value in zip(labels.keys(), escaped)) + '}'
+
+
+class Registry(object):
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.type_name}')
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+class Metric(object):
+    type_name = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        if not self.labelnames:
+            # unlabelled metrics are exported as 0 before their first update
+            self.labels()
+        if registry is not None:
+            registry.register(self)
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        child = self._children.get(key)
+        if child is None:
+            child = self._children[key] = self._new_child()
+        return child
+
+    def _labelled_children(self):
+        for key, child in sorted(self._children.items()):
+            yield dict(zip(self.labelnames, key)), child
+
+    def samples(self):
+        for labels, child in self._labelled_children():
+            yield (f'{self.name}{format_labels(labels)} '
+                   f'{format_value(child.get())}')
+
+
+class _Value(object):
+    def __init__(self):
+        self.value = 0.0
+        self.function = None
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def dec(self, amount=1):
+        self.value -= amount
+
+    def set(self, value):
+        self.value = value
+
+    def set_function(self, function):
+        """Read the value from function at scrape time"""
+        self.function = function
+
+    def get(self):
+        if self.function is not None:
+            return self.function()
+        return self.value
+
+
+class Counter(Metric):
+    type_name = 'counter'
+    _new_child = _Value
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+
+class Gauge(Metric):
+    type_name = 'gauge'
+    _new_child = _Value
+
+    def set(self, value):
+        self.labels().set(value)
+
+    def set_function(self, function):
+        self.labels().set_function(function)
+
+
+class _HistogramValue(object):
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.sum += value
+        self.count += 1
+        for i, upper_bound in enumerate(self.buckets):
+            if value <= upper_bound:
+                self.counts[i] += 1
+                break
+
+
+class Histogram(Metric):
+    type_name = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(),
+                 buckets=DEFAULT_BUCKETS, registry=REGISTRY):
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        super(Histogram, self).__init__(name, documentation, labelnames,
+                                        registry=registry)
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def samples(self):
+        for labels, child in self._labelled_children():
+            cumulative = 0
+            for upper_bound, count in zip(self.buckets, child.counts):
+                cumulative += count
+                bucket_labels = dict(labels, le=format_value(upper_bound))
+                yield (f'{self.name}_bucket{format_labels(bucket_labels)} '
+                       f'{cumulative}')
+            yield (f'{self.name}_sum{format_labels(labels)} '
+                   f'{format_value(child.sum)}')
+            yield f'{self.name}_count{format_labels(labels)} {child.count}'
+
+
+async def start_metrics_server(host, port, registry=REGISTRY):
+    """Serve registry at http://host:port/metrics, returns the runner to clean
+    up"""
+    async def handle_metrics(request):
+        return web.Response(body=registry.render().encode(),
+                            headers={'Content-Type': CONTENT_TYPE})
+
+    app = web.Application()
+    app.router.add_get('/metrics', handle_metrics)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    logger.info('serving metrics', url=f'http://{host}:{port}/metrics')
+    return runner
+
+
+# --- populate metrics ---
+
+BLOCKS_STORED = Counter('dpds_populate_blocks_stored_total',
+                        'Blocks stored')
+OPS_STORED = Counter('dpds_populate_ops_stored_total',
+                     'Operations stored, by operation type',
+                     ['operation_type'])
+QUEUE_DEPTH = Gauge('dpds_populate_queue_depth',
+                    'Chunks waiting for each pipeline stage',
+                    ['stage'])
+RPC_LATENCY = Histogram('dpds_populate_rpc_latency_seconds',
+                        'Latency of successful JSON-RPC block batches')
+RPC_PAYLOAD_BYTES = Histogram(
+    'dpds_populate_rpc_payload_bytes',
+    'Response size of successful JSON-RPC block batches',
+    buckets=[2 ** n for n in range(10, 28, 2)])
+RPC_RETRIES = Counter('dpds_populate_rpc_retries_total',
+                      'Failed JSON-RPC block batch attempts')
+RPC_FAILED_BATCHES = Counter(
+    'dpds_populate_rpc_failed_batches_total',
+    'JSON-RPC block batches given up on after their retries')
+RPC_BATCH_SIZE = Gauge('dpds_populate_rpc_batch_size',
+                       'Current JSON-RPC batch size')
+RPC_CONCURRENCY = Gauge('dpds_populate_rpc_concurrency',
+                        'Current limit of JSON-RPC batches in flight')
+RPC_IN_FLIGHT = Gauge('dpds_populate_rpc_in_flight',
+                      'JSON-RPC batches in flight')
+RPC_ENDPOINT_LATENCY = Gauge(
+    'dpds_populate_rpc_endpoint_latency_seconds',
+    'EWMA of JSON-RPC request latency per dpayd endpoint', ['endpoint'])
+RPC_ENDPOINT_ERROR_RATE = Gauge(
+    'dpds_populate_rpc_endpoint_error_rate',
+    'EWMA of JSON-RPC request failures per dpayd endpoint', ['endpoint'])
+RPC_ENDPOINT_UP = Gauge(
+    'dpds_populate_rpc_endpoint_up',
+    '1 while a dpayd endpoint is admitted, 0 while its circuit breaker is open',
+    ['endpoint'])
+RPC_CACHE_HITS = Counter(
+    'dpds_populate_rpc_cache_hits_total',
+    'JSON-RPC block calls answered from the response cache')
+RPC_CACHE_MISSES = Counter(
+    'dpds_populate_rpc_cache_misses_total',
+    'JSON-RPC block calls sent to dpayd with a response cache')
+RPC_CACHE_BYTES = Gauge('dpds_populate_rpc_cache_bytes',
+                        'Compressed size of the cached responses')
+DB_WRITE_LATENCY = Histogram('dpds_populate_db_write_seconds',
+                             'Time to write one chunk\'s rows to a table',
+                             ['table'])
+DB_COMMIT_LATENCY = Histogram('dpds_populate_db_commit_seconds',
+                              'Time to write and commit one chunk')
+LAST_IRREVERSIBLE_BLOCK_NUM = Gauge('dpds_populate_last_irreversible_block_num',
+                                    'Last irreversible block reported by dpayd')
+LAST_STORED_BLOCK_NUM = Gauge('dpds_populate_last_stored_block_num',
+                              'Highest block_num stored by this process')
+COMMIT_WATERMARK = Gauge(
+    'dpds_populate_commit_watermark',
+    'Highest block_num with every block up to it committed')
+WATERMARK_BUFFERED_BLOCKS = Gauge('dpds_populate_watermark_buffered_blocks',
+                                  'Blocks committed above the commit watermark')
+LAG_BLOCKS = Gauge(
+    'dpds_populate_lag_blocks',
+    'Blocks between the last irreversible block and the last stored block')
+LAG_SECONDS = Gauge('dpds_populate_lag_seconds',
+                    'Age of the last stored block, while following')
+LAG_BLOCKS.set_function(lambda: max(LAST_IRREVERSIBLE_BLOCK_NUM.labels().get()
+                                    - LAST_STORED_BLOCK_NUM.labels().get(), 0))
@@ -1,7 +1,13 @@
 # -*- coding: utf-8 -*-
 import asyncio
+import concurrent.futures
+import datetime
 import itertools as it
+import multiprocessing
 import os
+import time
+from collections import Counter
+from collections import namedtuple
 from functools import partial
 import aiopg.sa
 import asyncpg
@@ -10,6 +16,7 @@ import click
 from asyncio import Queue
 
 import aiofiles
+import dateutil.parser
 import uvloop
 from tqdm import tqdm
 import psycopg2
@@ -18,23 +25,74 @@ import funcy
 from sqlalchemy.engine.url import make_url
 import rapidjson as json
 import structlog
-import aiohttp
 
 from sqlalchemy.dialects import postgresql
 from sqlalchemy.dialects.postgresql import insert
-from aiohttp.connector import TCPConnector
 import asyncpg.exceptions
 
+from dpds.endpoints import CLOSED
+from dpds.http_client import AsyncDPayAPIClient
+from dpds.response_cache import DEFAULT_MAX_BYTES as DEFAULT_RPC_CACHE_MAX_BYTES
+from dpds.response_cache import ResponseCache
+from dpds.storages.db.scripts.account_names import DEFAULT_LOOKUP_REQUESTS
+from dpds.storages.db.scripts.account_names import lookup_account_names
+from dpds.storages.db.scripts.bulk_load import analyze_statements
+from dpds.storages.db.scripts.bulk_load import bulk_load_pending
+from dpds.storages.db.scripts.bulk_load import (
+    drop_deferred_indexes_and_foreign_keys)
+from dpds.storages.db.scripts.bulk_load import missing_deferred_foreign_keys
+from dpds.storages.db.scripts.bulk_load import missing_deferred_indexes
+from dpds.storages.db.scripts.bulk_load import not_validated_foreign_keys
+from dpds.storages.db.scripts.bulk_load import run_statements
+import dpds.storages.db.scripts.metrics as metrics
+from dpds.storages.db.scripts.fetch_control import DEFAULT_RPC_RETRIES
+from dpds.storages.db.scripts.fetch_control import FetchController
+from dpds.storages.db.scripts.leases import DEFAULT_LEASE_SIZE
+from dpds.storages.db.scripts.leases import DEFAULT_LEASE_TTL
+from dpds.storages.db.scripts.leases import DEFAULT_MAX_LEASE_ATTEMPTS
+from dpds.storages.db.scripts.leases import LEASE_POLL_INTERVAL
+from dpds.storages.db.scripts.leases import LeaseLost
+from dpds.storages.db.scripts.leases import claim_lease
+from dpds.storages.db.scripts.leases import complete_lease
+from dpds.storages.db.scripts.leases import has_remaining_leases
+from dpds.storages.db.scripts.leases import hold_lease
+from dpds.storages.db.scripts.leases import lease_owner
+from dpds.storages.db.scripts.leases import release_lease
+from dpds.storages.db.scripts.leases import seed_leases
+from dpds.storages.db.scripts.spool import Spool
+from dpds.storages.db.scripts.spool import decode_record
+from dpds.storages.db.scripts.watermark import CommitWatermark
+from dpds.storages.db.tables.async_core import load_raw_ops_sync
+from dpds.storages.db.tables.async_core import prepare_chunk_for_storage
+from dpds.storages.db.tables.async_core import prepare_compressed_chunk
 from dpds.storages.db.tables.async_core import prepare_raw_block_for_storage
-from dpds.storages.db.tables.operations import op_db_table_for_type
 from dpds.storages.db.tables.async_core import prepare_raw_operation_for_storage
+from dpds.storages.db.tables.block import MISSING_BLOCK_RANGES_SQL
+from dpds.storages.db.tables.core import extract_raw_operations_from_block
+from dpds.storages.db.tables.insert_plans import ACCOUNT_INSERT_PLAN
+from dpds.storages.db.tables.insert_plans import BLOCK_INSERT_PLAN
+from dpds.storages.db.tables.insert_plans import OP_INSERT_PLANS
+from dpds.storages.db.tables.insert_plans import build_insert_plan
+from dpds.storages.db.tables.insert_plans import op_insert_plan
+from dpds.storages.db.tables.partitions import PARTITION_BOUNDS_SQL
+from dpds.storages.db.tables.partitions import create_partition_sql
+from dpds.storages.db.tables.partitions import missing_partitions
+from dpds.storages.db.tables.partitions import partition_layout
 from dpds.storages.db.tables import Base
 from dpds.storages.db.tables.meta.accounts import extract_account_names
 
 from dpds.storages.db.tables import init_tables
 from dpds.storages.db.tables import test_connection
 from dpds.storages.db.utils import isolated_engine
+from dpds.storages.fs.local import DEFAULT_MAX_OPEN_FILES
+from dpds.storages.fs.local import FsBlockStore
+from dpds.utils import backoff_delay
+from dpds.utils import block_num_ranges
 from dpds.utils import chunkify
+from dpds.utils import fetched_prefix
+from dpds.utils import merge_ranges
+from dpds.utils import missing_ranges
+from dpds.utils import range_block_nums
 
 import dpds.dpds_logging
 
@@ -43,37 +101,30 @@ logger = structlog.get_logger(__name__)
 
 TOTAL_TASKS = 7
 
-STATEMENT_CACHE = {
-    'account': 'INSERT INTO dpds_meta_accounts (name) VALUES($1) ON CONFLICT DO NOTHING',
-    'block': 'INSERT INTO dpds_core_blocks (raw, block_num, previous, timestamp, witness, witness_signature, transaction_merkle_root) VALUES ($1, $2, $3, $4, $5, $6, $7) ON CONFLICT DO NOTHING'
-}
+STAGING_TABLE_PREFIX = 'dpds_staging_'
+
+# room for every insert plan in each connection's prepared statement cache
+STATEMENT_CACHE_SIZE = len(OP_INSERT_PLANS) + 100
+
+# seconds between merges of dpds_populate_progress rows
+PROGRESS_COMPACT_INTERVAL = 60
+
+# seconds between last irreversible block polls while streaming
+LIB_POLL_INTERVAL = 0.5
+
+# copy: binary COPY of a whole chunk into staging tables, merged per table
+# executemany: one executemany per table for a whole chunk
+# rows: one prepared INSERT per block and operation (fallback)
+WRITE_MODES = ('copy', 'executemany', 'rows')
+
+# op tables are labelled with their operation type in metrics
+OPERATION_TYPES_BY_TABLE = {plan.table_name: op_type
+                            for op_type, plan in OP_INSERT_PLANS.items()}
 
 asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
 loop = asyncio.get_event_loop()
 
 
-pbar_kwargs = dict(
-    color=True,
-    show_eta=False,
-    show_percent=False,
-    empty_char='░',
-    fill_char='█',
-    show_pos=True,
-    bar_template='%(bar)s  %(info)s')
-
-
-def get_op_insert_stmt(prepared_op, db_tables):
-    stmt = STATEMENT_CACHE.get('type')
-    if stmt:
-        return stmt
-    op_type = prepared_op['operation_type']
-    table = db_tables[op_db_table_for_type(op_type)]
-    values_str = ', '.join(
-        f'${i}' for i in range(1, len(prepared_op.keys()) + 1))
-    columns_str = ', '.join(f'"{k}"' for k in prepared_op.keys())
-    STATEMENT_CACHE[op_type] = f'INSERT INTO {table} ({columns_str}) VALUES({values_str}) ON CONFLICT DO NOTHING'
-    return STATEMENT_CACHE[op_type]
-
 def create_async_engine(database_url, loop=None, minsize=40, maxsize=50, **kwargs):
     sa_db_url = make_url(database_url)
     loop = loop or asyncio.get_event_loop()
@@ -89,34 +140,56 @@ def create_async_engine(database_url, loop=None, minsize=40, maxsize=50, **kwarg
             **kwargs))
     return async_engine
 
-def create_asyncpg_pool(database_url,loop=None,min_size=40, max_size=40, **kwargs):
+def create_asyncpg_pool(database_url,loop=None,min_size=40, max_size=40,
+                        statement_cache_size=STATEMENT_CACHE_SIZE, **kwargs):
     loop = loop or asyncio.get_event_loop()
-    return loop.run_until_complete(asyncpg.create_pool(database_url,
-                                                       min_size=min_size,
-                                                       max_size=max_size,
-                                                       **kwargs))
+    return loop.run_until_complete(
+        asyncpg.create_pool(
+            database_url, min_size=min_size, max_size=max_size,
+            statement_cache_size=statement_cache_size, **kwargs))
 
 
-def as_completed_limit_concurrent(coros_or_futures, concurrency_limit):
-    futures = [
-        asyncio.ensure_future(c)
-        for c in it.islice(coros_or_futures, 0, concurrency_limit)
-    ]
-    async def next_done():
-        while True:
-            await asyncio.sleep(0)
-            for f in futures:
-                if f.done():
-                    futures.remove(f)
-                    try:
-                        new_future = next(coros_or_futures)
-                        futures.append(
-                            asyncio.ensure_future(new_future))
-                    except StopIteration:
-                        pass
-                    return f.result()
-    while len(futures) > 0:
-        yield next_done()
+def create_rpc_client(dpayd_http_url, limit=100, rpc_cache_path=None,
+                      rpc_cache_max_bytes=DEFAULT_RPC_CACHE_MAX_BYTES):
+    cache = None
+    if rpc_cache_path:
+        cache = ResponseCache(rpc_cache_path, max_bytes=rpc_cache_max_bytes)
+    return AsyncDPayAPIClient(dpayd_http_url, limit=limit,
+                              json_loads=json.loads, cache=cache)
+
+
+async def close_rpc_client(client):
+    await client.close()
+    if client.cache is not None:
+        client.cache.close()
+
+
+def track_endpoint_metrics(endpoint):
+    metrics.RPC_ENDPOINT_LATENCY.labels(endpoint=endpoint.url).set_function(
+        lambda: endpoint.latency)
+    metrics.RPC_ENDPOINT_ERROR_RATE.labels(endpoint=endpoint.url).set_function(
+        lambda: endpoint.error_rate)
+    metrics.RPC_ENDPOINT_UP.labels(endpoint=endpoint.url).set_function(
+        lambda: int(endpoint.state == CLOSED))
+
+
+def track_rpc_cache_metrics(cache):
+    metrics.RPC_CACHE_HITS.labels().set_function(lambda: cache.hits)
+    metrics.RPC_CACHE_MISSES.labels().set_function(lambda: cache.misses)
+    metrics.RPC_CACHE_BYTES.set_function(lambda: cache.size)
+
+
+def build_fetch(source, client, controller,
+                max_open_files=DEFAULT_MAX_OPEN_FILES,
+                rpc_retries=DEFAULT_RPC_RETRIES, virtual_ops_only=False):
+    """Return the fs store, or None, and the fetch stage for source"""
+    if source.startswith('fs:'):
+        store = FsBlockStore(source[len('fs:'):], max_open_files=max_open_files)
+        return store, partial(local_fetch_blocks_and_ops_in_blocks, store)
+    return None, partial(fetch_chunk, client,
+                         controller=controller, retries=rpc_retries,
+                         only_virtual=virtual_ops_only)
+
 
 def fmt_success_message(msg, *args):
     base_msg = msg % args
@@ -143,33 +216,44 @@ def fmt_task_message(task_msg,
 
 
 
-def get_account_names(url):
-    import requests
-    RequestsSession = requests.Session()
-    lower_bound_name  = 'a'
-    limit = 1000
-    accts = list()
+async def store_account_names(pool, account_names):
+    """COPY account_names into dpds_meta_accounts, skipping existing names"""
+    account_name_records = [
+        (a,) for a in new_account_names(None, account_names)]
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            await copy_records_to_table(conn,
+                                        ACCOUNT_INSERT_PLAN.table_name,
+                                        ACCOUNT_INSERT_PLAN.columns,
+                                        account_name_records)
+    return len(account_name_records)
+
+
+async def preload_account_names(pool, account_names):
     try:
-        while True:
-            resp = RequestsSession.post(url,json={'id':1,'jsonrpc':'2.0','method':'lookup_accounts','params':[lower_bound_name, limit]})
-            accounts_in_resp = resp.json()['result']
-            accts.extend(accounts_in_resp)
-            if lower_bound_name == accounts_in_resp[-1]:
-                break
-            lower_bound_name = accounts_in_resp[-1]
+        await store_account_names(pool, account_names)
     except Exception as e:
-            print(e)
-    return sorted(list(set(accts)))
+        logger.exception('error preloading account names', e=e)
 
-async def preload_account_names(pool, account_names):
-    non_blank_account_names = (a for a in account_names if a not in ('',None))
-    unique_account_names = set(non_blank_account_names)
-    account_name_records = [(a,) for a in unique_account_names]
-    async with pool.acquire() as conn:
-        try:
-           await conn.copy_records_to_table('dpds_meta_accounts', records=account_name_records)
-        except Exception as e:
-            logger.exception('error preloading account names', e=e)
+
+async def preload_account_names_from_dpayd(
+        pool, client, requests=DEFAULT_LOOKUP_REQUESTS, pbar=None):
+    """Page every account name out of dpayd concurrently, storing each page
+    as it arrives
+
+    Returns the number of names looked up.
+    """
+    name_count = 0
+
+    async def store_page(names):
+        nonlocal name_count
+        await store_account_names(pool, names)
+        name_count += len(names)
+        if pbar:
+            pbar.update(len(names))
+
+    await lookup_account_names(client, store_page, requests=requests)
+    return name_count
 
 def task_confirm_db_connectivity(database_url):
     url, table_count = test_connection(database_url)
@@ -183,9 +267,43 @@ def task_confirm_db_connectivity(database_url):
         raise Exception('Unable to connect to database')
 
 
-def task_init_db_if_required(database_url):
+def task_init_db_if_required(database_url, partition_width=None):
+
+    init_tables(database_url, Base.metadata, partition_width=partition_width)
+
+
+async def restore_indexes_and_foreign_keys(pool, workers=4, analyze=True):
+    """Rebuild the indexes and foreign keys dropped for a bulk load
 
-    init_tables(database_url, Base.metadata)
+    Indexes are built and foreign keys validated by up to workers
+    connections at once, then the rebuilt tables are analyzed. Returns the
+    number of statements run.
+    """
+    steps = [
+        ('Rebuilding indexes', ' indexes', missing_deferred_indexes),
+        ('Adding foreign keys', ' keys', missing_deferred_foreign_keys),
+        ('Validating foreign keys', ' keys', not_validated_foreign_keys),
+    ]
+    statement_count = 0
+    for description, unit, find_statements in steps:
+        statements = await find_statements(pool)
+        if not statements:
+            continue
+        statement_count += len(statements)
+        click.echo(f'{description} ({len(statements)})')
+        pbar = tqdm(total=len(statements), dynamic_ncols=False, unit=unit)
+        failed = await run_statements(
+            pool, statements, workers=workers, pbar=pbar)
+        pbar.close()
+        if failed:
+            logger.error(f'{description} failed', failed=failed)
+    if analyze and statement_count:
+        statements = analyze_statements()
+        click.echo(f'Analyzing tables ({len(statements)})')
+        pbar = tqdm(total=len(statements), dynamic_ncols=False, unit=' tables')
+        await run_statements(pool, statements, workers=workers, pbar=pbar)
+        pbar.close()
+    return statement_count
 
 
 def task_load_db_meta(database_url):
@@ -196,14 +314,26 @@ def task_load_db_meta(database_url):
     return m
 
 
-def is_name_missing_from_accounts_error(e):
-    # Key (worker_account)=(kevtorin) is not present in table "dpds_meta_accounts"
-    err_str = e.detail
-    return 'is not present in table "dpds_meta_accounts"' in err_str
+async def load_known_account_names(pool):
+    """Return the set of names in dpds_meta_accounts"""
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            return {record['name'] async for record in
+                    conn.cursor('SELECT name FROM dpds_meta_accounts',
+                                prefetch=10_000)}
+
 
+def new_account_names(known_account_names, account_names):
+    """Names not yet in dpds_meta_accounts, sorted so concurrent chunks
+    lock the rows they insert in the same order
 
-def missing_account_name_from_error(e):
-    return e.detail.split('=')[1].split(')')[0].replace('(', '')  # hehe
+    Without a known_account_names cache every name is treated as new.
+    """
+    account_names = set(account_names)
+    account_names.difference_update(('', None))
+    if known_account_names is not None:
+        account_names.difference_update(known_account_names)
+    return sorted(account_names)
 
 
 async def get_existing_and_missing_count(engine, start_block, end_block):
@@ -216,78 +346,252 @@ async def get_existing_and_missing_count(engine, start_block, end_block):
 
 async def get_latest_db_block_num(engine):
     async with engine.acquire() as conn:
-        last_block_num = await conn.scalar('SELECT MAX(block_num) from dpds_core_blocks')
+        last_block_num = await conn.fetchval(
+            'SELECT MAX(block_num) from dpds_core_blocks')
     return last_block_num
 
 
-async def get_last_irreversible_block_num(url, client):
-    response = await client.post(url, data=f'{{"id":1,"jsonrpc":"2.0","method":"get_dynamic_global_properties"}}'.encode())
-    jsonrpc_response = await response.json()
-    return jsonrpc_response['result']['last_irreversible_block_num']
+async def get_last_irreversible_block_num(client):
+    last_irreversible_block_num = await client.last_irreversible_block_num()
+    metrics.LAST_IRREVERSIBLE_BLOCK_NUM.set(last_irreversible_block_num)
+    return last_irreversible_block_num
 
 
-async def collect_missing_block_nums(engine, last_chain_block, missing_count, start_block=None, pbar=None):
-    BLOCKNUM_CHUNK_SEARCH_SIZE = 10_000
-    start_block = start_block or 1
-    complete_block_nums = range(start_block, last_chain_block + 1)
+async def stream_missing_block_ranges(pool, start_block, end_block,
+                                      fetch_size=10_000):
+    """Yield inclusive (start, end) ranges of block_nums missing from
+    dpds_core_blocks, found by the database rather than in Python"""
+    query = MISSING_BLOCK_RANGES_SQL.format(start_block='$1', end_block='$2')
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            async for row in conn.cursor(query, start_block, end_block,
+                                         prefetch=fetch_size):
+                yield row['start_block'], row['end_block']
 
-    if missing_count == last_chain_block:
-        return complete_block_nums
-    missing_block_nums = set(complete_block_nums)
-    query = 'SELECT block_num from dpds_core_blocks WHERE block_num>=$1'
 
-    async with engine.acquire() as conn:
-        async with conn.transaction():
-            cursor = await conn.cursor(query,start_block)
-            while True:
-                rows = await cursor.fetch(BLOCKNUM_CHUNK_SEARCH_SIZE)
-                if not rows:
-                    break
-                missing_block_nums.difference_update(set(b[0] for b in rows))
-                if pbar:
-                    pbar.update(BLOCKNUM_CHUNK_SEARCH_SIZE)
-    pbar.update(len(missing_block_nums))
-    return missing_block_nums
+async def find_missing_block_ranges(pool, start_block, end_block):
+    return [r async for r in
+            stream_missing_block_ranges(pool, start_block, end_block)]
 
 
-# --- Blocks ---
-async def fetch_blocks_and_ops_in_blocks(url, client, block_nums):
-    request_data = ','.join(
-        f'{{"id":{block_num},"jsonrpc":"2.0","method":"get_block","params":[{block_num}]}},{{"id":{block_num},"jsonrpc":"2.0","method":"get_ops_in_block","params":[{block_num},false]}}'
-        for block_num in block_nums)
-    request_json = f'[{request_data}]'.encode()
-    response = 'n/a'
+# --- Progress ---
+async def record_completed_block_nums(conn, block_nums):
+    """Record committed block_nums as completed ranges, call inside the
+    transaction which stored the blocks"""
+    await conn.executemany(
+        'INSERT INTO dpds_populate_progress (start_block, end_block) '
+        'VALUES ($1, $2) ON CONFLICT (start_block) DO UPDATE SET end_block = '
+        'GREATEST(dpds_populate_progress.end_block, EXCLUDED.end_block)',
+        block_num_ranges(block_nums))
+
+
+async def load_watermark(pool):
+    """Return the stored commit watermark, 0 if none has been stored"""
+    async with pool.acquire() as conn:
+        watermark = await conn.fetchval(
+            'SELECT block_num FROM dpds_populate_watermark WHERE id = 1')
+    return watermark or 0
+
+
+async def store_watermark(pool, block_num):
+    """Raise the stored commit watermark to block_num, never lowering it"""
+    async with pool.acquire() as conn:
+        await conn.execute(
+            'INSERT INTO dpds_populate_watermark (id, block_num) '
+            'VALUES (1, $1) ON CONFLICT (id) DO UPDATE SET block_num = '
+            'GREATEST(dpds_populate_watermark.block_num, EXCLUDED.block_num)',
+            block_num)
+
+
+async def advance_watermark(pool, watermark, block_nums):
+    """Record committed block_nums and store the watermark if it advanced"""
+    advanced = watermark.commit(block_nums)
+    metrics.COMMIT_WATERMARK.set(watermark.watermark)
+    metrics.WATERMARK_BUFFERED_BLOCKS.set(watermark.buffered_count)
+    if advanced:
+        await store_watermark(pool, watermark.watermark)
+    return advanced
+
+
+async def clear_watermark(pool):
+    """Delete the stored commit watermark, which a run without one won't keep up
+    to date"""
+    async with pool.acquire() as conn:
+        await conn.execute('DELETE FROM dpds_populate_watermark')
+
+
+async def init_watermark(pool, stored_watermark, missing_block_ranges,
+                         start_block, end_block):
+    """Return a `CommitWatermark` counting every block in start_block
+    through end_block not in missing_block_ranges as committed, storing the
+    watermark if that advances it"""
+    watermark = CommitWatermark(stored_watermark,
+                                missing_ranges(missing_block_ranges,
+                                               start_block, end_block))
+    if watermark.watermark > stored_watermark:
+        await store_watermark(pool, watermark.watermark)
+    metrics.COMMIT_WATERMARK.set(watermark.watermark)
+    return watermark
+
+
+async def compact_completed_ranges(pool):
+    """Merge adjacent dpds_populate_progress rows and return the merged
+    ranges"""
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            # block concurrent inserts, not concurrent reads
+            await conn.execute(
+                'LOCK TABLE dpds_populate_progress IN SHARE ROW EXCLUSIVE MODE')
+            rows = await conn.fetch(
+                'SELECT start_block, end_block FROM dpds_populate_progress')
+            merged = merge_ranges((row['start_block'], row['end_block'])
+                                  for row in rows)
+            if len(merged) < len(rows):
+                await conn.execute('DELETE FROM dpds_populate_progress')
+                await conn.executemany(
+                    'INSERT INTO dpds_populate_progress (start_block, '
+                    'end_block) VALUES ($1, $2)', merged)
+    return merged
+
+
+async def compact_completed_ranges_periodically(
+        pool, interval=PROGRESS_COMPACT_INTERVAL):
     while True:
+        await asyncio.sleep(interval)
         try:
-            response = await client.post(url, data=request_json)
-            jsonrpc_response = await response.json()
-            response_pairs = funcy.partition(2,jsonrpc_response)
-            results = []
-            for get_block, get_ops in response_pairs:
-                assert get_block['id'] == get_ops['id']
-                results.append((get_block['id'],get_block['result'],get_ops['result']))
-            assert len(results) == len(block_nums)
-            return results
+            await compact_completed_ranges(pool)
         except Exception as e:
-            logger.exception('error fetching ops in block',
-                             e=e, response=response)
+            logger.exception('error compacting populate progress', e=e)
 
-async def local_fetch_blocks_and_ops_in_blocks(local_path, block_nums):
-    try:
-        results = []
-        for block_num in block_nums:
-            with aiofiles.open(f'{local_path}/{block_num}/block.json') as f:
-                raw_block = await f.read()
-            with aiofiles.open(f'{local_path}/{block_num}/ops.json') as f:
-               raw_ops = await f.read()
-            block = json.loads(raw_block)
-            ops = json.loads(raw_ops)
-            results.append((block_num,block,ops))
-        assert len(results) == len(block_nums)
-        return results
-    except Exception as e:
-            logger.exception('error ly localfetching block and/or ops in block',
-                             e=e, local_path=local_path)
+
+async def seed_completed_ranges(pool, start_block, end_block):
+    """Record ranges for blocks stored before progress was tracked"""
+    gaps = await find_missing_block_ranges(pool, start_block, end_block)
+    completed = missing_ranges(gaps, start_block, end_block)
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            await conn.executemany(
+                'INSERT INTO dpds_populate_progress (start_block, end_block) '
+                'VALUES ($1, $2) ON CONFLICT DO NOTHING', completed)
+    return await compact_completed_ranges(pool)
+
+
+async def get_missing_block_ranges(pool, start_block, end_block, watermark=0):
+    """Return the inclusive ranges between start_block and end_block which
+    have not been committed
+
+    Every block up to watermark is known to be committed.
+    """
+    completed = await compact_completed_ranges(pool)
+    if not completed and not watermark and await get_latest_db_block_num(pool):
+        completed = await seed_completed_ranges(pool, start_block, end_block)
+    if watermark:
+        completed = completed + [(1, watermark)]
+    return missing_ranges(completed, start_block, end_block)
+
+
+def count_range_block_nums(ranges):
+    return sum(end - start + 1 for start, end in ranges)
+
+
+# --- Blocks ---
+async def fetch_blocks_and_ops_in_blocks(client, block_nums, controller=None,
+                                         retries=DEFAULT_RPC_RETRIES,
+                                         only_virtual=False):
+    """Fetch blocks and their ops in one JSON-RPC batch
+
+    Failed attempts back off with jitter and are retried at most retries
+    times, after which an empty list is returned so the batch's blocks are
+    left missing for a later sweep.
+
+    With only_virtual, only virtual ops are fetched and the rest are built
+    from the blocks' transactions, so non-virtual ops aren't downloaded and
+    decoded twice. Blocks without transaction_ids to build them from have
+    their ops fetched in full instead.
+    """
+    if controller is None:
+        controller = FetchController(batch_size=len(block_nums))
+    calls = list(it.chain.from_iterable(
+        (('get_block', block_num),
+         ('get_ops_in_block', block_num, only_virtual))
+        for block_num in block_nums))
+    request_json = client.batch_body(calls)
+    results = None
+    for attempt in range(retries + 1):
+        if attempt:
+            await asyncio.sleep(backoff_delay(attempt))
+        await controller.acquire()
+        start = time.perf_counter()
+        try:
+            # posted separately from client.batch to measure the body
+            body, responses = await client.post(request_json)
+            batch_results = client.batch_results(responses, len(calls))
+            results = list(
+                zip(block_nums, batch_results[::2], batch_results[1::2]))
+        except Exception as e:
+            results = None
+            controller.record_failure()
+            metrics.RPC_RETRIES.inc()
+            logger.warning('error fetching ops in block',
+                           e=e, attempt=attempt + 1,
+                           block_ranges=block_num_ranges(block_nums))
+        else:
+            latency = time.perf_counter() - start
+            controller.record_success(latency, len(body), len(block_nums))
+            metrics.RPC_LATENCY.observe(latency)
+            metrics.RPC_PAYLOAD_BYTES.observe(len(body))
+            break
+        finally:
+            await controller.release()
+    if results is None:
+        metrics.RPC_FAILED_BATCHES.inc()
+        logger.error('giving up on blocks, leaving them for a later sweep',
+                     block_ranges=block_num_ranges(block_nums), retries=retries)
+        return []
+    if only_virtual:
+        results = await add_operations_from_blocks(
+            client, results, controller, retries)
+    return results
+
+
+async def add_operations_from_blocks(client, results, controller,
+                                     retries=DEFAULT_RPC_RETRIES):
+    """Add the ops built from each block to its fetched virtual ops"""
+    with_ops = {}
+    without_transaction_ids = []
+    for block_num, raw_block, virtual_ops in results:
+        try:
+            raw_ops = list(
+                extract_raw_operations_from_block(raw_block, block_num))
+        except ValueError:
+            without_transaction_ids.append(block_num)
+            continue
+        with_ops[block_num] = (block_num, raw_block,
+                               raw_ops + (virtual_ops or []))
+    if without_transaction_ids:
+        logger.warning(
+            'blocks have no transaction_ids, fetching their ops in full',
+            block_ranges=block_num_ranges(without_transaction_ids))
+        for result in await fetch_blocks_and_ops_in_blocks(
+                client, without_transaction_ids, controller=controller,
+                retries=retries):
+            with_ops[result[0]] = result
+    return [with_ops[block_num] for block_num, _, _ in results
+            if block_num in with_ops]
+
+async def local_fetch_blocks_and_ops_in_blocks(store, block_nums):
+    """Read blocks and their ops from a `FsBlockStore`
+
+    Blocks missing from the store are left out of the results and so stay
+    missing from the db.
+    """
+    results = await store.read_blocks_and_ops(block_nums)
+    if len(results) < len(block_nums):
+        fetched = {block_num for block_num, _, _ in results}
+        logger.error('blocks missing from fs store', path=store.path,
+                     block_ranges=block_num_ranges(n for n in block_nums
+                                                   if n not in fetched))
+    return results
 
 async def s3_fetch_blocks_and_ops_in_blocks(s3_url, s3_client, block_nums):
 
@@ -308,117 +612,44 @@ async def s3_fetch_blocks_and_ops_in_blocks(s3_url, s3_client, block_nums):
                              e=e, response=response)
 
 
-async def safe_store_block_and_ops(pool, db_tables, prepared_block, prepared_ops):
-    """Atomic add block,operations, and virtual operations in block
-
-
-
-    :param pool:
-    :param db_tables:
-    :param prepared_block:
-    :param prepared_ops:
-    :return:
-    """
-
-    raw_add_account_stmt = STATEMENT_CACHE['account']
-    raw_stmts = [(STATEMENT_CACHE['block'], prepared_block.values())]
-
-    # collect all account names referenced in block and ops
-    account_names_in_ops = extract_account_names(prepared_ops)
-    account_names_in_ops.add(prepared_block['witness'])
-    account_name_records = [(a,) for a in account_names_in_ops ]
-
+def block_and_ops_stmts(prepared_block, prepared_ops):
+    """Return (sql, args) for the block and each op from their insert plans"""
+    stmts = [(BLOCK_INSERT_PLAN.sql, BLOCK_INSERT_PLAN.record(prepared_block))]
     for prepared_op in prepared_ops:
-        raw_stmts.append((get_op_insert_stmt(prepared_op, db_tables), prepared_op.values()))
-
-    async with pool.acquire() as conn:
-        prepared_stmts = [await conn.prepare(stmt) for stmt,_ in raw_stmts]
-        add_acct_stmt = await conn.prepare(raw_add_account_stmt)
+        plan = op_insert_plan(prepared_op['operation_type'])
+        stmts.append((plan.sql, plan.record(prepared_op)))
+    return stmts
 
-        stmts = zip(prepared_stmts, (vals for _,vals in raw_stmts))
-        async with conn.transaction():
-            # add accounts first
-            await conn.executemany(raw_add_account_stmt, account_name_records)
 
-        async with conn.transaction():
-            # add block and ops
-            for i,stmt in enumerate(stmts):
-                query, args = stmt
-                while True:
-                    stmt_tr = conn.transaction()
-                    await stmt_tr.start()
-                    try:
-                        await query.fetchval(*args)
-                        await stmt_tr.commit()
-                        break
-                    except (asyncpg.exceptions.ForeignKeyViolationError) as e:
-                        await stmt_tr.rollback()
-                        if is_name_missing_from_accounts_error(e):
-                            missing_account_name = missing_account_name_from_error(
-                                e)
-                            stmt2_tr = conn.transaction()
-                            await stmt2_tr.start()
-                            await add_acct_stmt.fetchval(missing_account_name)
-                            await stmt2_tr.commit()
-                        else:
-                            if i == 0:
-                                prepared = prepared_block
-                            else:
-                                prepared = prepared_ops[i - 1]
-                            logger.exception('error storing block and ops',
-                                             e=e,
-                                             accts=account_names_in_ops,
-                                             prepared=prepared,
-                                             stmt=stmt)
-                            raise e
-                    except Exception as e:
-                        await stmt_tr.rollback()
-                        if i == 0:
-                            prepared = prepared_block
-                        else:
-                            prepared = prepared_ops[i - 1]
-                        logger.exception('error storing block and ops',
-                                         e=e,
-                                         accts=account_names_in_ops,
-                                         prepared=prepared,
-                                         stmt=stmt,
-                                         type=prepared.get('operation_type'))
-                        raise e
-
-async def store_block_and_ops(pool, db_tables, prepared_block, prepared_ops):
+async def store_block_and_ops(pool, prepared_block, prepared_ops,
+                              known_account_names=None):
     """Atomic add block,operations, and virtual operations in block
 
-
+    Statements are passed as SQL text so asyncpg reuses the statement it
+    prepared on each pooled connection. Account names missing from
+    known_account_names are added first, in the same transaction.
 
     :param pool:
-    :param db_tables:
     :param prepared_block:
     :param prepared_ops:
+    :param known_account_names: set of names known to be in dpds_meta_accounts
     :return:
     """
-
-    raw_add_account_stmt = STATEMENT_CACHE['account']
-    raw_stmts = [(STATEMENT_CACHE['block'], prepared_block.values())]
-
-    # collect all account names referenced in block and ops
-    #account_names_in_ops = extract_account_names(prepared_ops)
-    #account_names_in_ops.add(prepared_block['witness'])
-    #account_name_records = [(a,) for a in account_names_in_ops ]
-
-    for prepared_op in prepared_ops:
-        raw_stmts.append((get_op_insert_stmt(prepared_op, db_tables), prepared_op.values()))
+    account_names = extract_account_names(prepared_ops)
+    account_names.add(prepared_block['witness'])
+    account_names = new_account_names(known_account_names, account_names)
+    stmts = block_and_ops_stmts(prepared_block, prepared_ops)
 
     async with pool.acquire() as conn:
-        prepared_stmts = [await conn.prepare(stmt) for stmt,_ in raw_stmts]
-        stmts = zip(prepared_stmts, (vals for _,vals in raw_stmts))
-
         async with conn.transaction():
-            #await conn.executemany(raw_add_account_stmt, account_name_records)
+            if account_names:
+                await conn.executemany(ACCOUNT_INSERT_PLAN.sql,
+                                       [(a,) for a in account_names])
             # add block and ops
             for i,stmt in enumerate(stmts):
                 query, args = stmt
                 try:
-                    await query.fetchval(*args)
+                    await conn.fetchval(query, *args)
                 except Exception as e:
                     if i == 0:
                         prepared = prepared_block
@@ -426,15 +657,123 @@ async def store_block_and_ops(pool, db_tables, prepared_block, prepared_ops):
                         prepared = prepared_ops[i - 1]
                     logger.exception('error storing block and ops',
                                      e=e,
-                                     #accts=account_names_in_ops,
                                      prepared=prepared,
                                      stmt=stmt,
                                      type=prepared.get('operation_type'))
                     raise e
+            await record_completed_block_nums(conn,
+                                              [prepared_block['block_num']])
+    if known_account_names is not None:
+        known_account_names.update(account_names)
+
+
+def staged_table_names():
+    """Names of the tables the copy write mode merges into"""
+    op_table_names = {plan.table_name for plan in OP_INSERT_PLANS.values()}
+    return ([ACCOUNT_INSERT_PLAN.table_name, BLOCK_INSERT_PLAN.table_name]
+            + sorted(op_table_names))
+
+
+async def create_staging_tables(conn):
+    """Create the copy write mode's staging tables on a new connection
+
+    Used as the asyncpg pool ``init`` callback so each pooled connection
+    creates its staging tables once. A staging table is a column-only clone
+    (no constraints or defaults) of its target which is emptied when the
+    enclosing transaction commits.
+    """
+    await conn.execute(';'.join(
+        f'CREATE TEMP TABLE IF NOT EXISTS {STAGING_TABLE_PREFIX}{table_name} '
+        f'ON COMMIT DELETE ROWS AS SELECT * FROM {table_name} WITH NO DATA'
+        for table_name in staged_table_names()))
+
+
+async def copy_records_to_table(conn, table_name, columns, records):
+    """Binary COPY records into a staging table then merge into table_name
+
+    The staging table must already exist, see create_staging_tables.
+    """
+    if not records:
+        return
+    staging_table_name = f'{STAGING_TABLE_PREFIX}{table_name}'
+    columns_str = ', '.join(f'"{c}"' for c in columns)
+    await conn.copy_records_to_table(staging_table_name,
+                                     records=records,
+                                     columns=columns)
+    await conn.execute(
+        f'INSERT INTO {table_name} ({columns_str}) SELECT {columns_str} '
+        f'FROM {staging_table_name} ON CONFLICT DO NOTHING')
+
+
+async def executemany_records_to_table(conn, table_name, columns, records):
+    """Insert records into table_name with a single executemany"""
+    if not records:
+        return
+    plan = build_insert_plan(table_name, columns)
+    await conn.executemany(plan.sql, records)
+
+
+CHUNK_TABLE_WRITERS = {
+    'copy': copy_records_to_table,
+    'executemany': executemany_records_to_table
+}
 
 
+async def store_chunk_blocks_and_ops(pool, block_nums, table_rows,
+                                     write_mode='copy',
+                                     known_account_names=None):
+    """Atomic add blocks, operations, and virtual operations in a chunk
 
-async def process_block(block_num, raw_block, raw_ops, pool, db_tables, blocks_pbar=None, ops_pbar=None):
+    Every table in ``table_rows`` is written by the ``write_mode`` table
+    writer inside one transaction, so a whole chunk costs a single commit.
+    Accounts come first in ``table_rows`` because blocks reference them
+    with a non-deferred FK, and only names missing from
+    ``known_account_names`` are written.
+
+    :param pool:
+    :param block_nums: block_nums in the chunk, recorded as completed
+    :param table_rows: table name to (columns, records), see
+      `async_core.prepare_chunk_rows`
+    :param write_mode:
+    :param known_account_names: set of names known to be in dpds_meta_accounts,
+        updated once the chunk commits
+    :return:
+    """
+    write_records = CHUNK_TABLE_WRITERS[write_mode]
+    chunk_start = time.perf_counter()
+    account_columns, account_records = table_rows[
+        ACCOUNT_INSERT_PLAN.table_name]
+    account_names = new_account_names(known_account_names,
+                                      (name for name, in account_records))
+    table_rows = dict(table_rows)
+    table_rows[ACCOUNT_INSERT_PLAN.table_name] = (account_columns,
+                                                  [(a,) for a in account_names])
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            for table_name, (columns, records) in table_rows.items():
+                try:
+                    write_start = time.perf_counter()
+                    await write_records(conn, table_name, columns, records)
+                    if records:
+                        metrics.DB_WRITE_LATENCY.labels(
+                            table=table_name).observe(
+                                time.perf_counter() - write_start)
+                except Exception as e:
+                    logger.exception('error storing blocks and ops',
+                                     e=e,
+                                     table=table_name,
+                                     columns=columns,
+                                     record_count=len(records),
+                                     write_mode=write_mode)
+                    raise e
+            await record_completed_block_nums(conn, block_nums)
+    metrics.DB_COMMIT_LATENCY.observe(time.perf_counter() - chunk_start)
+    if known_account_names is not None:
+        known_account_names.update(account_names)
+
+
+async def prepare_block_and_ops(raw_block, raw_ops):
+    raw_ops = load_raw_ops_sync(raw_ops)
     prepared_futures = [prepare_raw_block_for_storage(raw_block, loop=loop)]
     if raw_ops:
         prepared_futures.extend(prepare_raw_operation_for_storage(raw_op, loop=loop)
@@ -445,36 +784,370 @@ async def process_block(block_num, raw_block, raw_ops, pool, db_tables, blocks_p
         prepared_ops = prepared[1:]
     else:
         prepared_ops = []
-    await store_block_and_ops(pool, db_tables, prepared_block, prepared_ops)
-    blocks_pbar.update()
-    if len(raw_ops) < 50:
-        ops_pbar.total = ops_pbar.total - (50 - len(raw_ops))
-    ops_pbar.update(len(raw_ops))
-    return (block_num, raw_block, prepared_block, raw_ops, prepared_ops)
-
-
-async def process_block_chunk(block_num_batch, url, client, engine, db_tables, blocks_pbar=None,ops_pbar=None):
-    results = await fetch_blocks_and_ops_in_blocks(url, client, block_num_batch)
-    block_futures = [process_block(
-            block_num,
-            raw_block,
-            raw_ops_in_block,
-            engine,
-            db_tables,
-            blocks_pbar=blocks_pbar,
-            ops_pbar=ops_pbar) for block_num, raw_block, raw_ops_in_block in results]
-    return await asyncio.wait(block_futures)
-
-async def process_blocks(missing_block_nums, url, client, pool, db_meta, blocks_pbar=None,ops_pbar=None):
-    CONCURRENCY_LIMIT = 5
-    BATCH_SIZE = 100
-
-    db_tables = db_meta.tables
-    block_num_batches = chunkify(missing_block_nums, BATCH_SIZE)
-    futures = (process_block_chunk(block_num_batch, url, client, pool, db_tables,blocks_pbar=blocks_pbar, ops_pbar=ops_pbar) for block_num_batch in block_num_batches)
-
-    for results_future in as_completed_limit_concurrent(futures, CONCURRENCY_LIMIT):
-        results = await results_future
+    return prepared_block, prepared_ops
+
+
+def update_progress(blocks_pbar, ops_pbar, block_count, op_count):
+    if blocks_pbar is None or ops_pbar is None:
+        return
+    blocks_pbar.update(block_count)
+    # ops bar total assumes 50 ops per block
+    expected_op_count = block_count * 50
+    if op_count < expected_op_count:
+        ops_pbar.total = ops_pbar.total - (expected_op_count - op_count)
+    ops_pbar.update(op_count)
+
+
+async def fetch_chunk(client, block_num_chunk, controller,
+                      retries=DEFAULT_RPC_RETRIES, only_virtual=False):
+    """Fetch a chunk of blocks using RPC batches sized by the controller
+
+    Blocks whose batch ran out of retries are missing from the results.
+    """
+    batches = await asyncio.gather(*(
+        fetch_blocks_and_ops_in_blocks(client, block_num_batch,
+                                       controller=controller, retries=retries,
+                                       only_virtual=only_virtual)
+        for block_num_batch in chunkify(block_num_chunk,
+                                        controller.batch_size)))
+    return list(it.chain.from_iterable(batches))
+
+
+async def prepare_chunk(results, write_mode='copy', executor=None):
+    """Prepare a fetched chunk for the store stage
+
+    Returns the chunk's block_nums and the prepared chunk. Chunk write modes
+    get table rows from the process pool, the per-row write mode gets a
+    (prepared_block, prepared_ops) pair per block.
+    """
+    block_nums = [block_num for block_num, _, _ in results]
+    if write_mode in CHUNK_TABLE_WRITERS:
+        prepared = await prepare_chunk_for_storage(results, loop=loop,
+                                                   executor=executor)
+    else:
+        prepared = await asyncio.gather(*(
+            prepare_block_and_ops(raw_block, raw_ops)
+            for _, raw_block, raw_ops in results))
+    return block_nums, prepared
+
+
+async def store_chunk(pool, chunk, write_mode='copy', blocks_pbar=None,
+                      ops_pbar=None, known_account_names=None, watermark=None):
+    block_nums, prepared = chunk
+    if write_mode in CHUNK_TABLE_WRITERS:
+        await store_chunk_blocks_and_ops(
+            pool, block_nums, prepared, write_mode=write_mode,
+            known_account_names=known_account_names)
+        block_count = len(prepared['dpds_core_blocks'][1])
+        op_counts = Counter({OPERATION_TYPES_BY_TABLE[table_name]: len(records)
+                             for table_name, (_, records) in prepared.items()
+                             if table_name in OPERATION_TYPES_BY_TABLE})
+    else:
+        await asyncio.gather(*(
+            store_block_and_ops(pool, prepared_block, prepared_ops,
+                                known_account_names=known_account_names)
+            for prepared_block, prepared_ops in prepared))
+        block_count = len(prepared)
+        op_counts = Counter(prepared_op['operation_type']
+                            for _, prepared_ops in prepared
+                            for prepared_op in prepared_ops)
+    op_count = sum(op_counts.values())
+    if watermark is not None:
+        await advance_watermark(pool, watermark, block_nums)
+    record_stored_metrics(block_nums, block_count, op_counts)
+    update_progress(blocks_pbar, ops_pbar, block_count, op_count)
+    return block_count, op_count
+
+
+def record_stored_metrics(block_nums, block_count, op_counts):
+    metrics.BLOCKS_STORED.inc(block_count)
+    for operation_type, count in op_counts.items():
+        metrics.OPS_STORED.labels(operation_type=operation_type).inc(count)
+    if block_nums:
+        last_stored = metrics.LAST_STORED_BLOCK_NUM.labels()
+        last_stored.set(max(last_stored.get(), max(block_nums)))
+
+
+# --- Partitions ---
+
+async def load_partition_layout(pool):
+    async with pool.acquire() as conn:
+        return partition_layout(await conn.fetch(PARTITION_BOUNDS_SQL))
+
+
+async def ensure_partitions(pool, layout, start_block, end_block):
+    """Create any partitions needed to store blocks start_block through
+    end_block
+
+    Partitions are created outside the chunk transactions, which would
+    otherwise queue behind the lock creating a partition takes. Returns
+    the number of partitions created.
+    """
+    created = 0
+    for table_name, start, width in missing_partitions(
+            layout, start_block, end_block):
+        async with pool.acquire() as conn:
+            await conn.execute(create_partition_sql(table_name, start, width))
+        layout[table_name][1].add(start)
+        created += 1
+        logger.info('created partition', table_name=table_name,
+                    start_block=start, width=width)
+    return created
+
+
+# --- Pipeline ---
+# fetch -> prepare -> store, each stage with its own workers, joined by
+# bounded queues so a slow stage throttles the stages feeding it
+PipelineConfig = namedtuple('PipelineConfig',
+                            ['fetch_workers', 'prepare_workers',
+                             'store_workers', 'queue_size'])
+
+DEFAULT_PIPELINE_CONFIG = PipelineConfig(fetch_workers=5,
+                                         prepare_workers=os.cpu_count() or 1,
+                                         store_workers=5,
+                                         queue_size=10)
+
+
+async def stage_worker(handler, in_queue, out_queue=None):
+    while True:
+        item = await in_queue.get()
+        try:
+            result = await handler(item)
+            if out_queue is not None:
+                await out_queue.put(result)
+        finally:
+            in_queue.task_done()
+
+
+def start_stage(handler, worker_count, in_queue, out_queue=None):
+    return [asyncio.ensure_future(stage_worker(handler, in_queue, out_queue))
+            for _ in range(worker_count)]
+
+
+async def run_pipeline(items, stages, queue_size):
+    """Feed items through stages of (handler, worker_count)
+
+    Returns once every item has passed through the last stage and raises
+    the first exception raised by any stage handler.
+    """
+    queues = [asyncio.Queue(maxsize=queue_size) for _ in stages]
+    for (handler, _), queue in zip(stages, queues):
+        stage = getattr(handler, 'func', handler).__name__
+        metrics.QUEUE_DEPTH.labels(stage=stage).set_function(queue.qsize)
+    workers = []
+    for i, (handler, worker_count) in enumerate(stages):
+        out_queue = queues[i + 1] if i + 1 < len(queues) else None
+        workers.extend(start_stage(handler, worker_count, queues[i], out_queue))
+
+    async def produce():
+        if hasattr(items, '__aiter__'):
+            async for item in items:
+                await queues[0].put(item)
+        else:
+            for item in items:
+                await queues[0].put(item)
+        # a stage only forwards an item before marking it done, so joining
+        # the queues in order drains the whole pipeline
+        for queue in queues:
+            await queue.join()
+
+    producer = asyncio.ensure_future(produce())
+    try:
+        done, _ = await asyncio.wait([producer, *workers],
+                                     return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            task.result()
+    finally:
+        for task in [producer, *workers]:
+            task.cancel()
+
+
+async def process_blocks(missing_block_nums, fetch, pool, blocks_pbar=None,
+                         ops_pbar=None, write_mode='copy', chunk_size=100,
+                         executor=None, pipeline_config=DEFAULT_PIPELINE_CONFIG,
+                         known_account_names=None, watermark=None, spool=None):
+    """Fetch, prepare and store missing_block_nums in chunks
+
+    fetch is called with each chunk's block_nums and returns its
+    (block_num, raw_block, raw_ops) results. Stored chunks advance
+    watermark, a `CommitWatermark`, if given. Fetched chunks pass through
+    spool, a `Spool`, if given.
+    """
+    block_num_chunks = chunkify(missing_block_nums, chunk_size)
+    store_kwargs = dict(
+        write_mode=write_mode, blocks_pbar=blocks_pbar, ops_pbar=ops_pbar,
+        known_account_names=known_account_names, watermark=watermark)
+    compactor = asyncio.ensure_future(
+        compact_completed_ranges_periodically(pool))
+    try:
+        if spool is None:
+            stages = [
+                (fetch, pipeline_config.fetch_workers),
+                (partial(prepare_chunk, write_mode=write_mode,
+                         executor=executor),
+                 pipeline_config.prepare_workers),
+                (partial(store_chunk, pool, **store_kwargs),
+                 pipeline_config.store_workers)
+            ]
+            await run_pipeline(block_num_chunks, stages,
+                               pipeline_config.queue_size)
+        else:
+            await run_spooled_pipeline(block_num_chunks, fetch, pool, spool,
+                                       executor=executor,
+                                       pipeline_config=pipeline_config,
+                                       **store_kwargs)
+    finally:
+        compactor.cancel()
+        await compact_completed_ranges(pool)
+
+
+# --- Spool ---
+# fetch -> spool and spool -> prepare -> store run as separate pipelines,
+# so fetching only waits on storing once the spool reaches its max_bytes
+
+async def spool_chunk(spool, results):
+    await spool.append(results)
+
+
+async def prepare_spooled_chunk(record, write_mode='copy', executor=None):
+    seq, payload = record
+    if write_mode in CHUNK_TABLE_WRITERS:
+        chunk = await loop.run_in_executor(
+            executor, prepare_compressed_chunk, payload)
+    else:
+        results = await loop.run_in_executor(None, decode_record, payload)
+        chunk = await prepare_chunk(results, write_mode=write_mode)
+    return seq, chunk
+
+
+def chunk_without_blocks(chunk, skipped, write_mode='copy'):
+    """A prepared chunk without the blocks in skipped or their operations"""
+    block_nums, prepared = chunk
+    block_nums = [block_num for block_num in block_nums
+                  if block_num not in skipped]
+    if write_mode in CHUNK_TABLE_WRITERS:
+        kept = {}
+        for table_name, (columns, records) in prepared.items():
+            if 'block_num' in columns:
+                index = columns.index('block_num')
+                records = [record for record in records
+                           if record[index] not in skipped]
+            kept[table_name] = (columns, records)
+    else:
+        kept = [(prepared_block, prepared_ops)
+                for prepared_block, prepared_ops in prepared
+                if prepared_block['block_num'] not in skipped]
+    return block_nums, kept
+
+
+async def stored_block_nums(pool, block_nums):
+    """The block_nums already stored"""
+    if not block_nums:
+        return set()
+    missing = set(range_block_nums(
+        await find_missing_block_ranges(pool, min(block_nums),
+                                        max(block_nums))))
+    return {block_num for block_num in block_nums if block_num not in missing}
+
+
+async def store_spooled_chunk(pool, spool, record, partitions=None,
+                              skip_stored=False, write_mode='copy',
+                              **store_kwargs):
+    """Store a spooled chunk, then advance the spool's consumer offset past it
+
+    Replayed chunks may be from blocks outside this run's range, so their
+    partitions are created first when partitions is given. A crash after
+    a chunk is stored but before the offset passes it leaves the chunk to
+    be replayed, so with skip_stored the blocks already stored are left
+    out rather than having their virtual ops, keyed by a serial id, stored
+    twice.
+    """
+    seq, chunk = record
+    block_nums, _ = chunk
+    if partitions is not None and block_nums:
+        await ensure_partitions(pool, partitions, min(block_nums),
+                                max(block_nums))
+    if skip_stored:
+        stored = await stored_block_nums(pool, block_nums)
+        if stored:
+            logger.info('skipping stored spooled blocks', seq=seq,
+                        block_ranges=block_num_ranges(stored))
+            chunk = chunk_without_blocks(chunk, stored, write_mode=write_mode)
+            if not chunk[0]:
+                await spool.commit(seq)
+                return 0, 0
+    result = await store_chunk(pool, chunk, write_mode=write_mode,
+                               **store_kwargs)
+    await spool.commit(seq)
+    return result
+
+
+def spooled_stages(pool, spool, executor=None,
+                   pipeline_config=DEFAULT_PIPELINE_CONFIG, write_mode='copy',
+                   **store_kwargs):
+    return [
+        (partial(prepare_spooled_chunk, write_mode=write_mode,
+                 executor=executor),
+         pipeline_config.prepare_workers),
+        (partial(store_spooled_chunk, pool, spool, write_mode=write_mode,
+                 **store_kwargs),
+         pipeline_config.store_workers)
+    ]
+
+
+async def run_spooled_pipeline(
+        block_num_chunks, fetch, pool, spool, executor=None,
+        pipeline_config=DEFAULT_PIPELINE_CONFIG, **store_kwargs):
+    """Fetch block_num_chunks into spool while storing the chunks spooled"""
+    async def fetch_into_spool():
+        try:
+            await run_pipeline(block_num_chunks,
+                               [(fetch, pipeline_config.fetch_workers),
+                                (partial(spool_chunk, spool), 1)],
+                               pipeline_config.queue_size)
+        finally:
+            await spool.stop_writing()
+
+    spool.writing = True
+    fetcher = asyncio.ensure_future(fetch_into_spool())
+    try:
+        await run_pipeline(spool.records(),
+                           spooled_stages(pool, spool, executor=executor,
+                                          pipeline_config=pipeline_config,
+                                          **store_kwargs),
+                           pipeline_config.queue_size)
+        await fetcher
+    finally:
+        fetcher.cancel()
+
+
+async def replay_spool(pool, spool, partitions=None, executor=None,
+                       pipeline_config=DEFAULT_PIPELINE_CONFIG, **store_kwargs):
+    """Store the chunks an earlier run spooled but did not store, returns how
+    many"""
+    pending = spool.pending
+    if pending:
+        logger.info('replaying spooled chunks', path=spool.path, chunks=pending)
+        await run_pipeline(spool.records(),
+                           spooled_stages(pool, spool, executor=executor,
+                                          pipeline_config=pipeline_config,
+                                          partitions=partitions,
+                                          skip_stored=True, **store_kwargs),
+                           pipeline_config.queue_size)
+    return pending
+
+
+def worker_spool_path(spool_path, worker_num):
+    return os.path.join(spool_path, f'worker-{worker_num}')
+
+
+def spool_paths(spool_path):
+    """spool_path and the spools of the workers of earlier runs under it"""
+    if not os.path.isdir(spool_path):
+        return [spool_path]
+    return [spool_path] + sorted(os.path.join(spool_path, name)
+                                 for name in os.listdir(spool_path)
+                                 if name.startswith('worker-'))
 
 
 # --- Operations ---
@@ -482,13 +1155,208 @@ async def process_blocks(missing_block_nums, url, client, pool, db_meta, blocks_
 async def prepare_operation_for_storage(raw_operation):
     return await prepare_raw_operation_for_storage(raw_operation)
 
-async def task_stream_blocks(engine, dpayd_http_url, client):
+def seconds_behind(raw_block):
+    timestamp = dateutil.parser.parse(raw_block['timestamp'])
+    return (datetime.datetime.utcnow() - timestamp).total_seconds()
+
+
+async def task_stream_blocks(
+        pool, client, start_block, controller, write_mode='copy',
+        chunk_size=100, rpc_retries=DEFAULT_RPC_RETRIES, executor=None,
+        poll_interval=LIB_POLL_INTERVAL, known_account_names=None,
+        only_virtual=False, watermark=None):
+    """Follow the last irreversible block, storing blocks as they become
+    irreversible"""
+    next_block_num = start_block
+    partitions = await load_partition_layout(pool)
+    compactor = asyncio.ensure_future(
+        compact_completed_ranges_periodically(pool))
+    try:
+        while True:
+            try:
+                last_irreversible_block_num = (
+                    await get_last_irreversible_block_num(client))
+                await ensure_partitions(pool, partitions, next_block_num,
+                                        last_irreversible_block_num)
+                for block_num_chunk in chunkify(
+                        range(next_block_num, last_irreversible_block_num + 1),
+                        chunk_size):
+                    fetched = await fetch_chunk(client, block_num_chunk,
+                                                controller, retries=rpc_retries,
+                                                only_virtual=only_virtual)
+                    # only the blocks before the first unfetched one are
+                    # stored, the rest are fetched again after the next poll
+                    results = fetched_prefix(fetched, block_num_chunk)
+                    if results:
+                        chunk = await prepare_chunk(
+                            results, write_mode=write_mode, executor=executor)
+                        block_count, op_count = await store_chunk(
+                            pool, chunk, write_mode=write_mode,
+                            known_account_names=known_account_names,
+                            watermark=watermark)
+                    if len(results) < len(block_num_chunk):
+                        next_block_num = block_num_chunk[len(results)]
+                        break
+                    next_block_num = block_num_chunk[-1] + 1
+                    metrics.LAG_SECONDS.set(seconds_behind(results[-1][1]))
+                    logger.info(
+                        'streamed blocks',
+                        last_stored_block_num=block_num_chunk[-1],
+                        last_irreversible_block_num=last_irreversible_block_num,
+                        lag_blocks=(last_irreversible_block_num
+                                    - block_num_chunk[-1]),
+                        lag_seconds=seconds_behind(results[-1][1]),
+                        blocks=block_count,
+                        ops=op_count)
+            except Exception as e:
+                logger.exception('error streaming blocks', e=e,
+                                 next_block_num=next_block_num)
+            await asyncio.sleep(poll_interval)
+    finally:
+        compactor.cancel()
+
+
+# --- Workers ---
+
+async def load_lease_blocks(pool, fetch, start_block, end_block, partitions,
+                            **process_kwargs):
+    """Load the missing blocks of a lease, returns True once none are missing"""
+    start_block = max(start_block, 1)
+    await ensure_partitions(pool, partitions, start_block, end_block)
+    missing_block_ranges = await find_missing_block_ranges(
+        pool, start_block, end_block)
+    if missing_block_ranges:
+        await process_blocks(range_block_nums(missing_block_ranges), fetch,
+                             pool, **process_kwargs)
+        missing_block_ranges = await find_missing_block_ranges(
+            pool, start_block, end_block)
+    return not missing_block_ranges
+
+
+async def lease_worker(pool, fetch, owner, lease_ttl=DEFAULT_LEASE_TTL,
+                       max_lease_attempts=DEFAULT_MAX_LEASE_ATTEMPTS,
+                       **process_kwargs):
+    """Claim and load leases until none are left, returns how many were
+    completed
+
+    Leases still missing blocks after loading are released to be retried
+    later, by this or any other worker.
+    """
+    partitions = await load_partition_layout(pool)
+    completed = 0
     while True:
-        tasks = [
-            get_last_irreversible_block_num(dpayd_http_url, client),
-            get_latest_db_block_num(engine)
-        ]
-        done, pending = await asyncio.wait(tasks)
+        lease = await claim_lease(pool, owner, ttl=lease_ttl,
+                                  max_attempts=max_lease_attempts)
+        if lease is None:
+            if not await has_remaining_leases(pool,
+                                              max_attempts=max_lease_attempts):
+                return completed
+            # the rest are held by other workers or waiting to be retried
+            await asyncio.sleep(LEASE_POLL_INTERVAL)
+            continue
+        start_block, end_block = lease
+        logger.info('claimed lease', owner=owner, start_block=start_block,
+                    end_block=end_block)
+        try:
+            loaded = await hold_lease(
+                pool, start_block, owner,
+                load_lease_blocks(pool, fetch, start_block, end_block,
+                                  partitions, **process_kwargs), ttl=lease_ttl)
+        except LeaseLost:
+            logger.error('lost lease', owner=owner, start_block=start_block,
+                         end_block=end_block)
+            continue
+        except Exception as e:
+            logger.exception('error loading lease', e=e, owner=owner,
+                             start_block=start_block, end_block=end_block)
+            loaded = False
+        if loaded:
+            await complete_lease(pool, start_block, owner)
+            completed += 1
+        else:
+            logger.error('lease still missing blocks, releasing it',
+                         owner=owner, start_block=start_block,
+                         end_block=end_block)
+            await release_lease(pool, start_block, owner)
+
+
+def run_lease_worker(
+        worker_num, database_url, dpayd_http_url, source='dpayd',
+        max_open_files=DEFAULT_MAX_OPEN_FILES, write_mode='copy',
+        chunk_size=100, rpc_batch_size=100, max_rpc_batch_size=500,
+        max_rpc_requests=20, rpc_retries=DEFAULT_RPC_RETRIES,
+        virtual_ops_only=False, pipeline_config=DEFAULT_PIPELINE_CONFIG,
+        lease_ttl=DEFAULT_LEASE_TTL, spool_path=None, spool_max_bytes=None,
+        rpc_cache_path=None, rpc_cache_max_bytes=DEFAULT_RPC_CACHE_MAX_BYTES):
+    """Entry point of each `populate --workers` process
+
+    Every worker has its own event loop, rpc client, asyncpg pool,
+    prepare processes and, with spool_path, spool.
+    """
+    # store workers, progress compaction, lease heartbeats and claims
+    pool = create_asyncpg_pool(database_url, min_size=1,
+                               max_size=pipeline_config.store_workers + 4,
+                               init=create_staging_tables)
+    owner = lease_owner(worker_num)
+    controller = FetchController(batch_size=rpc_batch_size,
+                                 concurrency=pipeline_config.fetch_workers,
+                                 max_batch_size=max_rpc_batch_size,
+                                 max_concurrency=max_rpc_requests)
+    executor = concurrent.futures.ProcessPoolExecutor(
+        max_workers=pipeline_config.prepare_workers)
+    client = create_rpc_client(dpayd_http_url, rpc_cache_path=rpc_cache_path,
+                               rpc_cache_max_bytes=rpc_cache_max_bytes)
+    _, fetch = build_fetch(source, client, controller,
+                           max_open_files=max_open_files,
+                           rpc_retries=rpc_retries,
+                           virtual_ops_only=virtual_ops_only)
+    spool = None
+    if spool_path:
+        spool = Spool(worker_spool_path(spool_path, worker_num),
+                      max_bytes=spool_max_bytes)
+    try:
+        known_account_names = loop.run_until_complete(
+            load_known_account_names(pool))
+        completed = loop.run_until_complete(
+            lease_worker(pool, fetch, owner, lease_ttl=lease_ttl,
+                         write_mode=write_mode, chunk_size=chunk_size,
+                         executor=executor, pipeline_config=pipeline_config,
+                         known_account_names=known_account_names, spool=spool))
+        logger.info('populate worker finished', owner=owner,
+                    completed_leases=completed)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if spool is not None:
+            spool.close()
+        executor.shutdown(wait=False)
+        loop.run_until_complete(close_rpc_client(client))
+        loop.run_until_complete(pool.close())
+
+
+def run_lease_workers(workers, **worker_kwargs):
+    """Run workers `run_lease_worker` processes until they finish, returns their
+    exit codes
+
+    Workers are spawned rather than forked so none inherits the parent's
+    event loop or connections.
+    """
+    context = multiprocessing.get_context('spawn')
+    processes = [context.Process(target=run_lease_worker,
+                                 args=(worker_num,),
+                                 kwargs=worker_kwargs,
+                                 name=f'populate-worker-{worker_num}')
+                 for worker_num in range(workers)]
+    for process in processes:
+        process.start()
+    try:
+        for process in processes:
+            process.join()
+    finally:
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+    return [process.exitcode for process in processes]
 
 
 @click.command()
@@ -502,31 +1370,195 @@ async def task_stream_blocks(engine, dpayd_http_url, client):
     '--legacy_database_url',
     type=str,
     envvar='LEGACY_DATABASE_URL',
-    help='Database connection URL in RFC-1738 format, read from "DATABASE_URL" ENV var by default'
+    help='Unused, insert plans are built from the table definitions'
 )
 @click.option(
     '--dpayd_http_url',
     metavar='DPAYD_HTTP_URL',
     envvar='DPAYD_HTTP_URL',
-    help='DPayd HTTP server URL')
+    help='DPayd HTTP server URL, or several separated by commas to route '
+         'between')
+@click.option('--source', type=str, default='dpayd',
+              help='Where blocks are read from, "dpayd" or "fs:<path>" for a '
+                   'store written by "dpds fs"')
+@click.option('--max_open_files', type=click.IntRange(min=1),
+              default=DEFAULT_MAX_OPEN_FILES,
+              help='Number of files read concurrently from an fs source')
 @click.option('--start_block',type=int, default=1)
 @click.option('--end_block',type=int, default=-1)
 @click.option('--accounts_file', type=click.Path(dir_okay=False,exists=True))
-def populate(database_url, legacy_database_url, dpayd_http_url, start_block, end_block, accounts_file):
-    _populate(database_url, legacy_database_url, dpayd_http_url, start_block, end_block, accounts_file)
-
-
-def _populate(database_url, legacy_database_url, dpayd_http_url, start_block, end_block,accounts_file):
-    CONNECTOR = TCPConnector(loop=loop, limit=100)
-    AIOHTTP_SESSION = aiohttp.ClientSession(loop=loop,
-                                            connector=CONNECTOR,
-                                            json_serialize=json.dumps,
-                                            headers={'Content-Type': 'application/json'})
-    DB_META = task_load_db_meta(legacy_database_url)
+@click.option('--preload_accounts', is_flag=True, default=False,
+              help='Without --accounts_file, load every account name from '
+                   'dpayd before adding blocks')
+@click.option('--write_mode', type=click.Choice(WRITE_MODES), default='copy',
+              help='"copy" streams each chunk with binary COPY, "executemany" '
+                   'commits each chunk with one executemany per table, "rows" '
+                   'inserts one row at a time')
+@click.option('--chunk_size', type=click.IntRange(min=1), default=100,
+              help='Number of blocks written per database transaction')
+@click.option('--rpc_batch_size', type=click.IntRange(min=1), default=100,
+              help='Initial number of blocks requested per JSON-RPC batch, '
+                   'adjusted from observed latency, payload size and errors')
+@click.option('--max_rpc_batch_size', type=click.IntRange(min=1), default=500,
+              help='Largest JSON-RPC batch the batch size may grow to. Batches '
+                   'never span chunks, so it is capped at --chunk_size')
+@click.option('--max_rpc_requests', type=click.IntRange(min=1), default=20,
+              help='Largest number of JSON-RPC batches in flight, starts at '
+                   '--fetch_workers')
+@click.option('--rpc_retries', type=click.IntRange(min=0),
+              default=DEFAULT_RPC_RETRIES,
+              help='Retries per JSON-RPC batch before its blocks are left for '
+                   'a later sweep')
+@click.option('--virtual_ops_only', is_flag=True, default=False,
+              help='Fetch only virtual ops with get_ops_in_block and build the '
+                   'rest from the blocks\' transactions. Needs a dpayd whose '
+                   'get_block results include transaction_ids')
+@click.option('--fetch_workers', type=click.IntRange(min=1),
+              default=DEFAULT_PIPELINE_CONFIG.fetch_workers,
+              help='Number of chunks fetched from dpayd concurrently')
+@click.option('--prepare_workers', type=click.IntRange(min=1),
+              default=DEFAULT_PIPELINE_CONFIG.prepare_workers,
+              help='Number of processes preparing chunks for storage, defaults '
+                   'to the number of CPUs')
+@click.option('--store_workers', type=click.IntRange(min=1),
+              default=DEFAULT_PIPELINE_CONFIG.store_workers,
+              help='Number of chunks written to the database concurrently')
+@click.option('--queue_size', type=click.IntRange(min=1),
+              default=DEFAULT_PIPELINE_CONFIG.queue_size,
+              help='Number of chunks buffered between pipeline stages')
+@click.option(
+    '--workers', type=click.IntRange(min=1), default=1,
+    help='Number of processes loading blocks, each claiming block ranges from '
+         'dpds_populate_leases. Populate processes on other hosts share the '
+         'leases; run all but one with --no-follow')
+@click.option('--lease_size', type=click.IntRange(min=1),
+              default=DEFAULT_LEASE_SIZE,
+              help='Blocks per lease with --workers, leases are aligned to '
+                   'multiples of this')
+@click.option('--lease_ttl', type=click.FloatRange(min=1),
+              default=DEFAULT_LEASE_TTL,
+              help='Seconds a lease is held without a heartbeat before other '
+                   'workers may reclaim it')
+@click.option('--spool', 'spool_path', type=click.Path(file_okay=False),
+              default=None,
+              help='Spool fetched blocks to this directory until they are '
+                   'stored, replaying them after a crash')
+@click.option(
+    '--spool_max_bytes', type=click.IntRange(min=1), default=None,
+    help='Pause fetching while the spool takes more than this many bytes')
+@click.option('--rpc_cache', 'rpc_cache_path', type=click.Path(dir_okay=False),
+              default=None, envvar='DPDS_RPC_CACHE',
+              help='Cache irreversible get_block and get_ops_in_block '
+                   'responses in this file, so later runs skip requesting them')
+@click.option('--rpc_cache_max_bytes', type=click.IntRange(min=1),
+              default=DEFAULT_RPC_CACHE_MAX_BYTES,
+              help='Evict the oldest cached responses once the cache takes '
+                   'more than this many bytes')
+@click.option('--partition_width', type=click.IntRange(min=1), default=None,
+              help='Create the largest operation tables range partitioned by '
+                   'block_num, this many blocks per partition. Only applies '
+                   'when the tables are created')
+@click.option('--bulk-load', 'bulk_load', is_flag=True, default=False,
+              help='Drop secondary indexes and foreign keys while loading, '
+                   'then rebuild them in parallel and analyze')
+@click.option('--index_workers', type=click.IntRange(min=1), default=4,
+              help='Number of indexes built or foreign keys validated '
+                   'concurrently after a bulk load')
+@click.option('--metrics_port', type=click.IntRange(min=0, max=65535),
+              default=None,
+              help='Serve Prometheus metrics at '
+                   'http://<metrics_host>:<metrics_port>/metrics while running')
+@click.option('--metrics_host', type=str, default='127.0.0.1',
+              help='Address the metrics endpoint listens on')
+@click.option('--commit_watermark/--no-commit_watermark', default=True,
+              help='Track the highest block with every block below it '
+                   'committed in dpds_populate_watermark, so restarts only '
+                   'look for missing blocks above it')
+@click.option('--follow/--no-follow', default=True,
+              help='After loading, keep storing blocks as they become '
+                   'irreversible. Ignored when --end_block is given')
+@click.option(
+    '--poll_interval', type=click.FloatRange(min=0), default=LIB_POLL_INTERVAL,
+    help='Seconds between last irreversible block polls while following')
+def populate(database_url, legacy_database_url, dpayd_http_url, source,
+             max_open_files, start_block, end_block, accounts_file,
+             preload_accounts, write_mode, chunk_size, rpc_batch_size,
+             max_rpc_batch_size, max_rpc_requests, rpc_retries,
+             virtual_ops_only, fetch_workers, prepare_workers, store_workers,
+             queue_size, workers, lease_size, lease_ttl, spool_path,
+             spool_max_bytes, rpc_cache_path, rpc_cache_max_bytes,
+             partition_width, bulk_load, index_workers, metrics_port,
+             metrics_host, commit_watermark, follow, poll_interval):
+    if source != 'dpayd' and not source.startswith('fs:'):
+        raise click.BadParameter('must be "dpayd" or "fs:<path>"',
+                                 param_hint='--source')
+    pipeline_config = PipelineConfig(fetch_workers=fetch_workers,
+                                     prepare_workers=prepare_workers,
+                                     store_workers=store_workers,
+                                     queue_size=queue_size)
+    _populate(
+        database_url, legacy_database_url, dpayd_http_url, start_block,
+        end_block, accounts_file, preload_accounts=preload_accounts,
+        source=source, max_open_files=max_open_files, write_mode=write_mode,
+        chunk_size=chunk_size, rpc_batch_size=rpc_batch_size,
+        max_rpc_batch_size=max_rpc_batch_size,
+        max_rpc_requests=max_rpc_requests, rpc_retries=rpc_retries,
+        virtual_ops_only=virtual_ops_only, pipeline_config=pipeline_config,
+        workers=workers, lease_size=lease_size, lease_ttl=lease_ttl,
+        spool_path=spool_path, spool_max_bytes=spool_max_bytes,
+        rpc_cache_path=rpc_cache_path, rpc_cache_max_bytes=rpc_cache_max_bytes,
+        partition_width=partition_width, bulk_load=bulk_load,
+        index_workers=index_workers, metrics_port=metrics_port,
+        metrics_host=metrics_host, commit_watermark=commit_watermark,
+        follow=follow, poll_interval=poll_interval)
+
+
+def _populate(
+        database_url, legacy_database_url, dpayd_http_url, start_block,
+        end_block,accounts_file, preload_accounts=False, source='dpayd',
+        max_open_files=DEFAULT_MAX_OPEN_FILES, write_mode='copy',
+        chunk_size=100, rpc_batch_size=100, max_rpc_batch_size=500,
+        max_rpc_requests=20, rpc_retries=DEFAULT_RPC_RETRIES,
+        virtual_ops_only=False, pipeline_config=DEFAULT_PIPELINE_CONFIG,
+        workers=1, lease_size=DEFAULT_LEASE_SIZE, lease_ttl=DEFAULT_LEASE_TTL,
+        spool_path=None, spool_max_bytes=None, rpc_cache_path=None,
+        rpc_cache_max_bytes=DEFAULT_RPC_CACHE_MAX_BYTES, partition_width=None,
+        bulk_load=False, index_workers=4, metrics_port=None,
+        metrics_host='127.0.0.1', commit_watermark=True, follow=True,
+        poll_interval=LIB_POLL_INTERVAL):
+    if max_rpc_batch_size > chunk_size:
+        # each chunk is fetched in batches of its own blocks
+        logger.warning('capping max_rpc_batch_size at chunk_size',
+                       max_rpc_batch_size=max_rpc_batch_size,
+                       chunk_size=chunk_size)
+        max_rpc_batch_size = chunk_size
+    FETCH_CONTROLLER = FetchController(
+        batch_size=rpc_batch_size, concurrency=pipeline_config.fetch_workers,
+        max_batch_size=max_rpc_batch_size, max_concurrency=max_rpc_requests)
+    PREPARE_EXECUTOR = concurrent.futures.ProcessPoolExecutor(
+        max_workers=pipeline_config.prepare_workers)
+    RPC_CLIENT = create_rpc_client(dpayd_http_url,
+                                   rpc_cache_path=rpc_cache_path,
+                                   rpc_cache_max_bytes=rpc_cache_max_bytes)
+    metrics.RPC_BATCH_SIZE.set_function(lambda: FETCH_CONTROLLER.batch_size)
+    metrics.RPC_CONCURRENCY.set_function(lambda: FETCH_CONTROLLER.concurrency)
+    metrics.RPC_IN_FLIGHT.set_function(lambda: FETCH_CONTROLLER.in_flight)
+    for endpoint in RPC_CLIENT.endpoints.endpoints:
+        track_endpoint_metrics(endpoint)
+    if RPC_CLIENT.cache is not None:
+        track_rpc_cache_metrics(RPC_CLIENT.cache)
+    METRICS_RUNNER = None
+    SPOOL = None
+    FS_STORE, fetch = build_fetch(source, RPC_CLIENT, FETCH_CONTROLLER,
+                                  max_open_files=max_open_files,
+                                  rpc_retries=rpc_retries,
+                                  virtual_ops_only=virtual_ops_only)
 
     try:
 
-        pool = create_asyncpg_pool(database_url)
+        if metrics_port is not None:
+            METRICS_RUNNER = loop.run_until_complete(
+                metrics.start_metrics_server(metrics_host, metrics_port))
         task_num = 0
         # [1/7] confirm db connectivity
         task_num += 1
@@ -544,18 +1576,45 @@ def _populate(database_url, legacy_database_url, dpayd_http_url, start_block, en
             emoji_code_point=u'\U0001F50C',
             task_num=task_num)
         click.echo(task_message)
-        task_init_db_if_required(database_url=database_url)
+        task_init_db_if_required(database_url=database_url,
+                                 partition_width=partition_width)
+        # staging tables are cloned from the tables, so connect after init
+        pool = create_asyncpg_pool(database_url, init=create_staging_tables)
+        if bulk_load:
+            dropped = loop.run_until_complete(
+                drop_deferred_indexes_and_foreign_keys(pool))
+            click.echo(
+                f'Dropped {dropped} secondary indexes and foreign keys for '
+                'bulk load')
+        elif loop.run_until_complete(bulk_load_pending(pool)):
+            # finish an interrupted bulk load before writing with indexes in
+            # place
+            loop.run_until_complete(
+                restore_indexes_and_foreign_keys(pool, workers=index_workers))
 
         # [3/7] find last irreversible block
         task_num += 1
-        if end_block == -1:
+        # only follow the chain when loading up to its irreversible head
+        follow = follow and end_block == -1 and FS_STORE is None
+        if end_block == -1 and FS_STORE is not None:
+            task_message = fmt_task_message(
+                f'Finding highest block in {FS_STORE.path}',
+                emoji_code_point='\U0001F50E',
+                task_num=task_num)
+            click.echo(task_message)
+            end_block = loop.run_until_complete(
+                loop.run_in_executor(None, FS_STORE.highest_block_num))
+            success_msg = fmt_success_message(
+                'highest stored block number is %s', end_block)
+            click.echo(success_msg)
+        elif end_block == -1:
             task_message = fmt_task_message(
             'Finding highest blockchain block',
             emoji_code_point='\U0001F50E',
             task_num=task_num)
             click.echo(task_message)
             last_chain_block_num = loop.run_until_complete(
-                get_last_irreversible_block_num(dpayd_http_url, AIOHTTP_SESSION))
+                get_last_irreversible_block_num(RPC_CLIENT))
             end_block = last_chain_block_num
             success_msg = fmt_success_message(
                 'last irreversible block number is %s',last_chain_block_num )
@@ -567,24 +1626,63 @@ def _populate(database_url, legacy_database_url, dpayd_http_url, start_block, en
                 task_num=task_num)
             click.echo(task_message)
 
+        partitions = loop.run_until_complete(load_partition_layout(pool))
+        created = loop.run_until_complete(
+            ensure_partitions(pool, partitions, start_block, end_block))
+        if created:
+            click.echo(
+                f'Created {created} partitions for blocks '
+                f'{start_block}<<-->>{end_block}')
+
+        if spool_path:
+            # store what an interrupted run fetched before finding what is
+            # missing
+            for path in spool_paths(spool_path):
+                spool = Spool(path, max_bytes=spool_max_bytes)
+                replayed = loop.run_until_complete(
+                    replay_spool(
+                        pool, spool, partitions, executor=PREPARE_EXECUTOR,
+                        pipeline_config=pipeline_config, write_mode=write_mode))
+                spool.close()
+                if replayed:
+                    click.echo(
+                        fmt_success_message('stored %s spooled chunks from %s',
+                                            replayed, path))
+            if workers == 1:
+                SPOOL = Spool(spool_path, max_bytes=spool_max_bytes)
+
         # [4/7] build list of blocks missing from db
-        existing_count, missing_count, range_count = loop.run_until_complete(get_existing_and_missing_count(pool, start_block, end_block))
         task_message = fmt_task_message(
-            f'Building list of {missing_count} blocks missing from db between {start_block}<<-->>{end_block}' ,
+            'Building list of blocks missing from db between '
+            f'{start_block}<<-->>{end_block}' ,
             emoji_code_point=u'\U0001F52D',
             task_num=4)
         click.echo(task_message)
 
-
-        with click.progressbar(length=end_block, **pbar_kwargs) as pbar:
-            pbar.update(existing_count)
-            missing_block_nums = loop.run_until_complete(
-                collect_missing_block_nums(
-                    pool,
-                    end_block,
-                    missing_count,
-                    start_block=start_block,
-                    pbar=pbar))
+        stored_watermark = (loop.run_until_complete(load_watermark(pool))
+                            if commit_watermark else 0)
+        missing_block_ranges = loop.run_until_complete(
+            get_missing_block_ranges(pool, start_block, end_block,
+                                     watermark=stored_watermark))
+        range_count = len(range(start_block, end_block + 1))
+        missing_count = count_range_block_nums(missing_block_ranges)
+        existing_count = range_count - missing_count
+        missing_block_nums = range_block_nums(missing_block_ranges)
+        success_msg = fmt_success_message(
+            '%s blocks missing in %s ranges', missing_count,
+            len(missing_block_ranges))
+        click.echo(success_msg)
+        if commit_watermark:
+            watermark = loop.run_until_complete(
+                init_watermark(pool, stored_watermark, missing_block_ranges,
+                               start_block, end_block))
+            click.echo(
+                fmt_success_message('commit watermark is %s',
+                                    watermark.watermark))
+        else:
+            # the health check would otherwise trust a watermark left behind
+            loop.run_until_complete(clear_watermark(pool))
+            watermark = None
 
         # [5.1/7] preload accounts file
         if accounts_file:
@@ -598,8 +1696,23 @@ def _populate(database_url, legacy_database_url, dpayd_http_url, start_block, en
             loop.run_until_complete(
                 preload_account_names(pool, account_names))
             del account_names
-
-
+        elif preload_accounts and FS_STORE is None:
+            task_message = fmt_task_message(
+                'Preloading account names from dpayd',
+                emoji_code_point=u'\U0001F52D',
+                task_num=5)
+            click.echo(task_message)
+            accounts_progress_bar = tqdm(dynamic_ncols=False, unit=' accounts')
+            loop.run_until_complete(
+                preload_account_names_from_dpayd(pool, RPC_CLIENT,
+                                                 pbar=accounts_progress_bar))
+            accounts_progress_bar.close()
+
+        known_account_names = loop.run_until_complete(
+            load_known_account_names(pool))
+        click.echo(
+            fmt_success_message('loaded %s known account names',
+                                len(known_account_names)))
         # [5/7] add missing blocks and operations
         task_message = fmt_task_message(
             'Adding missing blocks and operations to db',
@@ -607,30 +1720,69 @@ def _populate(database_url, legacy_database_url, dpayd_http_url, start_block, en
             task_num=5)
         click.echo(task_message)
 
+        if workers > 1:
+            lease_count = loop.run_until_complete(
+                seed_leases(pool, missing_block_ranges, lease_size))
+            click.echo(
+                f'Loading {lease_count} leases of up to {lease_size} blocks '
+                f'with {workers} workers')
+            exit_codes = run_lease_workers(
+                workers,
+                database_url=database_url,
+                dpayd_http_url=dpayd_http_url,
+                source=source,
+                max_open_files=max_open_files,
+                write_mode=write_mode,
+                chunk_size=chunk_size,
+                rpc_batch_size=rpc_batch_size,
+                max_rpc_batch_size=max_rpc_batch_size,
+                max_rpc_requests=max_rpc_requests,
+                rpc_retries=rpc_retries,
+                virtual_ops_only=virtual_ops_only,
+                # the prepare processes are shared between workers
+                pipeline_config=pipeline_config._replace(
+                    prepare_workers=max(
+                        pipeline_config.prepare_workers // workers, 1)),
+                lease_ttl=lease_ttl,
+                spool_path=spool_path,
+                spool_max_bytes=spool_max_bytes,
+                rpc_cache_path=rpc_cache_path,
+                rpc_cache_max_bytes=rpc_cache_max_bytes)
+            if any(exit_codes):
+                logger.error('populate workers failed', exit_codes=exit_codes)
+            if watermark is not None:
+                # count the blocks the workers committed
+                missing_block_ranges = loop.run_until_complete(
+                    get_missing_block_ranges(pool, start_block, end_block,
+                                             watermark=watermark.watermark))
+                watermark = loop.run_until_complete(
+                    init_watermark(
+                        pool, watermark.watermark, missing_block_ranges,
+                        start_block, end_block))
+        else:
+            blocks_progress_bar = tqdm(
+                initial=existing_count,
+                total=range_count,
+                bar_format='{bar}| [{rate_fmt}{postfix}]',
+                ncols=48,
+                dynamic_ncols=False,
+                unit=' blocks',
+            )
+            ops_progress_bar = tqdm(initial=existing_count * 50,
+                                    total=range_count * 50,
+                                    bar_format='{bar}| [{rate_fmt}{postfix}]',
+                                    ncols=48,
+                                    dynamic_ncols=False,
+                                    unit='    ops')
 
-
-
-        blocks_progress_bar = tqdm(initial=existing_count,
-                                   total=range_count,
-                                   bar_format='{bar}| [{rate_fmt}{postfix}]',
-                                   ncols=48,
-                                   dynamic_ncols=False,
-                                   unit=' blocks',
-                                   )
-        ops_progress_bar = tqdm(initial=existing_count * 50,
-                                total=range_count * 50,
-                                bar_format='{bar}| [{rate_fmt}{postfix}]',
-                                ncols=48,
-                                dynamic_ncols=False,
-                                unit='    ops')
-
-        loop.run_until_complete(process_blocks(missing_block_nums,
-                                             dpayd_http_url,
-                                             AIOHTTP_SESSION,
-                                             pool,
-                                             DB_META,
-                                             blocks_pbar=blocks_progress_bar,
-                                             ops_pbar=ops_progress_bar))
+            loop.run_until_complete(
+                process_blocks(missing_block_nums, fetch, pool,
+                               blocks_pbar=blocks_progress_bar,
+                               ops_pbar=ops_progress_bar, write_mode=write_mode,
+                               chunk_size=chunk_size, executor=PREPARE_EXECUTOR,
+                               pipeline_config=pipeline_config,
+                               known_account_names=known_account_names,
+                               watermark=watermark, spool=SPOOL))
 
         # [6/7] Make second sweep for missing blocks
         task_message = fmt_task_message(
@@ -639,25 +1791,23 @@ def _populate(database_url, legacy_database_url, dpayd_http_url, start_block, en
             task_num=6)
         click.echo(task_message)
 
-        existing_count, missing_count, range_count = loop.run_until_complete(
-            get_existing_and_missing_count(pool, start_block, end_block))
+        # check dpds_core_blocks itself rather than the recorded progress,
+        # above the watermark every block below which is known to be stored
+        sweep_start_block = start_block
+        if watermark is not None:
+            sweep_start_block = max(start_block, watermark.watermark + 1)
+        missing_block_ranges = loop.run_until_complete(
+            find_missing_block_ranges(pool, sweep_start_block, end_block))
+        missing_count = count_range_block_nums(missing_block_ranges)
+        existing_count = range_count - missing_count
+        missing_block_nums = range_block_nums(missing_block_ranges)
         task_message = fmt_task_message(
-            f'Building list of {missing_count} blocks missing from db between {start_block}<<-->>{end_block}',
+            f'Found {missing_count} blocks missing from db between '
+            f'{start_block}<<-->>{end_block}',
             emoji_code_point=u'\U0001F52D',
-            task_num=4)
+            task_num=6)
         click.echo(task_message)
 
-        with click.progressbar(length=end_block, **pbar_kwargs) as pbar:
-            pbar.update(existing_count)
-            missing_block_nums = loop.run_until_complete(
-                collect_missing_block_nums(
-                    pool,
-                    end_block,
-                    missing_count,
-                    start_block=start_block,
-                    pbar=pbar))
-
-
         blocks_progress_bar = tqdm(initial=existing_count,
                                    total=range_count,
                                    dynamic_ncols=False,
@@ -667,27 +1817,51 @@ def _populate(database_url, legacy_database_url, dpayd_http_url, start_block, en
                                 total=range_count * 50,
                                 dynamic_ncols=False,
                                 unit='    ops')
-        loop.run_until_complete(process_blocks(missing_block_nums,
-                                               dpayd_http_url,
-                                               AIOHTTP_SESSION,
-                                               pool,
-                                               DB_META,
-                                               blocks_pbar=blocks_progress_bar,
-                                               ops_pbar=ops_progress_bar))
-
-
+        loop.run_until_complete(
+            process_blocks(missing_block_nums, fetch, pool,
+                           blocks_pbar=blocks_progress_bar,
+                           ops_pbar=ops_progress_bar, write_mode=write_mode,
+                           chunk_size=chunk_size, executor=PREPARE_EXECUTOR,
+                           pipeline_config=pipeline_config,
+                           known_account_names=known_account_names,
+                           watermark=watermark, spool=SPOOL))
+
+        if bulk_load:
+            task_message = fmt_task_message(
+                'Rebuilding indexes and foreign keys after bulk load',
+                emoji_code_point=u'\U0001F52D',
+                task_num=6)
+            click.echo(task_message)
+            loop.run_until_complete(
+                restore_indexes_and_foreign_keys(pool, workers=index_workers))
 
         # [7/7] stream new blocks
-        task_message = fmt_task_message(
-            'Streaming blocks', emoji_code_point=u'\U0001F4DD',
-            task_num=7)
-        click.echo(task_message)
+        if follow:
+            task_message = fmt_task_message(
+                f'Streaming blocks after {end_block}',
+                emoji_code_point=u'\U0001F4DD', task_num=7)
+            click.echo(task_message)
+            loop.run_until_complete(
+                task_stream_blocks(
+                    pool, RPC_CLIENT, end_block + 1, FETCH_CONTROLLER,
+                    write_mode=write_mode, chunk_size=chunk_size,
+                    rpc_retries=rpc_retries, executor=PREPARE_EXECUTOR,
+                    poll_interval=poll_interval,
+                    known_account_names=known_account_names,
+                    only_virtual=virtual_ops_only, watermark=watermark))
 
     except KeyboardInterrupt:
         pass
     except Exception as e:
         logger.exception('ERROR')
         raise e
+    finally:
+        PREPARE_EXECUTOR.shutdown(wait=False)
+        loop.run_until_complete(close_rpc_client(RPC_CLIENT))
+        if SPOOL is not None:
+            SPOOL.close()
+        if METRICS_RUNNER is not None:
+            loop.run_until_complete(METRICS_RUNNER.cleanup())
 
 
 # included only for debugging with pdb, all the above code should be called
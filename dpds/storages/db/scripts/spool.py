@@ -0,0 +1,277 @@
+# -*- coding: utf-8 -*-
+"""On-disk spool of fetched chunks between populate's fetch and store stages
+
+Fetched chunks are appended as zlib compressed JSON records to append-only
+segment files, so fetching can run ahead of the database without holding
+the backlog in memory. The store side reads records back in order and
+stores them in any order. The consumer offset, the sequence number of the
+first record not yet stored, only advances over records stored without
+gaps, so after a crash every record from it on is replayed rather than
+fetched again.
+
+Segments are named after the sequence number of their first record and
+deleted once all their records are stored. Records are framed by their
+length and crc32, so a record torn by a crash is detected and dropped.
+"""
+import asyncio
+import os
+import struct
+import zlib
+
+import rapidjson as json
+import structlog
+
+logger = structlog.get_logger(__name__)
+
+DEFAULT_SEGMENT_BYTES = 64 * 1024 * 1024
+SEGMENT_SUFFIX = '.seg'
+OFFSET_FILENAME = 'offset'
+# payload length, crc32 of payload
+RECORD_HEADER = struct.Struct('>II')
+COMPRESSION_LEVEL = 1
+
+
+def encode_record(results):
+    return zlib.compress(json.dumps(results).encode(), COMPRESSION_LEVEL)
+
+
+def decode_record(payload):
+    return json.loads(zlib.decompress(payload))
+
+
+def segment_filename(first_seq):
+    return f'{first_seq:020d}{SEGMENT_SUFFIX}'
+
+
+def read_record(f):
+    """Read the next record's payload from f, None at the end or at a torn
+    record"""
+    header = f.read(RECORD_HEADER.size)
+    if len(header) < RECORD_HEADER.size:
+        return None
+    length, crc = RECORD_HEADER.unpack(header)
+    payload = f.read(length)
+    if len(payload) < length or zlib.crc32(payload) != crc:
+        return None
+    return payload
+
+
+class Spool(object):
+    """Append-only segment files of fetched chunks with a consumer offset
+
+    Args:
+      path: directory holding the segments and offset
+      segment_bytes: size at which a new segment is started
+      max_bytes: appends wait while the segments take more than this
+    """
+
+    def __init__(self, path, segment_bytes=DEFAULT_SEGMENT_BYTES,
+                 max_bytes=None):
+        self.path = path
+        self.max_bytes = max_bytes
+        # several segments to a spool so stored ones free space while it fills
+        self.segment_bytes = (min(segment_bytes, max(max_bytes // 4, 1))
+                              if max_bytes else segment_bytes)
+        os.makedirs(path, exist_ok=True)
+        self.consumed = self._read_offset()
+        self._stored = set()
+        self._segment_sizes = {}
+        for filename in sorted(os.listdir(path)):
+            if filename.endswith(SEGMENT_SUFFIX):
+                first_seq = int(filename[:-len(SEGMENT_SUFFIX)])
+                self._segment_sizes[first_seq] = os.path.getsize(
+                    self._segment_path(first_seq))
+        self._writer = None
+        self._reader = None
+        self._changed = None
+        self._append_lock = None
+        self.next_seq = self._recover()
+        self._delete_consumed_segments()
+        # set while a fetch pipeline appends, records() follows appends until it
+        # is cleared
+        self.writing = False
+
+    # --- files ---
+
+    def _segment_path(self, first_seq):
+        return os.path.join(self.path, segment_filename(first_seq))
+
+    def _read_offset(self):
+        try:
+            with open(os.path.join(self.path, OFFSET_FILENAME)) as f:
+                return int(f.read().strip() or 0)
+        except FileNotFoundError:
+            return 0
+
+    def _write_offset(self):
+        offset_path = os.path.join(self.path, OFFSET_FILENAME)
+        with open(offset_path + '.tmp', 'w') as f:
+            f.write(str(self.consumed))
+        os.replace(offset_path + '.tmp', offset_path)
+
+    def _recover(self):
+        """Count the records of the last segment, truncating a torn record"""
+        if not self._segment_sizes:
+            return self.consumed
+        first_seq = max(self._segment_sizes)
+        seq = first_seq
+        with open(self._segment_path(first_seq), 'r+b') as f:
+            end = 0
+            while read_record(f) is not None:
+                seq += 1
+                end = f.tell()
+            if end < self._segment_sizes[first_seq]:
+                logger.warning(
+                    'truncating torn spool record',
+                    segment=self._segment_path(first_seq), offset=end)
+                f.truncate(end)
+                self._segment_sizes[first_seq] = end
+        return max(seq, self.consumed)
+
+    def _delete_consumed_segments(self):
+        first_seqs = sorted(self._segment_sizes)
+        for first_seq, next_first_seq in zip(first_seqs,
+                                             first_seqs[1:] + [self.next_seq]):
+            if next_first_seq > self.consumed:
+                break
+            if self._writer is not None and self._writer_first_seq == first_seq:
+                if self._append_lock is not None and self._append_lock.locked():
+                    break
+                # the next append starts a new segment
+                self._writer.close()
+                self._writer = None
+            os.remove(self._segment_path(first_seq))
+            del self._segment_sizes[first_seq]
+
+    def _rotate_writer(self):
+        if (self._writer is not None
+                and self._segment_sizes[self._writer_first_seq]
+                < self.segment_bytes):
+            return
+        if self._writer is not None:
+            self._writer.close()
+        self._writer_first_seq = self.next_seq
+        self._writer = open(self._segment_path(self.next_seq), 'ab')
+        self._segment_sizes.setdefault(self.next_seq, 0)
+
+    def _write_sync(self, record):
+        self._writer.write(record)
+        # flushed so readers and a restart after a crash see whole records
+        self._writer.flush()
+
+    def _segment_first_seq(self, seq):
+        # on the loop thread, which adds and deletes segments
+        return max(s for s in self._segment_sizes if s <= seq)
+
+    def _read_sync(self, seq, first_seq):
+        # reopened at the start of each segment
+        if self._reader is None or self._reader_seq != seq or seq == first_seq:
+            self._open_reader(seq, first_seq)
+        payload = read_record(self._reader)
+        if payload is None:
+            raise IOError(f'spool record {seq} is missing or torn')
+        self._reader_seq += 1
+        return payload
+
+    def _open_reader(self, seq, first_seq):
+        if self._reader is not None:
+            self._reader.close()
+        self._reader = open(self._segment_path(first_seq), 'rb')
+        self._reader_seq = first_seq
+        while self._reader_seq < seq:
+            read_record(self._reader)
+            self._reader_seq += 1
+
+    # --- async api ---
+
+    @property
+    def changed(self):
+        # created lazily so the spool can be built outside the loop
+        if self._changed is None:
+            self._changed = asyncio.Condition()
+        return self._changed
+
+    async def _notify(self):
+        async with self.changed:
+            self.changed.notify_all()
+
+    @property
+    def size(self):
+        return sum(self._segment_sizes.values())
+
+    @property
+    def pending(self):
+        """Records appended but not yet stored"""
+        return self.next_seq - self.consumed
+
+    async def append(self, results):
+        """Append a chunk's (block_num, raw_block, raw_ops) results, returns its
+        sequence number
+
+        Waits while the spool is over max_bytes.
+        """
+        if self.max_bytes:
+            async with self.changed:
+                await self.changed.wait_for(lambda: self.size < self.max_bytes)
+        loop = asyncio.get_event_loop()
+        payload = await loop.run_in_executor(None, encode_record, results)
+        record = RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+        # shielded so a cancelled append still counts a record it wrote
+        seq = await asyncio.shield(self._append_record(record))
+        await self._notify()
+        return seq
+
+    async def _append_record(self, record):
+        if self._append_lock is None:
+            self._append_lock = asyncio.Lock()
+        async with self._append_lock:
+            self._rotate_writer()
+            await asyncio.get_event_loop().run_in_executor(
+                None, self._write_sync, record)
+            self._segment_sizes[self._writer_first_seq] += len(record)
+            seq = self.next_seq
+            self.next_seq += 1
+            return seq
+
+    async def records(self):
+        """Yield (seq, payload) from the consumer offset on
+
+        Follows appends while writing is set, then stops at the last record.
+        """
+        loop = asyncio.get_event_loop()
+        seq = self.consumed
+        while True:
+            if seq < self.next_seq:
+                payload = await loop.run_in_executor(
+                    None, self._read_sync, seq, self._segment_first_seq(seq))
+                yield seq, payload
+                seq += 1
+                continue
+            if not self.writing:
+                return
+            async with self.changed:
+                await self.changed.wait_for(
+                    lambda: seq < self.next_seq or not self.writing)
+
+    async def stop_writing(self):
+        self.writing = False
+        await self._notify()
+
+    async def commit(self, seq):
+        """Mark record seq stored, advancing the consumer offset past stored
+        records"""
+        self._stored.add(seq)
+        if self.consumed not in self._stored:
+            return
+        while self.consumed in self._stored:
+            self._stored.remove(self.consumed)
+            self.consumed += 1
+        self._write_offset()
+        self._delete_consumed_segments()
+        await self._notify()
+
+    def close(self):
+        for f in (self._writer, self._reader):
+            if f is not None:
+                f.close()
+        self._writer = self._reader = None
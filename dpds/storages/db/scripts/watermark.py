@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+"""Contiguous commit watermark for populate
+
+The watermark is the highest block_num N such that every block_num <= N
+has been committed. Chunks commit in whatever order the store workers
+finish them, so a chunk committed ahead of an earlier one waits in a
+reorder buffer of committed ranges above the watermark until the blocks
+before it are in.
+"""
+from dpds.utils import block_num_ranges
+from dpds.utils import merge_ranges
+
+
+class CommitWatermark(object):
+    """Track the contiguous commit watermark from committed block_nums
+
+    Args:
+      watermark: highest block_num known to have every block below it committed
+      committed_ranges: inclusive (start, end) ranges known to be committed
+    """
+
+    def __init__(self, watermark=0, committed_ranges=()):
+        ranges = list(committed_ranges)
+        if watermark:
+            ranges.append((1, watermark))
+        self._ranges = merge_ranges(ranges)
+        self.watermark = watermark
+        self._advance()
+
+    def _advance(self):
+        if self._ranges and self._ranges[0][0] <= self.watermark + 1:
+            self.watermark = max(self.watermark, self._ranges[0][1])
+        # ranges at or below the watermark are implied by it
+        self._ranges = [(start, end) for start, end in self._ranges
+                        if end > self.watermark]
+
+    def commit(self, block_nums):
+        """Record committed block_nums, returns True if the watermark
+        advanced"""
+        previous = self.watermark
+        self._ranges = merge_ranges(self._ranges + block_num_ranges(block_nums))
+        self._advance()
+        return self.watermark > previous
+
+    @property
+    def buffered_ranges(self):
+        """Committed ranges waiting above the watermark"""
+        return list(self._ranges)
+
+    @property
+    def buffered_count(self):
+        return sum(end - start + 1 for start, end in self._ranges)
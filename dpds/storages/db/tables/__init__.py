@@ -4,6 +4,7 @@ from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.dialects.postgresql import ENUM
 
+import structlog
 
 
 
@@ -12,32 +13,66 @@ metadata = MetaData()
 Base = declarative_base(metadata=metadata)
 Session = sessionmaker()
 
+logger = structlog.get_logger(__name__)
+
 # pylint: disable=wrong-import-position
 from ..utils import isolated_nullpool_engine
 
 
-def init_tables(database_url, _metadata, checkfirst=True):
-    """Create any missing tables on the database"""
+def init_tables(database_url, _metadata, checkfirst=True, partition_width=None):
+    """Create any missing tables on the database
+
+    With a partition_width, the largest operation tables are created range
+    partitioned by block_num, starting with the partition holding block 0.
+    Tables which already exist are left as they are.
+    """
     import dpds.storages.db.tables.operations
     import dpds.storages.db.tables.block
     import dpds.storages.db.tables.meta
+    from .partitions import PARTITIONED_TABLES
+    from .partitions import PARTITIONED_TABLE_NAMES_SQL
+    from .partitions import PARTITION_BOUNDS_SQL
+    from .partitions import create_partition_sql
+    from .partitions import partition_layout
+    from .partitions import partitioned_metadata
+    if partition_width:
+        _metadata = partitioned_metadata(_metadata)
     with isolated_nullpool_engine(database_url) as engine:
         _metadata.create_all(bind=engine, checkfirst=checkfirst)
-
-
-def reset_tables(database_url, _metadata):
+        if partition_width:
+            partitioned = {
+                row[0] for row in engine.execute(PARTITIONED_TABLE_NAMES_SQL)}
+            layout = partition_layout(engine.execute(PARTITION_BOUNDS_SQL))
+            for table_name in PARTITIONED_TABLES:
+                if table_name in layout:
+                    # already has partitions, and with them a width
+                    continue
+                if table_name in partitioned:
+                    engine.execute(
+                        create_partition_sql(table_name, 0, partition_width))
+                else:
+                    logger.warning(
+                        'table exists unpartitioned, not partitioning',
+                        table_name=table_name)
+
+
+def reset_tables(database_url, _metadata, partition_width=None):
     """Drop and then create tables on the database"""
+    from .partitions import PARTITION_NAMES_SQL
 
     # use reflected MetaData to avoid errors due to ORM classes
     # being inconsistent with existing tables
     with isolated_nullpool_engine(database_url) as engine:
         seperate_metadata = MetaData()
         seperate_metadata.reflect(bind=engine)
+        # partitions are dropped along with their partitioned table
+        for row in engine.execute(PARTITION_NAMES_SQL):
+            seperate_metadata.remove(seperate_metadata.tables[row[0]])
         seperate_metadata.drop_all(bind=engine)
         ENUM(name='dpds_operation_types').drop(engine)
 
     # use ORM clases to define tables to create
-    init_tables(database_url, _metadata)
+    init_tables(database_url, _metadata, partition_width=partition_width)
 
 
 def test_connection(database_url):
@@ -2,6 +2,9 @@
 
 import asyncio
 import concurrent.futures
+import itertools as it
+import zlib
+from collections import defaultdict
 
 import dateutil.parser
 import structlog
@@ -9,6 +12,10 @@ import uvloop
 
 import dpds.dpds_json
 from dpds.utils import block_num_from_previous
+from dpds.storages.db.tables.insert_plans import ACCOUNT_INSERT_PLAN
+from dpds.storages.db.tables.insert_plans import BLOCK_INSERT_PLAN
+from dpds.storages.db.tables.insert_plans import op_insert_plan
+from dpds.storages.db.tables.meta.accounts import extract_account_names
 from dpds.storages.db.tables.operations import op_class_for_type
 
 logger = structlog.get_logger(__name__)
@@ -21,23 +28,47 @@ async def prepare_raw_blocks_for_storage(raw_block, loop=None, executor=EXECUTOR
     pass
 
 async def prepare_raw_block_for_storage(raw_block, loop=None, executor=EXECUTOR):
-    block_dict = await load_raw_block(raw_block, loop=loop, executor=executor)
-    return dict(
-        raw=block_dict['raw'],
-        block_num=block_dict['block_num'],
-        previous=block_dict['previous'],
-        timestamp=block_dict['timestamp'],
-        witness=block_dict['witness'],
-        witness_signature=block_dict['witness_signature'],
-        transaction_merkle_root=block_dict['transaction_merkle_root'])
+    """`prepare_raw_block_for_storage_sync` run in executor"""
+    loop = loop or asyncio.get_event_loop()
+    return await loop.run_in_executor(
+        executor, prepare_raw_block_for_storage_sync, raw_block)
 
 
 async def load_raw_block(raw_block, loop=None, executor=EXECUTOR):
+    """`load_raw_block_sync` run in executor"""
+    loop = loop or asyncio.get_event_loop()
+    return await loop.run_in_executor(executor, load_raw_block_sync, raw_block)
+
+
+async def load_raw_operation(raw_operation, loop=None, executor=EXECUTOR):
+    """`load_raw_operation_sync` run in executor"""
+    loop = loop or asyncio.get_event_loop()
+    return await loop.run_in_executor(executor, load_raw_operation_sync,
+                                      raw_operation)
+
+
+async def prepare_raw_operation_for_storage(raw_operation, loop=None, executor=EXECUTOR):
+    """`prepare_raw_operation_for_storage_sync` run in executor"""
+    loop = loop or asyncio.get_event_loop()
+    return await loop.run_in_executor(
+        executor, prepare_raw_operation_for_storage_sync, raw_operation)
+
+
+def prepare_op_class_fields(op_dict_data, fields):
+    return {k: v(op_dict_data) for k, v in fields.items()}
+
+
+# --- Batch preparation ---
+# These run inside ProcessPoolExecutor workers, and in the executor of the
+# async functions above, so they are plain functions which take and return
+# picklable values.
+
+def load_raw_block_sync(raw_block):
     """
         Convert raw block to dict, add block_num and parse timestamp into datetime
 
-        This is the async version which inlines functions from `dpds.storages.db.core`
-        for speedup during initial syncing
+        Inlines functions from `dpds.storages.db.core` for speedup during
+        initial syncing
 
         Args:
             raw_block (Union[Dict[str, Any], str, bytes]):
@@ -45,17 +76,15 @@ async def load_raw_block(raw_block, loop=None, executor=EXECUTOR):
         Returns:
             Dict[str, List]:
     """
-
     if isinstance(raw_block, dict):
         block_dict = dict()
         block_dict.update(raw_block)
-        block_dict['raw'] = await loop.run_in_executor(executor, dpds.dpds_json.dumps, block_dict)
+        block_dict['raw'] = dpds.dpds_json.dumps(block_dict)
     elif isinstance(raw_block, str):
-        block_dict = await loop.run_in_executor(executor, dpds.dpds_json.loads, raw_block)
+        block_dict = dpds.dpds_json.loads(raw_block)
         block_dict['raw'] = raw_block
     elif isinstance(raw_block, bytes):
-        block_dict = await loop.run_in_executor(executor, dpds.dpds_json.loads,
-                                                raw_block)
+        block_dict = dpds.dpds_json.loads(raw_block)
         block_dict['raw'] = raw_block.decode('utf8')
     else:
         raise TypeError(f'Unsupported raw_block type: {type(raw_block)}')
@@ -64,12 +93,30 @@ async def load_raw_block(raw_block, loop=None, executor=EXECUTOR):
         block_dict['block_num'] = block_num_from_previous(block_dict['previous'])
     timestamp = block_dict.get('timestamp')
     if isinstance(timestamp, str):
-        block_dict['timestamp'] = await loop.run_in_executor(executor, dateutil.parser.parse, timestamp)
-
+        block_dict['timestamp'] = dateutil.parser.parse(timestamp)
     return block_dict
 
 
-async def load_raw_operation(raw_operation, loop=None, executor=EXECUTOR):
+def load_raw_ops_sync(raw_ops):
+    """Decode raw_ops read as undecoded JSON, e.g. from the fs store"""
+    if isinstance(raw_ops, (str, bytes)):
+        return dpds.dpds_json.loads(raw_ops)
+    return raw_ops
+
+
+def prepare_raw_block_for_storage_sync(raw_block):
+    block_dict = load_raw_block_sync(raw_block)
+    return dict(
+        raw=block_dict['raw'],
+        block_num=block_dict['block_num'],
+        previous=block_dict['previous'],
+        timestamp=block_dict['timestamp'],
+        witness=block_dict['witness'],
+        witness_signature=block_dict['witness_signature'],
+        transaction_merkle_root=block_dict['transaction_merkle_root'])
+
+
+def load_raw_operation_sync(raw_operation):
     """Load operation fronm response of get_ops_in_block calls
 
     {
@@ -93,28 +140,83 @@ async def load_raw_operation(raw_operation, loop=None, executor=EXECUTOR):
 
 
     """
-    raw_operation['timestamp'] = await loop.run_in_executor(executor, dateutil.parser.parse, raw_operation['timestamp'])
     return {
         'block_num': raw_operation['block'],
         'transaction_num': raw_operation['trx_in_block'],
         'operation_num': raw_operation['op_in_trx'],
-        'timestamp': raw_operation['timestamp'],
+        'timestamp': dateutil.parser.parse(raw_operation['timestamp']),
         'trx_id': raw_operation['trx_id'],
         'operation_type': raw_operation['op'][0],
         'data': raw_operation['op'][1]
     }
 
 
-async def prepare_raw_operation_for_storage(raw_operation, loop=None, executor=EXECUTOR):
-    op_dict = await load_raw_operation(raw_operation, loop=loop, executor=executor)
+def prepare_raw_operation_for_storage_sync(raw_operation):
+    op_dict = load_raw_operation_sync(raw_operation)
+    data = op_dict.pop('data')
     op_cls = op_class_for_type(op_dict['operation_type'])
-    _fields = op_cls._fields
-    prepared_fields = await loop.run_in_executor(executor, prepare_op_class_fields, op_dict['data'], _fields)
+    prepared_fields = prepare_op_class_fields(data, op_cls._fields)
     op_dict.update(prepared_fields)
-    op_dict.update({k: v for k, v in op_dict['data'].items() if k not in prepared_fields})
-    del op_dict['data']
+    op_dict.update({k: v for k, v in data.items() if k not in prepared_fields})
     return op_dict
 
 
-def prepare_op_class_fields(op_dict_data, fields):
-    return {k: v(op_dict_data) for k, v in fields.items()}
+def prepare_chunk_rows(results):
+    """Transform a fetched chunk into ready-to-write row tuples per table
+
+    Args:
+        results (List[Tuple[int, Dict, List[Dict]]]): (block_num, raw_block,
+            raw_ops) tuples as returned by the populate fetchers, raw_block and
+            raw_ops may also be undecoded JSON
+
+    Returns:
+        Dict[str, Tuple[Tuple[str], List[tuple]]]: table name to (columns,
+            records) in the table's insert plan column order, ordered so that
+            ``dpds_meta_accounts`` comes first and ``dpds_core_blocks`` second
+    """
+    prepared_blocks = []
+    rows_by_plan = defaultdict(list)
+    for _, raw_block, raw_ops in results:
+        prepared_blocks.append(prepare_raw_block_for_storage_sync(raw_block))
+        for raw_op in load_raw_ops_sync(raw_ops) or []:
+            prepared_op = prepare_raw_operation_for_storage_sync(raw_op)
+            rows_by_plan[op_insert_plan(
+                prepared_op['operation_type'])].append(prepared_op)
+
+    account_names = extract_account_names(
+        it.chain.from_iterable(rows_by_plan.values()))
+    account_names.update(b['witness'] for b in prepared_blocks)
+    account_names.discard(None)
+
+    table_rows = {
+        ACCOUNT_INSERT_PLAN.table_name: (ACCOUNT_INSERT_PLAN.columns,
+                                         [(a,) for a in account_names]),
+        BLOCK_INSERT_PLAN.table_name: (BLOCK_INSERT_PLAN.columns,
+                                       BLOCK_INSERT_PLAN.records(
+                                           prepared_blocks))
+    }
+    for plan, rows in rows_by_plan.items():
+        table_rows[plan.table_name] = (plan.columns, plan.records(rows))
+    return table_rows
+
+
+def prepare_compressed_chunk(payload):
+    """`prepare_chunk_rows` for a zlib compressed JSON chunk, as spooled by
+    populate
+
+    Returns the chunk's block_nums with its table rows, so only the
+    compressed chunk is sent to the process preparing it.
+    """
+    results = dpds.dpds_json.loads(zlib.decompress(payload))
+    return ([block_num for block_num, _, _ in results],
+            prepare_chunk_rows(results))
+
+
+async def prepare_chunk_for_storage(results, loop=None, executor=None):
+    """Prepare a whole fetched chunk in one executor call
+
+    Intended for a ProcessPoolExecutor so preparation runs outside the
+    event loop's process and scales with cores.
+    """
+    loop = loop or asyncio.get_event_loop()
+    return await loop.run_in_executor(executor, prepare_chunk_rows, results)
@@ -11,6 +11,7 @@ from sqlalchemy import String
 from sqlalchemy import UnicodeText
 from sqlalchemy import ForeignKey
 from sqlalchemy import func
+from sqlalchemy import text
 
 from toolz import dissoc
 
@@ -18,6 +19,27 @@ import dpds.dpds_json
 from dpds.storages.db.tables import Base
 from dpds.storages.db.tables.core import prepare_raw_block
 from dpds.storages.db.utils import UniqueMixin
+from dpds.utils import range_block_nums
+
+# Gaps between consecutive stored block_nums, with sentinels just outside
+# the requested range so leading and trailing gaps are found too. The
+# {start_block} and {end_block} placeholders take the driver's bind syntax.
+MISSING_BLOCK_RANGES_SQL = """
+WITH bounds AS (
+    SELECT block_num FROM dpds_core_blocks
+    WHERE block_num BETWEEN {start_block} AND {end_block}
+    UNION ALL SELECT {start_block} - 1
+    UNION ALL SELECT {end_block} + 1
+)
+SELECT block_num + 1 AS start_block, next_block_num - 1 AS end_block
+FROM (
+    SELECT block_num,
+        LEAD(block_num) OVER (ORDER BY block_num) AS next_block_num
+    FROM bounds
+) AS neighbours
+WHERE next_block_num - block_num > 1
+ORDER BY block_num
+"""
 
 
 class Block(Base, UniqueMixin):
@@ -260,3 +282,44 @@ class Block(Base, UniqueMixin):
             return 0
 
         return highest
+
+    @classmethod
+    def find_missing_ranges(cls, session, last_chain_block, start_block=1):
+        """
+        Yield inclusive (start, end) ranges of block_nums missing from the db.
+
+        Gaps are found by the database, only the ranges are streamed back.
+
+        Args:
+            session (sqlalchemy.orm.session.Session):
+            last_chain_block (int):
+            start_block (int):
+
+        Yields:
+            Tuple[int, int]:
+        """
+        query = text(MISSING_BLOCK_RANGES_SQL.format(start_block=':start_block',
+                                                     end_block=':end_block'))
+        results = session.connection().execution_options(
+            stream_results=True).execute(query,
+                                         start_block=start_block,
+                                         end_block=last_chain_block)
+        for row in results:
+            yield row.start_block, row.end_block
+
+    @classmethod
+    def find_missing(cls, session, last_chain_block, start_block=1):
+        """
+        Return list of block_nums missing from the db.
+
+        Args:
+            session (sqlalchemy.orm.session.Session):
+            last_chain_block (int):
+            start_block (int):
+
+        Returns:
+            List[int]:
+        """
+        return list(range_block_nums(
+            cls.find_missing_ranges(session, last_chain_block,
+                                    start_block=start_block)))
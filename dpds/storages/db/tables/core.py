@@ -160,6 +160,44 @@ def extract_operations_from_block(raw_block):
             yield op
 
 
+def extract_raw_operations_from_block(raw_block, block_num=None):
+    """Non-virtual operations of a block, as returned by get_ops_in_block
+
+    Operations are numbered like dpayd numbers them, from 0 within the
+    block and within each transaction, and take their trx_id from the
+    block's transaction_ids, so only virtual operations need fetching.
+
+    Args:
+        raw_block (Dict[str, Any]): get_block result
+        block_num (int): the block's block_num, read from previous if omitted
+
+    Returns:
+        Generator[Dict[str, Any]]:
+
+    Raises:
+        ValueError: if the block has transactions but no transaction_ids
+    """
+    transactions = raw_block['transactions']
+    if not transactions:
+        return
+    transaction_ids = raw_block.get('transaction_ids')
+    if not transaction_ids or len(transaction_ids) != len(transactions):
+        raise ValueError('block has no transaction_ids to take trx_ids from')
+    if block_num is None:
+        block_num = block_num_from_previous(raw_block['previous'])
+    timestamp = raw_block['timestamp']
+    for trx_in_block, (trx_id, transaction) in enumerate(
+            zip(transaction_ids, transactions)):
+        for op_in_trx, operation in enumerate(transaction['operations']):
+            yield {'trx_id': trx_id,
+                   'block': block_num,
+                   'trx_in_block': trx_in_block,
+                   'op_in_trx': op_in_trx,
+                   'virtual_op': 0,
+                   'timestamp': timestamp,
+                   'op': operation}
+
+
 def extract_operations_from_blocks(blocks):
     """
 
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""Insert plans used when writing prepared blocks and operations
+
+Plans are built once at import from the ORM tables so every block or
+operation of a given type always produces the same SQL text and the same
+column order. Identical SQL text lets asyncpg reuse the statement it
+prepared on each connection.
+"""
+from collections import namedtuple
+
+from sqlalchemy import Integer
+
+from dpds.storages.db.tables.block import Block
+from dpds.storages.db.tables.meta.accounts import Account
+from dpds.storages.db.tables.operations import combined_ops_class_map
+
+# prepared blocks carry these keys, columns left out keep their defaults
+BLOCK_COLUMNS = ('raw',
+                 'block_num',
+                 'previous',
+                 'timestamp',
+                 'witness',
+                 'witness_signature',
+                 'transaction_merkle_root')
+
+
+class InsertPlan(
+        namedtuple('InsertPlan', ['table_name', 'columns', 'sql', 'defaults'])):
+    """Fixed column order and INSERT statement for one table
+
+    Every row is written with every column, so a column missing from a
+    prepared row dict is written with its default in defaults rather than
+    left to the database.
+    """
+    __slots__ = ()
+
+    def record(self, row):
+        """Return the tuple for a prepared row dict in this plan's column
+        order"""
+        return tuple(row[c] if c in row else default
+                     for c, default in zip(self.columns, self.defaults))
+
+    def records(self, rows):
+        return [self.record(row) for row in rows]
+
+
+def is_serial_column(table, column):
+    primary_key_columns = list(table.primary_key.columns)
+    return (primary_key_columns == [column]
+            and isinstance(column.type, Integer)
+            and column.autoincrement is not False)
+
+
+def column_default(column):
+    """The value written for column when a row leaves it out
+
+    Only scalar defaults can be written as values, any other column is
+    written as NULL.
+    """
+    if column.default is not None and column.default.is_scalar:
+        return column.default.arg
+    return None
+
+
+def build_insert_plan(table_name, columns, defaults=None):
+    columns_str = ', '.join(f'"{c}"' for c in columns)
+    values_str = ', '.join(f'${i}' for i in range(1, len(columns) + 1))
+    sql = (f'INSERT INTO {table_name} ({columns_str}) VALUES({values_str}) '
+           'ON CONFLICT DO NOTHING')
+    defaults = (tuple(defaults) if defaults is not None
+                else (None,) * len(columns))
+    return InsertPlan(table_name, tuple(columns), sql, defaults)
+
+
+def build_table_insert_plan(table, columns=None):
+    """Plan which writes columns of table, by default every column except a
+    serial primary key"""
+    if columns is None:
+        columns = [c.name for c in table.columns
+                   if not is_serial_column(table, c)]
+    return build_insert_plan(table.name, columns,
+                             defaults=[column_default(table.columns[c])
+                                       for c in columns])
+
+
+def build_op_insert_plans(op_class_map):
+    return {op_type: build_table_insert_plan(op_cls.__table__)
+            for op_type, op_cls in op_class_map.items()}
+
+
+ACCOUNT_INSERT_PLAN = build_table_insert_plan(Account.__table__, ['name'])
+BLOCK_INSERT_PLAN = build_table_insert_plan(Block.__table__, BLOCK_COLUMNS)
+OP_INSERT_PLANS = build_op_insert_plans(combined_ops_class_map)
+
+
+def op_insert_plan(op_type):
+    return OP_INSERT_PLANS[op_type]
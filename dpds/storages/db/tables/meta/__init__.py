@@ -1,4 +1,7 @@
 from .accounts import Account
+from .populate_leases import PopulateLease
+from .populate_progress import PopulateProgress
+from .populate_watermark import PopulateWatermark
 
 
 
@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+from sqlalchemy import Boolean
+from sqlalchemy import Column
+from sqlalchemy import DateTime
+from sqlalchemy import Integer
+from sqlalchemy import SmallInteger
+from sqlalchemy import Unicode
+
+from dpds.storages.db.tables import Base
+
+
+class PopulateLease(Base):
+    """Block ranges claimed by populate workers, see `scripts.leases`
+
+    A lease is held while owner is set and expires_at is in the future.
+    """
+
+    __tablename__ = 'dpds_populate_leases'
+    start_block = Column(Integer, primary_key=True, autoincrement=False)
+    end_block = Column(Integer, nullable=False)
+    owner = Column(Unicode(255))
+    expires_at = Column(DateTime(timezone=True))
+    completed = Column(Boolean, nullable=False, default=False, index=True)
+    attempts = Column(SmallInteger, nullable=False, default=0)
@@ -0,0 +1,17 @@
+# -*- coding: utf-8 -*-
+from sqlalchemy import Column
+from sqlalchemy import Integer
+
+from dpds.storages.db.tables import Base
+
+
+class PopulateProgress(Base):
+    """Contiguous, inclusive block ranges committed by populate
+
+    Rows are written in the same transaction as the blocks they describe and
+    merged periodically, so the table stays a handful of rows.
+    """
+
+    __tablename__ = 'dpds_populate_progress'
+    start_block = Column(Integer, primary_key=True, autoincrement=False)
+    end_block = Column(Integer, nullable=False)
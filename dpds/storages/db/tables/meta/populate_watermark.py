@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+from sqlalchemy import Column
+from sqlalchemy import Integer
+from sqlalchemy import SmallInteger
+from sqlalchemy.exc import ProgrammingError
+
+from dpds.storages.db.tables import Base
+
+
+class PopulateWatermark(Base):
+    """Highest block_num below which every block has been committed
+
+    A single row, only ever raised, after the commits it covers. Blocks
+    above it may be committed too, see `PopulateProgress`.
+    """
+
+    __tablename__ = 'dpds_populate_watermark'
+    id = Column(SmallInteger, primary_key=True, autoincrement=False, default=1)
+    block_num = Column(Integer, nullable=False)
+
+    @classmethod
+    def highest_block(cls, session):
+        """
+        Return the watermark, or None if populate hasn't recorded one or
+        hasn't created the table yet.
+
+        Unlike `Block.highest_block`, every block up to the result is in
+        the database.
+
+        Args:
+            session (sqlalchemy.orm.session.Session):
+
+        Returns:
+            Union[int, None]:
+        """
+        try:
+            return session.query(cls.block_num).filter(cls.id == 1).scalar()
+        except ProgrammingError:
+            # a database not yet initialized by a populate with watermarks
+            session.rollback()
+            return None
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""Range partitioning of the largest operation tables by block_num
+
+Partitioned tables are split into partitions of a fixed number of blocks,
+aligned to multiples of the width, so partition [k * width, (k + 1) * width)
+holds every row of blocks k * width through (k + 1) * width - 1. The width
+chosen when the tables are created is read back from the existing
+partitions, so ingest never needs to be told it.
+"""
+import re
+
+from sqlalchemy import Integer
+from sqlalchemy import MetaData
+from sqlalchemy import PrimaryKeyConstraint
+
+DEFAULT_PARTITION_WIDTH = 1_000_000
+
+PARTITIONED_TABLES = ('dpds_op_comments',
+                      'dpds_op_custom_jsons',
+                      'dpds_op_votes',
+                      'dpds_op_virtual_author_rewards',
+                      'dpds_op_virtual_comment_benefactor_rewards',
+                      'dpds_op_virtual_comment_rewards',
+                      'dpds_op_virtual_curation_rewards',
+                      'dpds_op_virtual_producer_rewards')
+
+PARTITION_KEY = 'block_num'
+
+PARTITION_BOUNDS_SQL = """
+SELECT parent.relname AS table_name,
+    pg_get_expr(child.relpartbound, child.oid) AS bound
+FROM pg_inherits
+JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+WHERE parent.relkind = 'p'
+"""
+
+PARTITIONED_TABLE_NAMES_SQL = """
+SELECT relname FROM pg_class WHERE relkind = 'p'
+"""
+
+PARTITION_NAMES_SQL = """
+SELECT relname FROM pg_class WHERE relispartition
+"""
+
+BOUND_PATTERN = re.compile(r"FROM \('?(-?\d+)'?\) TO \('?(-?\d+)'?\)")
+
+
+def include_partition_key(table):
+    """Add block_num to table's primary key
+
+    Postgres requires the primary key of a partitioned table to include
+    the partition key. A serial key column keeps its sequence.
+    """
+    columns = list(table.primary_key.columns)
+    if PARTITION_KEY in [column.name for column in columns]:
+        return
+    for column in columns:
+        if column.autoincrement == 'auto' and isinstance(column.type, Integer):
+            column.autoincrement = True
+    partition_column = table.c[PARTITION_KEY]
+    partition_column.primary_key = True
+    table.append_constraint(PrimaryKeyConstraint(*columns, partition_column))
+
+
+def partitioned_metadata(metadata, tables=PARTITIONED_TABLES):
+    """Copy metadata, declaring tables as range partitioned by block_num"""
+    copied = MetaData()
+    for table in metadata.sorted_tables:
+        table_copy = table.tometadata(copied)
+        if table.name in tables:
+            include_partition_key(table_copy)
+            table_copy.dialect_options['postgresql']['partition_by'] = (
+                f'RANGE ({PARTITION_KEY})')
+    return copied
+
+
+def partition_start(block_num, width):
+    return block_num - block_num % width
+
+
+def partition_starts(start_block, end_block, width):
+    """Starts of the partitions covering start_block through end_block"""
+    return list(
+        range(partition_start(start_block, width), end_block + 1, width))
+
+
+def partition_name(table_name, start):
+    return f'{table_name}_p{start}'
+
+
+def create_partition_sql(table_name, start, width):
+    return (f'CREATE TABLE IF NOT EXISTS {partition_name(table_name, start)} '
+            f'PARTITION OF {table_name} FOR VALUES FROM ({start}) '
+            f'TO ({start + width})')
+
+
+def parse_partition_bound(bound):
+    """Return the (start, end) of a range partition bound, end exclusive"""
+    match = BOUND_PATTERN.search(bound or '')
+    if not match:
+        return None
+    return int(match.group(1)), int(match.group(2))
+
+
+def partition_layout(rows):
+    """Map each partitioned table to its width and existing partition starts
+
+    Args:
+      rows: (table_name, bound) pairs from PARTITION_BOUNDS_SQL
+
+    Returns:
+      Dict[str, Tuple[int, Set[int]]]:
+    """
+    layout = {}
+    for table_name, bound in rows:
+        parsed = parse_partition_bound(bound)
+        if parsed is None:
+            continue
+        start, end = parsed
+        _, starts = layout.setdefault(table_name, (end - start, set()))
+        starts.add(start)
+    return layout
+
+
+def missing_partitions(layout, start_block, end_block):
+    """(table_name, start, width) for partitions needed to hold the blocks"""
+    return [(table_name, start, width)
+            for table_name, (width, starts) in sorted(layout.items())
+            for start in partition_starts(start_block, end_block, width)
+            if start not in starts]
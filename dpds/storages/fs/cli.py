@@ -5,35 +5,21 @@ import click
 import shutil
 import os
 import pathlib
-import requests
 import structlog
 import hashlib
 
 from dpds.dpds_json import dumps
+from dpds.http_client import DEFAULT_BATCH_SIZE
+from dpds.http_client import SimpleDPayAPIClient
+from dpds.response_cache import DEFAULT_MAX_BYTES as DEFAULT_RPC_CACHE_MAX_BYTES
+from dpds.response_cache import ResponseCache
+from dpds.utils import chunkify
 
 logger = structlog.get_logger(__name__)
 
 CHARS = ['0', '1', '2', '3', '4', '5', '6', '7', '8', '9', 'a', 'b', 'c', 'd', 'e', 'f']
 
 
-def fetch(session, dpayd_url, block_num, method):
-    if method == 'get_block':
-        jsonrpc_data = dict(id=block_num, jsonrpc='2.0', method=method,
-                            params=[block_num])
-    elif method == 'get_ops_in_block':
-        jsonrpc_data = dict(id=block_num, jsonrpc='2.0', method=method,
-                            params=[block_num, False])
-    else:
-        raise ValueError('unknown method %s' % method)
-    response = session.post(dpayd_url, json=jsonrpc_data)
-    response.raise_for_status()
-    response_json = response.json()
-    response_raw = response.content
-    assert 'error' not in response_json
-    assert response_json['id'] == block_num
-    return response_raw, response_json
-
-
 def key(block_num, name, base_path):
     block_num_sha = hashlib.sha1(bytes(block_num)).hexdigest()
     return pathlib.PosixPath(os.path.join(
@@ -45,12 +31,49 @@ def put(pathobj, data):
     pathobj.write_bytes(dumps(data).encode())
 
 
+def missing_block_nums(block_nums, names, base_path, skip_existing=True):
+    """block_nums without a stored file for each of names"""
+    for block_num in block_nums:
+        if skip_existing and all(key(block_num, name, base_path).exists()
+                                 for name in names):
+            logger.info('put', block_num=block_num, names=names, exists=True)
+            continue
+        yield block_num
+
+
+def put_result(command, block_num, name, base_path, result):
+    result_key = key(block_num, name, base_path)
+    if result is None:
+        logger.error(command, error='no result', block_num=block_num,
+                     key=result_key)
+        return
+    put(result_key, result)
+    logger.info(command, block_num=block_num, key=result_key)
+
+
+def rpc_client(ctx, dpayd_url, batch_size):
+    cache = None
+    if ctx.obj['rpc_cache']:
+        cache = ResponseCache(ctx.obj['rpc_cache'],
+                              max_bytes=ctx.obj['rpc_cache_max_bytes'])
+    return SimpleDPayAPIClient(dpayd_url, batch_size=batch_size, cache=cache)
+
+
 @click.group(name='fs')
 @click.option('--path', type=click.Path(file_okay=False), default='blocks_data')
+@click.option('--rpc_cache', type=click.Path(dir_okay=False), default=None,
+              envvar='DPDS_RPC_CACHE',
+              help='Cache irreversible get_block and get_ops_in_block '
+                   'responses in this file')
+@click.option('--rpc_cache_max_bytes', type=click.IntRange(min=1),
+              default=DEFAULT_RPC_CACHE_MAX_BYTES,
+              help='Evict the oldest cached responses once the cache takes '
+                   'more than this many bytes')
 @click.pass_context
-def fs(ctx, path):
+def fs(ctx, path, rpc_cache, rpc_cache_max_bytes):
     """Interact with a filesystem storage backend"""
-    ctx.obj = dict(path=path)
+    ctx.obj = dict(path=path, rpc_cache=rpc_cache,
+                   rpc_cache_max_bytes=rpc_cache_max_bytes)
 
 
 @fs.command('init')
@@ -70,37 +93,24 @@ def init(ctx):
 @click.option('--start', type=click.INT, default=1)
 @click.option('--end', type=click.INT, default=20000000)
 @click.option('--skip_existing', type=click.BOOL, default=True)
+@click.option('--batch_size', type=click.IntRange(min=1),
+              default=DEFAULT_BATCH_SIZE,
+              help='Blocks per JSON-RPC batch request')
 @click.pass_context
-def put_blocks_and_ops(ctx, dpayd_url, start, end, skip_existing):
-    session = requests.Session()
+def put_blocks_and_ops(ctx, dpayd_url, start, end, skip_existing, batch_size):
+    rpc = rpc_client(ctx, dpayd_url, batch_size)
     base_path = ctx.obj['path']
-    for block_num in range(start, end + 1):
-        ops_key = None
-        block_key = None
-        try:
-            block_key = key(block_num, 'block.json', base_path)
-            if skip_existing and block_key.exists():
-                logger.info('put blocks', block_num=block_num, key=block_key, exists=True)
-                continue
-
-            raw, block = fetch(session, dpayd_url, block_num, 'get_block')
-            block = block['result']
-            put(block_key, block)
-            logger.info('put_blocks_and_ops', block_num=block_num, key=block_key)
-
-            ops_key = key(block_num, 'ops_in_block.json', base_path)
-            if skip_existing and ops_key.exists():
-                logger.info('put ops', block_num=block_num, key=ops_key,
-                            exists=True)
-                continue
-            raw, ops = fetch(session, dpayd_url, block_num, 'get_ops_in_block')
-
-            ops = ops['result']
-            put(ops_key, ops)
-            logger.info('put_blocks_and_ops', block_num=block_num, key=ops_key)
-        except Exception as e:
-            logger.error('put_blocks_and_ops', error=e, block_num=block_num,
-                         block_key=block_key, ops_key=ops_key)
+    block_nums = missing_block_nums(range(start, end + 1),
+                                    ['block.json', 'ops_in_block.json'],
+                                    base_path, skip_existing)
+    for chunk in chunkify(block_nums, chunksize=batch_size):
+        blocks = rpc.exec_multi('get_block', chunk)
+        ops = rpc.exec_multi('get_ops_in_block', chunk, False)
+        for block_num, (block, _), (block_ops, _) in zip(chunk, blocks, ops):
+            put_result(
+                'put_blocks_and_ops', block_num, 'block.json', base_path, block)
+            put_result('put_blocks_and_ops', block_num, 'ops_in_block.json',
+                       base_path, block_ops)
 
 
 @fs.command(name='put-blocks')
@@ -108,24 +118,17 @@ def put_blocks_and_ops(ctx, dpayd_url, start, end, skip_existing):
 @click.option('--start', type=click.INT, default=1)
 @click.option('--end', type=click.INT, default=20000000)
 @click.option('--skip_existing', type=click.BOOL, default=True)
+@click.option('--batch_size', type=click.IntRange(min=1),
+              default=DEFAULT_BATCH_SIZE,
+              help='Blocks per JSON-RPC batch request')
 @click.pass_context
-def put_blocks(ctx, dpayd_url, start, end, skip_existing):
-    session = requests.Session()
+def put_blocks(ctx, dpayd_url, start, end, skip_existing, batch_size):
+    rpc = rpc_client(ctx, dpayd_url, batch_size)
     base_path = ctx.obj['path']
-    for block_num in range(start, end + 1):
-        block_key = None
-        try:
-            block_key = key(block_num, 'block.json', base_path)
-            if skip_existing and block_key.exists():
-                logger.info('put blocks', block_num=block_num, key=block_key, exists=True)
-                continue
-            raw, block = fetch(session, dpayd_url, block_num, 'get_block')
-            block = block['result']
-            put(block_key, block)
-            logger.info('put_blocks', block_num=block_num, key=block_key)
-
-        except Exception as e:
-            logger.error('put_blocks', error=e, block_num=block_num, key=block_key)
+    block_nums = missing_block_nums(range(start, end + 1), ['block.json'],
+                                    base_path, skip_existing)
+    for block, (block_num,) in rpc.exec_multi('get_block', block_nums):
+        put_result('put_blocks', block_num, 'block.json', base_path, block)
 
 
 @fs.command(name='put-ops')
@@ -133,21 +136,15 @@ def put_blocks(ctx, dpayd_url, start, end, skip_existing):
 @click.option('--start', type=click.INT, default=1)
 @click.option('--end', type=click.INT, default=20000000)
 @click.option('--skip_existing', type=click.BOOL, default=True)
+@click.option('--batch_size', type=click.IntRange(min=1),
+              default=DEFAULT_BATCH_SIZE,
+              help='Blocks per JSON-RPC batch request')
 @click.pass_context
-def put_ops(ctx, dpayd_url, start, end, skip_existing):
-    session = requests.Session()
+def put_ops(ctx, dpayd_url, start, end, skip_existing, batch_size):
+    rpc = rpc_client(ctx, dpayd_url, batch_size)
     base_path = ctx.obj['path']
-    for block_num in range(start, end + 1):
-        ops_key = None
-        try:
-            ops_key = key(block_num, 'ops.json', base_path)
-            if skip_existing and ops_key.exists():
-                logger.info('put_ops', block_num=block_num, key=ops_key,
-                            exists=True)
-                continue
-            raw, ops = fetch(session, dpayd_url, block_num, 'get_ops_in_block')
-            ops = ops['result']
-            put(ops_key, ops)
-            logger.info('put ops', block_num=block_num, key=ops_key)
-        except Exception as e:
-            logger.error('put_ops', error=e, block_num=block_num, key=ops_key)
+    block_nums = missing_block_nums(range(start, end + 1), ['ops.json'],
+                                    base_path, skip_existing)
+    for ops, (block_num, _) in rpc.exec_multi(
+            'get_ops_in_block', block_nums, False):
+        put_result('put_ops', block_num, 'ops.json', base_path, ops)
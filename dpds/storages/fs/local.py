@@ -1 +1,129 @@
 # coding=utf-8
+"""Read blocks and ops from the sha1-sharded store written by ``dpds fs``
+
+Each block lives in ``<path>/<sha[:2]>/<sha[2:4]>/<sha[4:6]>/<block_num>/``
+where sha is the sha1 hexdigest of ``bytes(block_num)``, i.e. of block_num
+zero bytes, matching `dpds.storages.fs.cli.key`.
+"""
+import asyncio
+import hashlib
+import os
+import pathlib
+
+import aiofiles
+import structlog
+
+logger = structlog.get_logger(__name__)
+
+BLOCK_FILENAME = 'block.json'
+# put-blocks-and-ops writes ops_in_block.json, put-ops writes ops.json
+OPS_FILENAMES = ('ops_in_block.json', 'ops.json')
+DEFAULT_MAX_OPEN_FILES = 64
+
+
+def block_num_sha(block_num):
+    return hashlib.sha1(bytes(block_num)).hexdigest()
+
+
+def block_dir(base_path, block_num, sha):
+    return pathlib.PosixPath(os.path.join(
+        base_path, sha[:2], sha[2:4], sha[4:6], str(block_num)))
+
+
+class BlockNumShas(object):
+    """`block_num_sha` for mostly ascending block_nums
+
+    Hashing block_num zero bytes costs O(block_num), so the digest is
+    extended from the previous block_num instead of recomputed.
+    """
+
+    def __init__(self):
+        self._block_num = 0
+        self._hasher = hashlib.sha1()
+
+    def __call__(self, block_num):
+        if block_num < self._block_num:
+            self._block_num = 0
+            self._hasher = hashlib.sha1()
+        self._hasher.update(bytes(block_num - self._block_num))
+        self._block_num = block_num
+        return self._hasher.copy().hexdigest()
+
+
+class FsBlockStore(object):
+    """Concurrent reader for a ``dpds fs`` block store"""
+
+    def __init__(self, path, max_open_files=DEFAULT_MAX_OPEN_FILES):
+        self.path = path
+        self.max_open_files = max_open_files
+        self._shas = BlockNumShas()
+        self._semaphore = None
+
+    @property
+    def semaphore(self):
+        # created lazily so the store can be built outside the loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_open_files)
+        return self._semaphore
+
+    def block_dir(self, block_num):
+        return block_dir(self.path, block_num, self._shas(block_num))
+
+    def has_block(self, block_num):
+        sha = block_num_sha(block_num)
+        return (block_dir(self.path, block_num, sha) / BLOCK_FILENAME).exists()
+
+    def highest_block_num(self):
+        """Highest stored block_num, assuming blocks are stored from 1 without
+        gaps"""
+        if not self.has_block(1):
+            return 0
+        low = 1
+        while self.has_block(low * 2):
+            low *= 2
+        high = low * 2
+        # has_block(low) and not has_block(high)
+        while high - low > 1:
+            middle = (low + high) // 2
+            if self.has_block(middle):
+                low = middle
+            else:
+                high = middle
+        return low
+
+    async def read(self, path):
+        async with self.semaphore:
+            async with aiofiles.open(path, 'rb') as f:
+                return await f.read()
+
+    async def read_ops(self, path):
+        for filename in OPS_FILENAMES[:-1]:
+            try:
+                return await self.read(path / filename)
+            except FileNotFoundError:
+                continue
+        return await self.read(path / OPS_FILENAMES[-1])
+
+    async def read_block_and_ops(self, block_num, path):
+        try:
+            raw_block = await self.read(path / BLOCK_FILENAME)
+            raw_ops = await self.read_ops(path)
+        except OSError as e:
+            logger.warning('error reading block and/or ops from fs store',
+                           e=e, block_num=block_num, path=str(path))
+            return None
+        return block_num, raw_block, raw_ops
+
+    async def read_blocks_and_ops(self, block_nums):
+        """(block_num, raw_block, raw_ops) for each stored block, as undecoded
+        bytes
+
+        Blocks which can't be read are left out of the results.
+        """
+        # paths are built up front, in order, so the digests extend cheaply
+        paths = [(block_num, self.block_dir(block_num))
+                 for block_num in block_nums]
+        results = await asyncio.gather(*(
+            self.read_block_and_ops(block_num, path)
+            for block_num, path in paths))
+        return [result for result in results if result is not None]
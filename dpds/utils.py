@@ -1,5 +1,7 @@
 # -*- coding: utf-8 -*-
+import itertools as it
 import json
+import random
 from urllib.parse import urlparse
 
 import w3lib.url
@@ -8,6 +10,9 @@ import structlog
 
 logger = structlog.get_logger(__name__)
 
+BACKOFF_BASE_DELAY = 0.25
+BACKOFF_MAX_DELAY = 30.0
+
 
 def block_num_from_hash(block_hash: str) -> int:
     """
@@ -56,6 +61,114 @@ def chunkify(iterable, chunksize=10000):
         yield chunk
 
 
+def merge_ranges(ranges):
+    """Merge overlapping or adjacent inclusive (start, end) ranges.
+
+    Args:
+      ranges: iterable of inclusive (start, end) int tuples
+
+    Returns:
+      List[Tuple[int, int]]: sorted, non-overlapping, non-adjacent ranges
+
+    """
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return [tuple(r) for r in merged]
+
+
+def block_num_ranges(block_nums):
+    """Collapse block_nums into inclusive (start, end) ranges.
+
+    Args:
+      block_nums: iterable of ints
+
+    Returns:
+      List[Tuple[int, int]]:
+
+    """
+    return merge_ranges((block_num, block_num) for block_num in block_nums)
+
+
+def missing_ranges(ranges, start, end):
+    """Return the inclusive ranges between start and end not covered by ranges.
+
+    Args:
+      ranges: iterable of inclusive (start, end) int tuples
+      start: first block_num of the range to check
+      end: last block_num of the range to check
+
+    Returns:
+      List[Tuple[int, int]]:
+
+    """
+    missing = []
+    next_start = start
+    for range_start, range_end in merge_ranges(ranges):
+        if range_end < next_start:
+            continue
+        if range_start > end:
+            break
+        if range_start > next_start:
+            missing.append((next_start, range_start - 1))
+        next_start = range_end + 1
+    if next_start <= end:
+        missing.append((next_start, end))
+    return missing
+
+
+def range_block_nums(ranges):
+    """Lazily yield every block_num in inclusive (start, end) ranges.
+
+    Args:
+      ranges: iterable of inclusive (start, end) int tuples
+
+    Returns:
+      Iterator[int]:
+
+    """
+    return it.chain.from_iterable(range(start, end + 1)
+                                  for start, end in ranges)
+
+
+
+def fetched_prefix(results, block_nums):
+    """Return the results for block_nums before the first one not fetched.
+
+    Args:
+      results: (block_num, ...) tuples, in any order
+      block_nums: block_nums requested, in order
+
+    Returns:
+      List[tuple]: results in block_nums order
+
+    """
+    by_block_num = {result[0]: result for result in results}
+    prefix = []
+    for block_num in block_nums:
+        if block_num not in by_block_num:
+            break
+        prefix.append(by_block_num[block_num])
+    return prefix
+
+def backoff_delay(attempt, base_delay=BACKOFF_BASE_DELAY,
+                  max_delay=BACKOFF_MAX_DELAY):
+    """Capped exponential backoff with full jitter.
+
+    Args:
+      attempt (int): number of failed attempts so far, starting at 1
+      base_delay (float):  (Default value = BACKOFF_BASE_DELAY)
+      max_delay (float):  (Default value = BACKOFF_MAX_DELAY)
+
+    Returns:
+      float: seconds to wait before the next attempt
+    """
+    return random.uniform(0, min(max_delay, base_delay * 2 ** (attempt - 1)))
+
+
 def ensure_decoded(thing):
     if not thing:
         logger.debug('ensure_decoded thing is logically False')
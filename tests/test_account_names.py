@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import bisect
+
+import pytest
+
+from dpds.storages.db.scripts.account_names import collect_account_names
+from dpds.storages.db.scripts.account_names import name_space_partitions
+
+ACCOUNT_NAMES = sorted(['a-b', 'a.b', 'a0b', 'aaa', 'abc', 'bex', 'dpay',
+                        'jared', 'z9z', 'zzz', 'zzzz'])
+
+
+class FakeLookupAccountsClient(object):
+    async def exec(self, name, lower_bound, limit):
+        assert name == 'lookup_accounts'
+        i = bisect.bisect_left(ACCOUNT_NAMES, lower_bound)
+        return ACCOUNT_NAMES[i:i + limit]
+
+
+@pytest.mark.parametrize('prefix_length', [1, 2])
+def test_name_space_partitions_cover_each_name_once(prefix_length):
+    partitions = name_space_partitions(prefix_length)
+    assert partitions[0][0] == '' and partitions[-1][1] is None
+    for name in ACCOUNT_NAMES:
+        assert sum(1 for lower, upper in partitions
+                   if lower <= name and (upper is None or name < upper)) == 1
+
+
+@pytest.mark.parametrize('prefix_length', [1, 2])
+def test_collect_account_names(prefix_length):
+    loop = asyncio.new_event_loop()
+    try:
+        account_names = loop.run_until_complete(
+            collect_account_names(FakeLookupAccountsClient(),
+                                  prefix_length=prefix_length, limit=2))
+    finally:
+        loop.close()
+    assert account_names == ACCOUNT_NAMES
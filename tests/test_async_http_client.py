@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import json
+
+import pytest
+
+from dpds.http_client import AsyncDPayAPIClient
+from dpds.http_client import RPCError
+
+
+class CannedClient(AsyncDPayAPIClient):
+    """Answers every post with a canned response body"""
+
+    def __init__(self, response):
+        super().__init__('http://dpayd')
+        self.response = response
+        self.requests = []
+
+    async def _post(self, body):
+        self.requests.append(json.loads(body))
+        return json.dumps(self.response).encode()
+
+
+def run(coro):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+
+def test_batch_matches_responses_by_id():
+    client = CannedClient([
+        {'id': 1, 'jsonrpc': '2.0', 'result': []},
+        {'id': 0, 'jsonrpc': '2.0', 'result': {'block_id': 'a'}},
+    ])
+    results = run(
+        client.batch([('get_block', 1), ('get_ops_in_block', 1, False)]))
+    assert results == [{'block_id': 'a'}, []]
+    assert client.requests[0] == [
+        {'method': 'get_block', 'params': [1], 'jsonrpc': '2.0', 'id': 0},
+        {'method': 'get_ops_in_block', 'params': [1, False], 'jsonrpc': '2.0',
+         'id': 1},
+    ]
+
+
+def test_batch_errors():
+    client = CannedClient([
+        {'id': 0, 'jsonrpc': '2.0',
+         'error': {'code': -32000, 'message': 'unknown block'}},
+    ])
+    with pytest.raises(RPCError):
+        run(client.batch([('get_block', 1), ('get_block', 2)]))
+    results = run(
+        client.batch([('get_block', 1), ('get_block', 2)],
+                     return_exceptions=True))
+    assert [str(result) for result in results] == [
+        'unknown block', 'no response to batch call 1']
+
+    client = CannedClient({'id': None, 'jsonrpc': '2.0',
+                           'error': {'code': -32600,
+                                     'message': 'invalid request'}})
+    with pytest.raises(RPCError, match='invalid request'):
+        run(client.batch([('get_block', 1)]))
+
+
+def test_exec():
+    client = CannedClient(
+        {'id': 0, 'jsonrpc': '2.0',
+         'result': {'last_irreversible_block_num': 7}})
+    assert run(client.last_irreversible_block_num()) == 7
+    assert client.requests[0]['method'] == 'get_dynamic_global_properties'
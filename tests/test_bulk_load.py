@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+from dpds.storages.db.scripts.bulk_load import BULK_LOAD_TABLES
+from dpds.storages.db.scripts.bulk_load import deferred_foreign_keys
+from dpds.storages.db.scripts.bulk_load import deferred_indexes
+from dpds.storages.db.scripts.bulk_load import foreign_key_sql
+
+
+def test_deferred_indexes_skip_primary_keys():
+    index_names = {index_name for _, index_name, _ in deferred_indexes()}
+    assert 'ix_dpds_op_transfers_block_num' in index_names
+    assert all(sql.startswith('CREATE INDEX IF NOT EXISTS ')
+               for _, _, sql in deferred_indexes())
+    assert all(table.primary_key.columns for table in BULK_LOAD_TABLES)
+
+
+def test_foreign_key_sql_is_added_not_valid():
+    table, foreign_key = next((table, foreign_key)
+                              for table, foreign_key in deferred_foreign_keys()
+                              if table.name == 'dpds_op_transfers'
+                              and foreign_key.column_keys == ['from'])
+    assert foreign_key_sql(table, foreign_key) == (
+        'ALTER TABLE dpds_op_transfers '
+        'ADD CONSTRAINT dpds_op_transfers_from_fkey '
+        'FOREIGN KEY ("from") REFERENCES dpds_meta_accounts (name) '
+        'DEFERRABLE INITIALLY DEFERRED NOT VALID')
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+import asyncio
+
+import pytest
+
+import dpds.chain.cli
+from dpds.chain.cli import _batch_with_retries
+from dpds.chain.cli import _get_blocks_fast
+from dpds.chain.cli import _stream_blocks
+from dpds.http_client import RPCConnectionError
+from dpds.http_client import RPCError
+
+
+class FlakyClient(object):
+    """Fails each batch with failures.pop(0), if any, then answers get_block
+    calls"""
+    url = 'http://dpayd'
+
+    def __init__(self, failures):
+        self.failures = list(failures)
+        self.batches = []
+
+    async def batch(self, calls, return_exceptions=False):
+        self.batches.append([call[1] for call in calls])
+        failure = self.failures.pop(0) if self.failures else None
+        if isinstance(failure, Exception):
+            raise failure
+        return [RPCError('unknown block') if call[1] == failure
+                else {'block_num': call[1]} for call in calls]
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(dpds.chain.cli, 'backoff_delay', lambda attempt: 0)
+
+
+def run(coro):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+
+def test_batch_with_retries_retries_failed_calls():
+    rpc = FlakyClient([RPCConnectionError('timeout'), 2])
+    results = run(
+        _batch_with_retries(rpc, [('get_block', 1), ('get_block', 2)]))
+    assert results == [{'block_num': 1}, {'block_num': 2}]
+    assert rpc.batches == [[1, 2], [1, 2], [2]]
+
+
+def test_batch_with_retries_gives_up():
+    rpc = FlakyClient([RPCConnectionError('timeout')] * 3)
+    results = run(_batch_with_retries(rpc, [('get_block', 1)], retries=2))
+    assert isinstance(results[0], RPCConnectionError)
+    assert len(rpc.batches) == 3
+
+
+def test_get_blocks_fast_retries():
+    rpc = FlakyClient([RPCConnectionError('timeout'), None, 3])
+
+    async def collect():
+        return [block async for block in _get_blocks_fast(
+            start=1, end=5, chunksize=2, max_workers=1, rpc=rpc)]
+
+    assert run(collect()) == [{'block_num': n} for n in range(1, 5)]
+    assert rpc.batches == [[1, 2], [1, 2], [3, 4], [3]]
+
+
+def test_stream_blocks_raises_once_retries_run_out():
+    rpc = FlakyClient([RPCConnectionError('timeout')] * 2)
+
+    async def collect():
+        return [block async for block in _stream_blocks(rpc, [1], retries=1)]
+
+    with pytest.raises(RPCConnectionError):
+        run(collect())
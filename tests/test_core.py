@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+
+import pytest
+
+from dpds.storages.db.tables.core import extract_operations_from_block
+from dpds.storages.db.tables.core import extract_raw_operations_from_block
+
+GET_BLOCK_DATA_DIR = os.path.join(os.path.dirname(__file__), 'data',
+                                  'get_block')
+
+
+@pytest.fixture
+def raw_block():
+    with open(os.path.join(GET_BLOCK_DATA_DIR, 'block.json')) as f:
+        return json.load(f)
+
+
+def test_extract_raw_operations_from_block(raw_block):
+    raw_block['transaction_ids'] = [
+        f'{i:040x}' for i in range(len(raw_block['transactions']))]
+    raw_ops = list(extract_raw_operations_from_block(raw_block, 4000000))
+    ops = list(extract_operations_from_block(raw_block))
+    assert len(raw_ops) == len(ops)
+    for raw_op, op in zip(raw_ops, ops):
+        # numbered from 0 like get_ops_in_block
+        assert raw_op['trx_in_block'] == op['transaction_num'] - 1
+        assert raw_op['op_in_trx'] == op['operation_num'] - 1
+        assert raw_op['trx_id'] == (
+            raw_block['transaction_ids'][raw_op['trx_in_block']])
+        assert raw_op['block'] == 4000000
+        assert raw_op['timestamp'] == raw_block['timestamp']
+        assert raw_op['virtual_op'] == 0
+        assert raw_op['op'][0] == op['type']
+
+
+def test_extract_raw_operations_needs_transaction_ids(raw_block):
+    with pytest.raises(ValueError):
+        list(extract_raw_operations_from_block(raw_block))
+    raw_block['transactions'] = []
+    assert list(extract_raw_operations_from_block(raw_block)) == []
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from dpds.endpoints import CLOSED
+from dpds.endpoints import OPEN
+from dpds.endpoints import EndpointPool
+from dpds.endpoints import parse_urls
+from dpds.http_client import SimpleDPayAPIClient
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_parse_urls():
+    assert parse_urls('http://a, http://b,') == ['http://a', 'http://b']
+    assert parse_urls(['http://a']) == ['http://a']
+    with pytest.raises(ValueError):
+        parse_urls(' , ')
+
+
+def test_routes_to_lowest_latency():
+    pool = EndpointPool('http://fast,http://slow', alpha=1)
+    fast, slow = pool.endpoints
+    pool.record_success(pool.choose(exclude=['http://slow']), 0.1)
+    pool.record_success(pool.choose(exclude=['http://fast']), 1.0)
+    assert pool.choose() is fast
+    # requests in flight make the fast endpoint cost more than the slow one
+    chosen = [pool.choose() for _ in range(10)]
+    assert chosen.count(fast) == 9 and chosen[-1] is slow
+
+
+def test_breaker_ejects_probes_and_readmits():
+    clock = Clock()
+    pool = EndpointPool('http://a,http://b', failure_threshold=2,
+                        open_seconds=10, clock=clock)
+    a, b = pool.endpoints
+    for _ in range(2):
+        pool.record_failure(pool.choose(exclude=['http://b']))
+    assert a.state == OPEN
+    assert all(pool.choose() is b for _ in range(3))
+
+    # a failed probe reopens the breaker
+    clock.now = 10
+    probe = pool.choose(exclude=['http://b'])
+    assert probe is a
+    # only one probe at a time
+    assert pool.choose() is b
+    pool.record_failure(probe)
+    assert a.state == OPEN and a.opened_at == 10
+
+    clock.now = 20
+    pool.record_success(pool.choose(exclude=['http://b']), 0.05)
+    assert a.state == CLOSED
+
+
+class FakeResponse(object):
+    def __init__(self, status):
+        self.status = status
+
+
+class FakeHttp(object):
+    def __init__(self, statuses):
+        self.statuses = statuses
+        self.urls = []
+
+    def urlopen(self, method, url, body=None):
+        self.urls.append(url)
+        status = self.statuses[url]
+        if status is None:
+            raise ConnectionError(url)
+        return FakeResponse(status)
+
+
+def test_request_fails_over():
+    client = SimpleDPayAPIClient('http://down,http://up')
+    client.http = FakeHttp({'http://down': None, 'http://up': 200})
+    assert all(client._request(body=b'{}').status == 200 for _ in range(10))
+    # its error rate routes requests away from the failing endpoint
+    assert client.http.urls.count('http://down') == 1
+
+    client.http.statuses['http://down'] = 503
+    client.http.statuses['http://up'] = 503
+    assert client._request(body=b'{}').status == 503
+    assert client.http.urls[-2:] == ['http://up', 'http://down']
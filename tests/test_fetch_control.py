@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+from dpds.storages.db.scripts.fetch_control import FetchController
+
+
+def test_fast_batches_increase_batch_size_and_concurrency():
+    controller = FetchController(batch_size=100, concurrency=2,
+                                 batch_increase=10)
+    controller.record_success(latency=0.1, payload_bytes=1000, block_count=100)
+    assert controller.batch_size == 110
+    assert controller.concurrency == 2
+    controller.record_success(latency=0.1, payload_bytes=1000, block_count=100)
+    assert controller.concurrency == 3
+
+
+def test_failure_halves_batch_size_and_concurrency():
+    controller = FetchController(batch_size=100, concurrency=8)
+    controller.record_failure()
+    assert controller.batch_size == 50
+    assert controller.concurrency == 4
+    assert controller.error_rate > 0
+
+
+def test_slow_batch_halves_batch_size():
+    controller = FetchController(batch_size=100, concurrency=8,
+                                 target_latency=1.0)
+    controller.record_success(latency=5.0, payload_bytes=1000, block_count=100)
+    assert controller.batch_size == 50
+    assert controller.concurrency == 8
+
+
+def test_oversized_payload_shrinks_batch_to_fit():
+    controller = FetchController(batch_size=100, max_payload_bytes=1000)
+    controller.record_success(latency=0.1, payload_bytes=10000, block_count=100)
+    assert controller.batch_size == 10
+
+
+def test_limits_are_respected():
+    controller = FetchController(batch_size=2, concurrency=1, min_batch_size=1,
+                                 max_batch_size=5, max_concurrency=2)
+    for _ in range(10):
+        controller.record_failure()
+    assert controller.batch_size == 1
+    assert controller.concurrency == 1
+    # growth resumes once the error rate decays
+    for _ in range(50):
+        controller.record_success(latency=0.1, payload_bytes=10, block_count=1)
+    assert controller.batch_size == 5
+    assert controller.concurrency == 2
+
+
+def test_growth_waits_for_error_rate_to_subside():
+    controller = FetchController(batch_size=100, concurrency=4,
+                                 batch_increase=10, max_error_rate=0.05)
+    controller.record_failure()
+    assert (controller.batch_size, controller.concurrency) == (50, 2)
+    controller.record_success(latency=0.1, payload_bytes=1000, block_count=50)
+    assert (controller.batch_size, controller.concurrency) == (50, 2)
+    # the success bringing the error rate under the limit grows the batch
+    while controller.batch_size == 50:
+        controller.record_success(latency=0.1, payload_bytes=1000,
+                                  block_count=50)
+    assert controller.batch_size == 60
+    assert controller.error_rate <= 0.05
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import json
+import os
+import random
+
+from dpds.chain.fixtures import DirCorpus
+from dpds.chain.fixtures import FixtureServer
+from dpds.chain.fixtures import FsCorpus
+from dpds.chain.fixtures import record_blocks
+from dpds.chain.fixtures import write_result
+from dpds.http_client import AsyncDPayAPIClient
+from dpds.storages.fs.local import FsBlockStore
+
+GET_BLOCK_DATA_DIR = os.path.join(os.path.dirname(__file__), 'data',
+                                  'get_block')
+
+
+class FakeRequest(object):
+    def __init__(self, data):
+        self.data = data
+
+    async def read(self):
+        return self.data
+
+
+class FakeClient(AsyncDPayAPIClient):
+    """Posts straight to a FixtureServer's handler"""
+
+    def __init__(self, server):
+        super().__init__('http://fixtures')
+        self.server = server
+
+    async def _post(self, body):
+        response = await self.server.handle(FakeRequest(body))
+        return response.body
+
+
+def run(coro):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+
+def make_corpus(path, block_nums):
+    with open(os.path.join(GET_BLOCK_DATA_DIR, 'block.json')) as f:
+        block = json.load(f)
+    corpus = DirCorpus(path)
+    for block_num in block_nums:
+        write_result(corpus, 'get_block', block_num,
+                     dict(block, block_num=block_num))
+        write_result(corpus, 'get_ops_in_block', block_num, [])
+    return corpus
+
+
+def post(server, request):
+    response = run(server.handle(FakeRequest(json.dumps(request).encode())))
+    return json.loads(response.body)
+
+
+def test_serve_batch_in_request_order(tmpdir):
+    server = FixtureServer(make_corpus(str(tmpdir), range(1, 4)))
+    response = post(server, [
+        {'id': 2, 'jsonrpc': '2.0', 'method': 'get_block', 'params': [2]},
+        {'id': 2, 'jsonrpc': '2.0', 'method': 'get_ops_in_block',
+         'params': [2, False]},
+        {'id': 9, 'jsonrpc': '2.0', 'method': 'get_block', 'params': [9]},
+        {'id': 1, 'jsonrpc': '2.0', 'method': 'get_dynamic_global_properties'},
+    ])
+    assert response[0]['result']['block_num'] == 2
+    assert response[1]['result'] == []
+    assert 'error' in response[2]
+    assert response[3]['result']['last_irreversible_block_num'] == 3
+
+
+def test_serve_tests_data_get_block():
+    server = FixtureServer(DirCorpus(os.path.dirname(GET_BLOCK_DATA_DIR)))
+    assert server.last_irreversible_block_num == 4000001
+    response = post(server, [
+        {'id': 1, 'jsonrpc': '2.0', 'method': 'get_block', 'params': [4000001]},
+        {'id': 1, 'jsonrpc': '2.0', 'method': 'get_ops_in_block',
+         'params': [4000001, False]},
+        {'id': 2, 'jsonrpc': '2.0', 'method': 'get_block', 'params': [4000002]},
+    ])
+    assert response[0]['result']['previous'].startswith('003d0900')
+    assert response[1]['result'] == []
+    assert 'error' in response[2]
+
+
+def test_injected_rpc_errors(tmpdir):
+    server = FixtureServer(make_corpus(str(tmpdir), [1]), rpc_error_rate=1)
+    response = post(server, {'id': 1, 'jsonrpc': '2.0', 'method': 'get_block',
+                             'params': [1]})
+    assert response['error']['message'] == 'injected error'
+
+
+def test_record_replayed_corpus_into_fs_store(tmpdir):
+    server = FixtureServer(make_corpus(str(tmpdir.join('dir')), range(1, 6)),
+                           rng=random.Random(0))
+    fs_path = str(tmpdir.join('fs'))
+    recorded = run(record_blocks(FakeClient(server), FsCorpus(fs_path),
+                                 range(1, 6), batch_size=2))
+    assert recorded == 5
+    store = FsBlockStore(fs_path)
+    assert store.highest_block_num() == 5
+    results = run(store.read_blocks_and_ops([4]))
+    assert json.loads(results[0][1])['block_num'] == 4
+
+    # already recorded blocks are skipped
+    assert run(record_blocks(FakeClient(server), FsCorpus(fs_path),
+                             range(1, 6), batch_size=2)) == 0
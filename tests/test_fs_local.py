@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+import asyncio
+
+from dpds.storages.fs.cli import key
+from dpds.storages.fs.cli import put
+from dpds.storages.fs.local import BlockNumShas
+from dpds.storages.fs.local import FsBlockStore
+from dpds.storages.fs.local import block_num_sha
+
+
+def test_block_num_shas_match_full_digest():
+    shas = BlockNumShas()
+    for block_num in [1, 2, 5, 100, 3, 4]:
+        assert shas(block_num) == block_num_sha(block_num)
+
+
+def test_read_blocks_and_ops_from_fs_store(tmpdir):
+    base_path = str(tmpdir)
+    for block_num in range(1, 6):
+        put(key(block_num, 'block.json', base_path), {'block_num': block_num})
+        put(key(block_num, 'ops_in_block.json', base_path), [])
+    # written by put-ops rather than put-blocks-and-ops
+    key(3, 'ops_in_block.json', base_path).unlink()
+    put(key(3, 'ops.json', base_path), [{'block': 3}])
+    store = FsBlockStore(base_path)
+    assert store.block_dir(4) == key(4, 'block.json', base_path).parent
+    assert store.highest_block_num() == 5
+
+    loop = asyncio.new_event_loop()
+    try:
+        results = loop.run_until_complete(store.read_blocks_and_ops([2, 3, 6]))
+    finally:
+        loop.close()
+    assert results == [(2, b'{"block_num":2}', b'[]'),
+                       (3, b'{"block_num":3}', b'[{"block":3}]')]
@@ -1,6 +1,69 @@
 # -*- coding: utf-8 -*-
+import json
+import time
+
+from dpds.http_client import RPCError
+from dpds.http_client import SimpleDPayAPIClient
+
+
+class FakeResponse(object):
+    status = 200
+
+    def __init__(self, responses):
+        self.data = json.dumps(responses).encode()
 
 
 def test_client_get_block(http_client, first_block_dict):
     block = http_client.get_block(1)
     assert block == first_block_dict
+
+
+def test_exec_multi_retries_only_failed_calls():
+    requests = []
+
+    def request(body):
+        calls = json.loads(body)
+        requests.append([call['id'] for call in calls])
+        # the first batch loses call 1 and fails call 2
+        return FakeResponse([
+            {'id': call['id'], 'jsonrpc': '2.0',
+             'result': call['params'][0] * 10}
+            if len(requests) > 1 or call['id'] == 0 else
+            {'id': call['id'], 'jsonrpc': '2.0',
+             'error': {'code': 1, 'message': 'busy'}}
+            for call in reversed(calls)
+            if len(requests) > 1 or call['id'] != 1])
+
+    client = SimpleDPayAPIClient('http://dpayd', batch_size=3)
+    client._request = request
+    results = list(client.exec_multi('get_block', range(1, 6), retries=1))
+    assert results == [(10, [1]), (20, [2]), (30, [3]), (40, [4]), (50, [5])]
+    assert requests == [[0, 1, 2], [1, 2], [0, 1]]
+
+
+def test_exec_multi_with_futures_yields_in_order_within_window():
+    consumed = []
+    attempts = {}
+
+    def params():
+        for param in range(50):
+            consumed.append(param)
+            yield param
+
+    def exec_(name, param, re_raise=None):
+        attempts[param] = attempts.get(param, 0) + 1
+        # later params finish first, every fifth fails once
+        time.sleep((50 - param) / 10000)
+        if param % 5 == 0 and attempts[param] == 1:
+            raise RPCError('busy')
+        return param * 10
+
+    client = SimpleDPayAPIClient('http://dpayd')
+    client.exec = exec_
+    results = []
+    for result in client.exec_multi_with_futures('get_block', params(),
+                                                 max_workers=4, window=6):
+        results.append(result)
+        assert len(consumed) - len(results) <= 6
+    assert results == [param * 10 for param in range(50)]
+    assert attempts[10] == 2
@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+from dpds.storages.db.tables.insert_plans import BLOCK_INSERT_PLAN
+from dpds.storages.db.tables.insert_plans import op_insert_plan
+
+
+def test_record_fills_in_column_defaults():
+    plan = op_insert_plan('vote')
+    record = dict(
+        zip(plan.columns, plan.record({'block_num': 1, 'voter': 'alice'})))
+    assert record['block_num'] == 1
+    assert record['voter'] == 'alice'
+    # absent columns get their default rather than NULL
+    assert record['operation_type'] == 'vote'
+    assert record['weight'] is None
+
+    # a value that is present is kept, even when it is None
+    record = dict(zip(plan.columns, plan.record({'operation_type': None})))
+    assert record['operation_type'] is None
+
+
+def test_block_plan_keeps_block_column_order():
+    assert BLOCK_INSERT_PLAN.record(
+        {'block_num': 1, 'raw': '{}'})[:2] == ('{}', 1)
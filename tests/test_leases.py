@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+import asyncio
+
+import pytest
+
+from dpds.storages.db.scripts.leases import LeaseLost
+from dpds.storages.db.scripts.leases import hold_lease
+from dpds.storages.db.scripts.leases import lease_ranges
+
+
+class FakeConnection(object):
+    def __init__(self, renewals):
+        self.renewals = renewals
+
+    async def fetchval(self, query, *args):
+        return args[0] if self.renewals.pop(0) else None
+
+
+class FakePool(object):
+    def __init__(self, renewals):
+        self.conn = FakeConnection(renewals)
+
+    def acquire(self):
+        pool = self
+
+        class Acquire(object):
+            async def __aenter__(self):
+                return pool.conn
+
+            async def __aexit__(self, *exc):
+                return False
+
+        return Acquire()
+
+
+def run(coro):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+
+def test_lease_ranges_are_aligned():
+    assert lease_ranges([(5, 25)], 10) == [(0, 9), (10, 19), (20, 25)]
+
+
+def test_lease_ranges_merge_ranges_within_a_lease():
+    assert lease_ranges([(1, 3), (7, 8), (12, 12)], 10) == [(0, 8), (10, 12)]
+
+
+def test_hold_lease_renews_until_done():
+    renewals = [True, True, True, True]
+    result = run(hold_lease(FakePool(renewals), 0, 'owner',
+                            asyncio.sleep(0.05, result='done'),
+                            ttl=0.03))
+    assert result == 'done'
+    assert len(renewals) < 4
+
+
+def test_hold_lease_cancels_work_when_lost():
+    cancelled = []
+
+    async def work():
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    async def hold():
+        with pytest.raises(LeaseLost):
+            await hold_lease(FakePool([False]), 0, 'owner', work(), ttl=0.03)
+        await asyncio.sleep(0)
+
+    run(hold())
+    assert cancelled == [True]
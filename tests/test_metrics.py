@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+from dpds.storages.db.scripts.metrics import Counter
+from dpds.storages.db.scripts.metrics import Gauge
+from dpds.storages.db.scripts.metrics import Histogram
+from dpds.storages.db.scripts.metrics import Registry
+
+
+def test_render_counters_and_gauges():
+    registry = Registry()
+    counter = Counter('ops_total', 'Ops', ['operation_type'], registry=registry)
+    gauge = Gauge('depth', 'Depth', registry=registry)
+    counter.labels(operation_type='vote').inc(3)
+    counter.labels(operation_type='say "hi"').inc()
+    gauge.set_function(lambda: 7)
+    assert registry.render() == (
+        '# HELP ops_total Ops\n'
+        '# TYPE ops_total counter\n'
+        'ops_total{operation_type="say \\"hi\\""} 1\n'
+        'ops_total{operation_type="vote"} 3\n'
+        '# HELP depth Depth\n'
+        '# TYPE depth gauge\n'
+        'depth 7\n')
+
+
+def test_render_histogram_buckets_are_cumulative():
+    registry = Registry()
+    histogram = Histogram('latency_seconds', 'Latency', buckets=[0.1, 1],
+                          registry=registry)
+    for value in (0.05, 0.5, 5):
+        histogram.observe(value)
+    assert registry.render().splitlines()[2:] == [
+        'latency_seconds_bucket{le="0.1"} 1',
+        'latency_seconds_bucket{le="1"} 2',
+        'latency_seconds_bucket{le="+Inf"} 3',
+        'latency_seconds_sum 5.55',
+        'latency_seconds_count 3',
+    ]
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from dpds.storages.db.tables.partitions import create_partition_sql
+from dpds.storages.db.tables.partitions import missing_partitions
+from dpds.storages.db.tables.partitions import parse_partition_bound
+from dpds.storages.db.tables.partitions import partition_layout
+from dpds.storages.db.tables.partitions import partition_starts
+
+
+@pytest.mark.parametrize('start_block,end_block,width,expected', [
+    (1, 1, 100, [0]),
+    (99, 100, 100, [0, 100]),
+    (150, 420, 100, [100, 200, 300, 400]),
+])
+def test_partition_starts(start_block, end_block, width, expected):
+    assert partition_starts(start_block, end_block, width) == expected
+
+
+def test_parse_partition_bound():
+    assert parse_partition_bound(
+        'FOR VALUES FROM (0) TO (1000000)') == (0, 1000000)
+    assert parse_partition_bound('DEFAULT') is None
+
+
+def test_missing_partitions_uses_existing_width():
+    layout = partition_layout(
+        [('dpds_op_votes', 'FOR VALUES FROM (0) TO (100)'),
+         ('dpds_op_votes', 'FOR VALUES FROM (100) TO (200)')])
+    assert layout == {'dpds_op_votes': (100, {0, 100})}
+    assert missing_partitions(layout, 150, 320) == [('dpds_op_votes', 200, 100),
+                                                    ('dpds_op_votes', 300, 100)]
+
+
+def test_create_partition_sql():
+    assert create_partition_sql('dpds_op_votes', 200, 100) == (
+        'CREATE TABLE IF NOT EXISTS dpds_op_votes_p200 '
+        'PARTITION OF dpds_op_votes FOR VALUES FROM (200) TO (300)')
+
+
+def test_partitioned_keys_include_partition_key():
+    from sqlalchemy import UniqueConstraint
+    from sqlalchemy.dialects import postgresql
+    from sqlalchemy.schema import CreateTable
+
+    import dpds.storages.db.tables.block  # noqa: F401
+    import dpds.storages.db.tables.meta  # noqa: F401
+    import dpds.storages.db.tables.operations  # noqa: F401
+    from dpds.storages.db.tables import metadata
+    from dpds.storages.db.tables.partitions import PARTITIONED_TABLES
+    from dpds.storages.db.tables.partitions import partitioned_metadata
+
+    partitioned = partitioned_metadata(metadata)
+    for table_name in PARTITIONED_TABLES:
+        table = partitioned.tables[table_name]
+        ddl = str(CreateTable(table).compile(dialect=postgresql.dialect()))
+        assert 'PARTITION BY RANGE (block_num)' in ddl
+        unique_keys = [table.primary_key] + [
+            c for c in table.constraints if isinstance(c, UniqueConstraint)]
+        unique_keys += [index for index in table.indexes if index.unique]
+        for key in unique_keys:
+            assert 'block_num' in key.columns, (table_name, key)
+        if 'id' in table.primary_key.columns:
+            # the serial id keeps its sequence in the wider key
+            assert 'id SERIAL' in ddl
+    # the unpartitioned tables are left as they are
+    assert list(metadata.tables['dpds_op_virtual_author_rewards']
+                .primary_key.columns.keys()) == ['id']
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import json
+import os
+
+from dpds.http_client import AsyncDPayAPIClient
+from dpds.http_client import SimpleDPayAPIClient
+from dpds.response_cache import ResponseCache
+from dpds.response_cache import cache_key
+
+
+class FakeResponse(object):
+    status = 200
+    REDIRECT_STATUSES = ()
+
+    def __init__(self, data):
+        self.data = data
+
+
+def respond(call, last_irreversible_block_num):
+    if call['method'] == 'get_dynamic_global_properties':
+        result = {'last_irreversible_block_num': last_irreversible_block_num}
+    else:
+        result = {'block_num': call['params'][0], 'method': call['method']}
+    return {'id': call['id'], 'jsonrpc': '2.0', 'result': result}
+
+
+class FakeHttp(object):
+    """Answers get_block, get_ops_in_block and get_dynamic_global_properties
+    calls"""
+
+    def __init__(self, last_irreversible_block_num):
+        self.last_irreversible_block_num = last_irreversible_block_num
+        self.calls = []
+
+    def urlopen(self, method, url, body=None):
+        request = json.loads(body)
+        calls = request if isinstance(request, list) else [request]
+        self.calls.extend((call['method'], *call['params']) for call in calls)
+        responses = [respond(call, self.last_irreversible_block_num)
+                     for call in calls]
+        return FakeResponse(
+            json.dumps(responses if isinstance(request, list)
+                       else responses[0]).encode())
+
+
+def test_caches_irreversible_blocks(tmpdir):
+    cache = ResponseCache(str(tmpdir.join('cache.db')))
+    client = SimpleDPayAPIClient('http://dpayd', batch_size=10, cache=cache)
+    client.http = FakeHttp(last_irreversible_block_num=3)
+
+    results = [
+        result for result, _ in client.exec_multi('get_block', range(1, 6))]
+    assert [result['block_num'] for result in results] == [1, 2, 3, 4, 5]
+    assert client.http.calls[0] == ('get_dynamic_global_properties',)
+
+    # only the blocks above the last irreversible block are requested again
+    client.http.calls = []
+    again = [
+        result for result, _ in client.exec_multi('get_block', range(1, 6))]
+    assert again == results
+    assert client.http.calls == [('get_block', 4), ('get_block', 5)]
+    assert (cache.hits, cache.misses) == (3, 7)
+
+    # calls with other params are cached apart
+    client.http.calls = []
+    assert client.get_block(2) == results[1]
+    client.exec('get_ops_in_block', 2, False)
+    assert client.http.calls == [('get_ops_in_block', 2, False)]
+
+
+def test_evicts_oldest_results(tmpdir):
+    cache = ResponseCache(str(tmpdir.join('cache.db')), max_bytes=1000)
+    blocks = [json.dumps({'block_id': os.urandom(100).hex()}).encode()
+              for _ in range(20)]
+    for block_num, block in enumerate(blocks, 1):
+        cache.put_many([(cache_key('get_block', [block_num]), block)])
+    assert cache.size <= 1000
+    assert cache.get(cache_key('get_block', [1])) is None
+    assert cache.get(cache_key('get_block', [20])) == blocks[-1]
+
+    reopened = ResponseCache(cache.path, max_bytes=1000)
+    assert reopened.size == cache.size
+
+
+def test_async_client_answers_from_cache(tmpdir):
+    cache = ResponseCache(str(tmpdir.join('cache.db')))
+    cache.set_irreversible_block_num(10)
+    cache.put_many([(cache_key('get_block', [1]), b'{"block_id":"a"}')])
+
+    class FakeClient(AsyncDPayAPIClient):
+        def __init__(self):
+            super().__init__('http://dpayd', cache=cache)
+            self.posted = []
+
+        async def _post(self, body):
+            self.posted.append(json.loads(body))
+            return json.dumps(
+                [respond(call, 10) for call in json.loads(body)]).encode()
+
+    client = FakeClient()
+    loop = asyncio.new_event_loop()
+    try:
+        results = loop.run_until_complete(
+            client.batch(
+                [('get_block', 1), ('get_block', 2),
+                 ('get_ops_in_block', 2, False)]))
+    finally:
+        loop.close()
+    assert results == [{'block_id': 'a'},
+                       {'block_num': 2, 'method': 'get_block'},
+                       {'block_num': 2, 'method': 'get_ops_in_block'}]
+    assert [call['id'] for call in client.posted[0]] == [1, 2]
+    assert cache.get(cache_key('get_ops_in_block', [2, False])) is not None
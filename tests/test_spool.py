@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import os
+
+from dpds.storages.db.scripts.spool import Spool
+from dpds.storages.db.scripts.spool import decode_record
+from dpds.storages.db.scripts.spool import segment_filename
+
+
+def run(coro):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+
+def chunk(block_num):
+    return [[block_num, {'block_num': block_num}, []]]
+
+
+async def append_all(spool, block_nums):
+    return [await spool.append(chunk(block_num)) for block_num in block_nums]
+
+
+async def read_all(spool):
+    return [(seq, decode_record(payload))
+            async for seq, payload in spool.records()]
+
+
+def test_commit_advances_offset_over_stored_records(tmpdir):
+    spool = Spool(str(tmpdir), segment_bytes=1)
+
+    async def main():
+        assert await append_all(spool, [1, 2, 3]) == [0, 1, 2]
+        records = await read_all(spool)
+        assert [results[0][0] for _, results in records] == [1, 2, 3]
+        # stored out of order, the offset waits for record 0
+        await spool.commit(1)
+        assert spool.consumed == 0
+        await spool.commit(0)
+        assert spool.consumed == 2
+    run(main())
+
+    # one record per segment, the stored ones are deleted
+    assert sorted(f for f in os.listdir(str(tmpdir))
+                  if f.endswith('.seg')) == [segment_filename(2)]
+    spool.close()
+
+    reopened = Spool(str(tmpdir))
+    assert (reopened.consumed, reopened.next_seq, reopened.pending) == (2, 3, 1)
+    assert [(seq, results[0][0])
+            for seq, results in run(read_all(reopened))] == [(2, 3)]
+
+
+def test_torn_record_is_truncated(tmpdir):
+    spool = Spool(str(tmpdir))
+    run(append_all(spool, [1, 2]))
+    spool.close()
+    segment_path = str(tmpdir.join(segment_filename(0)))
+    with open(segment_path, 'r+b') as f:
+        f.truncate(os.path.getsize(segment_path) - 1)
+
+    reopened = Spool(str(tmpdir))
+    assert reopened.next_seq == 1
+    assert [results[0][0] for _, results in run(read_all(reopened))] == [1]
+    assert run(reopened.append(chunk(2))) == 1
+
+
+def test_records_follow_appends_while_writing(tmpdir):
+    spool = Spool(str(tmpdir))
+
+    async def produce():
+        await append_all(spool, [1, 2])
+        await spool.stop_writing()
+
+    async def main():
+        spool.writing = True
+        producer = asyncio.ensure_future(produce())
+        records = await read_all(spool)
+        await producer
+        return records
+
+    assert [seq for seq, _ in run(main())] == [0, 1]
+
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from dpds.utils import backoff_delay
+from dpds.utils import block_num_ranges
+from dpds.utils import fetched_prefix
+from dpds.utils import merge_ranges
+from dpds.utils import missing_ranges
+from dpds.utils import range_block_nums
+
+
+@pytest.mark.parametrize('ranges,expected', [
+    ([], []),
+    ([(1, 1)], [(1, 1)]),
+    ([(5, 7), (1, 2), (3, 4)], [(1, 7)]),
+    ([(10, 12), (11, 11), (1, 2)], [(1, 2), (10, 12)]),
+])
+def test_merge_ranges(ranges, expected):
+    assert merge_ranges(ranges) == expected
+
+
+def test_block_num_ranges():
+    assert block_num_ranges([3, 1, 2, 7, 9, 8, 2]) == [(1, 3), (7, 9)]
+
+
+@pytest.mark.parametrize('ranges,start,end,expected', [
+    ([], 1, 3, [(1, 3)]),
+    ([(1, 3)], 1, 3, []),
+    ([(1, 3), (7, 9)], 1, 12, [(4, 6), (10, 12)]),
+    ([(5, 20)], 1, 10, [(1, 4)]),
+    ([(1, 4)], 3, 6, [(5, 6)]),
+])
+def test_missing_ranges(ranges, start, end, expected):
+    assert missing_ranges(ranges, start, end) == expected
+
+
+def test_range_block_nums():
+    assert list(range_block_nums([(1, 2), (5, 6)])) == [1, 2, 5, 6]
+
+
+def test_fetched_prefix():
+    results = [(3, 'c', []), (1, 'a', []), (2, 'b', []), (5, 'e', [])]
+    assert fetched_prefix(results, [1, 2, 3, 4, 5]) == [
+        (1, 'a', []), (2, 'b', []), (3, 'c', [])]
+    assert fetched_prefix(results, [4, 5]) == []
+
+
+@pytest.mark.parametrize('attempt,max_delay', [
+    (1, 0.25),
+    (3, 1.0),
+    (20, 30.0),
+])
+def test_backoff_delay_is_capped(attempt, max_delay):
+    for _ in range(100):
+        assert 0 <= backoff_delay(attempt) <= max_delay
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+from dpds.storages.db.scripts.watermark import CommitWatermark
+
+
+def test_out_of_order_commits_wait_for_earlier_blocks():
+    watermark = CommitWatermark()
+    assert not watermark.commit(range(11, 21))
+    assert watermark.watermark == 0
+    assert watermark.buffered_ranges == [(11, 20)]
+    assert watermark.commit(range(1, 11))
+    assert watermark.watermark == 20
+    assert watermark.buffered_count == 0
+
+
+def test_failed_blocks_hold_the_watermark():
+    watermark = CommitWatermark(10)
+    watermark.commit([11, 12, 14, 15])
+    assert watermark.watermark == 12
+    assert watermark.buffered_ranges == [(14, 15)]
+    watermark.commit([13])
+    assert watermark.watermark == 15
+
+
+def test_blocks_committed_before_the_run_count():
+    # blocks 1-50 and 61-100 already stored, 51-60 missing
+    watermark = CommitWatermark(0, [(1, 50), (61, 100)])
+    assert watermark.watermark == 50
+    watermark.commit(range(51, 61))
+    assert watermark.watermark == 100
+
+
+def test_committed_ranges_not_joined_to_the_watermark_are_buffered():
+    watermark = CommitWatermark(10, [(21, 30)])
+    assert watermark.watermark == 10
+    assert watermark.buffered_count == 10